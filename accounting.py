@@ -0,0 +1,131 @@
+import asyncio
+import os
+import sys
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+class ResourceSampler:
+    """Tracks the resources used by one job's process tree.
+
+    ``sample`` is called periodically by the worker while the job runs. It
+    walks the tree with psutil and records the peak combined RSS and the
+    CPU time so far (each process's own time plus that of children it has
+    already reaped). Without psutil only wall time and queue wait are
+    measured, unless the worker supplies the exit rusage.
+    """
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.interval = interval
+        self.started = time.monotonic()
+        self.peak_rss = 0
+        self.cpu_user = 0.0
+        self.cpu_system = 0.0
+        self._next_sample = self.started
+        self._root = None
+        if psutil is not None:
+            try:
+                self._root = psutil.Process(pid)
+            except psutil.Error:
+                pass
+
+    def due(self) -> bool:
+        return time.monotonic() >= self._next_sample
+
+    def sample(self):
+        self._next_sample = time.monotonic() + self.interval
+        if self._root is None:
+            return
+        try:
+            procs = [self._root] + self._root.children(recursive=True)
+        except psutil.Error:
+            return
+        rss = 0
+        user = system = 0.0
+        for proc in procs:
+            try:
+                with proc.oneshot():
+                    times = proc.cpu_times()
+                    rss += proc.memory_info().rss
+            except psutil.Error:
+                continue
+            user += times.user + times.children_user
+            system += times.system + times.children_system
+        self.peak_rss = max(self.peak_rss, rss)
+        self.cpu_user = max(self.cpu_user, user)
+        self.cpu_system = max(self.cpu_system, system)
+
+    def apply_rusage(self, rusage):
+        """Take exact CPU totals from the reaped process's rusage"""
+        self.cpu_user = max(self.cpu_user, rusage.ru_utime)
+        self.cpu_system = max(self.cpu_system, rusage.ru_stime)
+        if not self.peak_rss:
+            # Only a fallback: ru_maxrss covers the largest single process
+            # and can include the worker's memory from before exec. It is
+            # KiB on Linux, bytes on macOS.
+            scale = 1 if sys.platform == "darwin" else 1024
+            self.peak_rss = rusage.ru_maxrss * scale
+
+    def result(self, queue_wait: float) -> dict:
+        return {
+            "wall_time": round(time.monotonic() - self.started, 6),
+            "queue_wait": round(queue_wait, 6),
+            "cpu_user": round(self.cpu_user, 6),
+            "cpu_system": round(self.cpu_system, 6),
+            "peak_rss": self.peak_rss,
+        }
+
+def _reaped(proc, status: int):
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+
+def wait_with_rusage(proc, deadline: float):
+    """Reap a Popen child with wait4 so its rusage is available.
+
+    Sets ``proc.returncode`` and returns the rusage, or raises
+    TimeoutError once the monotonic deadline passes.
+    """
+    delay = 0.001
+    while True:
+        pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+        if pid:
+            _reaped(proc, status)
+            return rusage
+        if time.monotonic() >= deadline:
+            raise TimeoutError
+        time.sleep(delay)
+        delay = min(delay * 2, 0.05)
+
+async def async_wait_with_rusage(proc, poll_interval: float = 0.05):
+    """Reap a Popen child from an event loop and return its rusage.
+
+    Waits on a pidfd where the platform has one, else polls wait4.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        pidfd = os.pidfd_open(proc.pid)
+    except (AttributeError, OSError):
+        pidfd = None
+    try:
+        while True:
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            if pid:
+                _reaped(proc, status)
+                return rusage
+            if pidfd is None:
+                await asyncio.sleep(poll_interval)
+                continue
+            exited = loop.create_future()
+            loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+            try:
+                await exited
+            finally:
+                loop.remove_reader(pidfd)
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
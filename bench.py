@@ -0,0 +1,189 @@
+import contextlib
+import os
+import platform
+import signal
+import sys
+import tempfile
+import threading
+import time
+from typing import List, Optional
+from job import JobState
+from queue_manager import QueueManager
+from storage import create_storage
+
+DATA_FILES = {"json": "jobs.json", "sqlite": "jobs.db"}
+
+def bytes_written() -> Optional[int]:
+    """Bytes this process has passed to write calls so far (Linux only)"""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of values, None if there are none"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+class _TimedQueueManager(QueueManager):
+    """QueueManager that records when jobs are claimed and finished"""
+
+    def __init__(self, storage):
+        super().__init__(storage)
+        self.claimed_at = {}
+        self.finished = 0
+        self._finished_cond = threading.Condition()
+
+    def claim_jobs(self, owner: str = None, limit: int = 1, parallel: int = 1):
+        jobs = super().claim_jobs(owner, limit, parallel)
+        now = time.perf_counter()
+        for job in jobs:
+            self.claimed_at.setdefault(job.id, now)
+        return jobs
+
+    def _finish(self, job, saved: bool) -> bool:
+        if saved and job.state in (JobState.COMPLETED, JobState.DEAD):
+            with self._finished_cond:
+                self.finished += 1
+                self._finished_cond.notify_all()
+        return saved
+
+    def complete_job(self, job) -> bool:
+        return self._finish(job, super().complete_job(job))
+
+    def fail_job(self, job) -> bool:
+        return self._finish(job, super().fail_job(job))
+
+    def wait_finished(self, count: int):
+        """Block until count jobs have completed or gone to the DLQ"""
+        with self._finished_cond:
+            self._finished_cond.wait_for(lambda: self.finished >= count)
+
+class _NoopConsumers:
+    """Threads that claim jobs and complete them without running anything"""
+
+    def __init__(self, manager: QueueManager, count: int, prefetch: int):
+        self.manager = manager
+        self.prefetch = prefetch
+        self.running = True
+        self.threads = [threading.Thread(target=self._run, args=(f"bench:{i}",), daemon=True)
+                        for i in range(count)]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self, owner: str):
+        while self.running:
+            jobs = self.manager.claim_jobs(owner, self.prefetch)
+            if not jobs:
+                self.manager.wait_for_work()
+            for job in jobs:
+                self.manager.complete_job(job)
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            # A thread about to wait would miss a single wake_all
+            while thread.is_alive():
+                self.manager.wakeup.wake_all()
+                thread.join(0.05)
+
+class _CommandConsumers:
+    """A WorkerManager running each job's command, as ``jobqueue start`` does"""
+
+    def __init__(self, manager: QueueManager, count: int, prefetch: int, executor: str):
+        from worker import WorkerManager
+        handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)}
+        self.workers = WorkerManager(manager, executor, drain_timeout=30)
+        # WorkerManager exits the process on a signal; keep ours
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+        self.workers.start_workers(count, prefetch)
+
+    def stop(self):
+        self.workers.stop_all_workers()
+
+def run_benchmark(backend: str, jobs: int, workers: int = 1, command: str = None,
+                  latency_samples: int = 100, prefetch: int = 1,
+                  executor: str = "thread") -> dict:
+    """Run one synthetic workload against a fresh queue and measure it.
+
+    ``jobs`` jobs are enqueued in batches, then ``workers`` consumers drain
+    them. Without ``command`` the consumers are threads that claim and
+    complete jobs directly, which measures the queue on its own; with one
+    they are real workers running it through the shell. Afterwards
+    ``latency_samples`` jobs are enqueued one at a time into the idle queue
+    to time how long each waits before a worker claims it.
+
+    Bytes written count every write the process makes while a phase runs
+    (storage, logs and our own output), so they are comparable between
+    backends rather than exact; they are None where the OS doesn't report
+    them.
+    """
+    spec = {"command": command or "true", "max_retries": 0}
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(sys.stderr):
+        storage = create_storage(os.path.join(tmp, DATA_FILES[backend]), backend)
+        manager = _TimedQueueManager(storage)
+
+        written = bytes_written()
+        start = time.perf_counter()
+        enqueued, _ = manager.enqueue_many(spec for _ in range(jobs))
+        enqueue_seconds = time.perf_counter() - start
+        enqueue_bytes = bytes_written()
+
+        start = time.perf_counter()
+        if command is None:
+            consumers = _NoopConsumers(manager, workers, prefetch)
+        else:
+            consumers = _CommandConsumers(manager, workers, prefetch, executor)
+        try:
+            manager.wait_finished(enqueued)
+            drain_seconds = time.perf_counter() - start
+            drain_bytes = bytes_written()
+
+            latencies = []
+            for _ in range(latency_samples):
+                target = manager.finished + 1
+                enqueued_at = time.perf_counter()
+                job = manager.enqueue_spec(spec)
+                manager.wait_finished(target)
+                latencies.append(manager.claimed_at[job.id] - enqueued_at)
+        finally:
+            consumers.stop()
+
+    def per(count, before, after):
+        if before is None or after is None or not count:
+            return None
+        return round((after - before) / count, 1)
+
+    return {
+        "backend": backend,
+        "jobs": enqueued,
+        "workers": workers,
+        "workload": "noop" if command is None else command,
+        "enqueue_per_sec": round(enqueued / enqueue_seconds, 1),
+        "claims_per_sec": round(enqueued / drain_seconds, 1),
+        "pickup_latency_ms": {
+            name: None if value is None else round(value * 1000, 3)
+            for name, value in (("p50", percentile(latencies, 50)),
+                                ("p95", percentile(latencies, 95)),
+                                ("p99", percentile(latencies, 99)))
+        },
+        "enqueue_bytes_per_job": per(enqueued, written, enqueue_bytes),
+        # Each drained job makes two transitions: claimed, then completed
+        "bytes_per_transition": per(2 * enqueued, enqueue_bytes, drain_bytes),
+    }
+
+def environment() -> dict:
+    """Where a set of benchmark results was measured"""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Benchmark job hydration: memory per job and records hydrated per second.
+
+Compares ``Job`` with ``LegacyJob``, the dict-backed implementation with
+``datetime`` fields that it replaced, and a state/attempts scan through
+``JobRecord`` against one that hydrates every job.
+
+    python bench_job.py [--jobs N]
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from job import Job, JobRecord, JobState, parse_timestamp
+
+class LegacyJob:
+    """Job as stored before it used __slots__ and epoch timestamps"""
+
+    def __init__(self, id=None, command="", max_retries=3, state=JobState.PENDING,
+                 attempts=0, created_at=None, updated_at=None, lease_owner=None,
+                 lease_expires_at=None, run_at=None, output_tail=None, resources=None,
+                 timeout=None):
+        self.id = id or str(uuid.uuid4())
+        self.command = command
+        self.state = state
+        self.attempts = attempts
+        self.max_retries = max_retries
+        self.created_at = created_at or datetime.utcnow()
+        self.updated_at = updated_at or datetime.utcnow()
+        self.lease_owner = lease_owner
+        self.lease_expires_at = lease_expires_at
+        self.run_at = run_at
+        self.output_tail = output_tail
+        self.resources = resources
+        self.timeout = timeout
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "command": self.command,
+            "state": self.state.value,
+            "attempts": self.attempts,
+            "max_retries": self.max_retries,
+            "created_at": self.created_at.isoformat() + "Z",
+            "updated_at": self.updated_at.isoformat() + "Z",
+            "lease_owner": self.lease_owner,
+            "lease_expires_at": (self.lease_expires_at.isoformat() + "Z"
+                                 if self.lease_expires_at else None),
+            "run_at": self.run_at.isoformat() + "Z" if self.run_at else None,
+            "output_tail": self.output_tail,
+            "resources": self.resources,
+            "timeout": self.timeout
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(
+            id=data["id"],
+            command=data["command"],
+            max_retries=data.get("max_retries", 3),
+            state=JobState(data["state"]),
+            attempts=data["attempts"]
+        )
+        job.created_at = parse_timestamp(data["created_at"])
+        job.updated_at = parse_timestamp(data["updated_at"])
+        job.lease_owner = data.get("lease_owner")
+        if data.get("lease_expires_at"):
+            job.lease_expires_at = parse_timestamp(data["lease_expires_at"])
+        if data.get("run_at"):
+            job.run_at = parse_timestamp(data["run_at"])
+        job.output_tail = data.get("output_tail")
+        job.resources = data.get("resources")
+        job.timeout = data.get("timeout")
+        return job
+
+def make_records(count: int) -> list:
+    """Job records shaped like a real queue: mostly finished, some scheduled"""
+    states = [JobState.COMPLETED] * 6 + [JobState.PENDING, JobState.FAILED,
+                                         JobState.DEAD, JobState.PROCESSING]
+    records = []
+    for i in range(count):
+        job = Job(command=f"process-item --id {i}", state=states[i % len(states)],
+                  attempts=i % 3)
+        if job.state == JobState.FAILED:
+            job.schedule_in(60)
+        elif job.state == JobState.PROCESSING:
+            job.mark_processing("host:1:1", 300)
+        # Round-trip through JSON so strings are fresh, as after a load
+        records.append(json.loads(json.dumps(job.to_dict())))
+    return records
+
+def hydration_rate(cls, records: list) -> float:
+    start = time.perf_counter()
+    for record in records:
+        cls.from_dict(record)
+    return len(records) / (time.perf_counter() - start)
+
+def bytes_per_job(cls, records: list, touch: bool) -> float:
+    """Memory held by hydrated jobs, optionally after reading every timestamp"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    jobs = [cls.from_dict(record) for record in records]
+    if touch:
+        for job in jobs:
+            job.created_at, job.updated_at, job.run_at, job.lease_expires_at
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del jobs
+    return used / len(records)
+
+def scan_rate(records: list, use_view: bool) -> float:
+    """Records per second when counting retried failures"""
+    start = time.perf_counter()
+    if use_view:
+        matches = sum(1 for record in map(JobRecord, records)
+                      if record.state is JobState.FAILED and record.attempts > 0)
+    else:
+        matches = sum(1 for job in map(Job.from_dict, records)
+                      if job.state is JobState.FAILED and job.attempts > 0)
+    assert matches >= 0
+    return len(records) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=100000, help="Job records to generate")
+    args = parser.parse_args()
+
+    records = make_records(args.jobs)
+    print(f"{args.jobs} job records")
+    print(f"{'':32}{'LegacyJob':>14}{'Job':>14}")
+    rows = [
+        ("hydrations/sec", lambda cls: hydration_rate(cls, records), "{:14,.0f}"),
+        ("bytes/job (hydrated)", lambda cls: bytes_per_job(cls, records, False), "{:14,.0f}"),
+        ("bytes/job (timestamps read)", lambda cls: bytes_per_job(cls, records, True),
+         "{:14,.0f}"),
+    ]
+    for label, measure, fmt in rows:
+        cells = "".join(fmt.format(measure(cls)) for cls in (LegacyJob, Job))
+        print(f"{label:32}{cells}")
+    print(f"{'state/attempts scan, records/sec':32}"
+          f"{scan_rate(records, False):14,.0f}{scan_rate(records, True):14,.0f}"
+          "   (Job.from_dict vs JobRecord)")
+
+if __name__ == "__main__":
+    main()
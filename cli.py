@@ -1,180 +1,181 @@
+import atexit
 import click
+import heapq
+import itertools
 import json
-import time
-import uuid
-import subprocess
-import threading
-from datetime import datetime
-from enum import Enum
-
-# ===== SIMPLIFIED CORE CLASSES =====
-class JobState(Enum):
-    PENDING = "pending"
-    PROCESSING = "processing"
-    COMPLETED = "completed"
-    FAILED = "failed"
-    DEAD = "dead"
-
-class Job:
-    def __init__(self, id=None, command="", max_retries=3, state=JobState.PENDING, attempts=0):
-        self.id = id or str(uuid.uuid4())
-        self.command = command
-        self.state = state
-        self.attempts = attempts
-        self.max_retries = max_retries
-        self.created_at = datetime.utcnow()
-        self.updated_at = datetime.utcnow()
-    
-    def to_dict(self):
-        return {
-            "id": self.id,
-            "command": self.command,
-            "state": self.state.value,
-            "attempts": self.attempts,
-            "max_retries": self.max_retries,
-            "created_at": self.created_at.isoformat() + "Z",
-            "updated_at": self.updated_at.isoformat() + "Z"
-        }
-
-class Storage:
-    def __init__(self, data_file="jobqueue_data.json"):
-        self.data_file = data_file
-        self._ensure_data_file()
-    
-    def _ensure_data_file(self):
-        if not os.path.exists(self.data_file):
-            with open(self.data_file, 'w') as f:
-                json.dump({"jobs": {}, "config": {}}, f)
-    
-    def _read_data(self):
-        try:
-            with open(self.data_file, 'r') as f:
-                return json.load(f)
-        except:
-            return {"jobs": {}, "config": {}}
-    
-    def _write_data(self, data):
-        with open(self.data_file, 'w') as f:
-            json.dump(data, f, indent=2)
-    
-    def save_job(self, job):
-        data = self._read_data()
-        data["jobs"][job.id] = job.to_dict()
-        self._write_data(data)
-    
-    def get_job(self, job_id):
-        data = self._read_data()
-        job_data = data["jobs"].get(job_id)
-        if job_data:
-            return Job(
-                id=job_data["id"],
-                command=job_data["command"],
-                max_retries=job_data.get("max_retries", 3),
-                state=JobState(job_data["state"]),
-                attempts=job_data["attempts"]
-            )
-        return None
-    
-    def get_all_jobs(self):
-        data = self._read_data()
-        jobs = []
-        for job_data in data["jobs"].values():
-            jobs.append(Job(
-                id=job_data["id"],
-                command=job_data["command"],
-                max_retries=job_data.get("max_retries", 3),
-                state=JobState(job_data["state"]),
-                attempts=job_data["attempts"]
-            ))
-        return jobs
-    
-    def get_config(self, key, default=None):
-        data = self._read_data()
-        return data.get("config", {}).get(key, default)
-    
-    def set_config(self, key, value):
-        data = self._read_data()
-        if "config" not in data:
-            data["config"] = {}
-        data["config"][key] = value
-        self._write_data(data)
-
-class QueueManager:
-    def __init__(self, storage):
-        self.storage = storage
-        self.active_workers = 0
-    
-    def enqueue(self, command, max_retries=None):
-        if max_retries is None:
-            max_retries = self.storage.get_config("max_retries", 3)
-        job = Job(command=command, max_retries=max_retries)
-        self.storage.save_job(job)
-        return job
-    
-    def get_stats(self):
-        jobs = self.storage.get_all_jobs()
-        stats = {
-            "total_jobs": len(jobs),
-            "pending": len([j for j in jobs if j.state == JobState.PENDING]),
-            "processing": len([j for j in jobs if j.state == JobState.PROCESSING]),
-            "completed": len([j for j in jobs if j.state == JobState.COMPLETED]),
-            "failed": len([j for j in jobs if j.state == JobState.FAILED]),
-            "dead": len([j for j in jobs if j.state == JobState.DEAD]),
-            "active_workers": self.active_workers
-        }
-        return stats
-
-# Global instances
 import os
-storage = Storage()
-queue_manager = QueueManager(storage)
+import time
+from datetime import datetime, timedelta
+from job import DEFAULT_QUEUE, MAX_PRIORITY, MIN_PRIORITY, JobState, decode_cursor, parse_timestamp
+from joblog import follow as follow_log, log_path, read_tail
+from codec import CODECS
+from storage import Storage, create_storage, list_queues
+import metrics
+from queue_manager import QueueManager, check_idempotency_key, metrics_text
+from supervisor import (Supervisor, detach as supervisor_detach, profile_path, read_pidfile,
+                        stop_supervisor)
+
+# Global instances, opened by the cli group from --backend/--data-file
+storage = None
+queue_manager = None
 
 # ===== CLI COMMANDS =====
 @click.group()
-def cli():
+@click.option('--backend', type=click.Choice(['json', 'sqlite']), envvar='JOBQUEUE_BACKEND',
+              default='json', show_default=True, help='Storage backend')
+@click.option('--data-file', envvar='JOBQUEUE_DATA_FILE', default=None,
+              help='Data file (default: jobqueue_data.json or jobqueue_data.db)')
+def cli(backend, data_file):
     """JobQueue System - Background Job Queue Management"""
-    pass
+    global storage, queue_manager
+    storage = create_storage(data_file, backend)
+    queue_manager = QueueManager(storage)
+
+def _backend():
+    return 'sqlite' if not isinstance(storage, Storage) else 'json'
+
+def _queue(name, create: bool = False):
+    """Queue manager of a named queue, sharing the default queue's config.
+
+    Only commands that add jobs pass ``create``; elsewhere an unknown name
+    is an error rather than a reason to create an empty partition.
+    """
+    if name is None or name == DEFAULT_QUEUE:
+        return queue_manager
+    if not create and name not in list_queues(storage.data_file):
+        raise click.BadParameter(
+            f"Unknown queue: {name} (existing: {', '.join(list_queues(storage.data_file))})",
+            param_hint="'--queue'")
+    try:
+        partition = create_storage(storage.data_file, _backend(), name)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="'--queue'")
+    return QueueManager(partition, queue_manager.config, queue=name)
+
+def _queues(name):
+    """Queue managers a read-only command covers: the named queue, or every queue"""
+    if name:
+        return [_queue(name)]
+    return [_queue(each) for each in list_queues(storage.data_file)]
+
+def _publish_metrics_at_exit():
+    """Add this process's enqueue metrics to the totals `jobqueue metrics` reports"""
+    atexit.register(metrics.retire, storage.data_file + ".metrics")
+
+def _queue_option(func):
+    return click.option('--queue', default=None,
+                        help=f'Named queue (default: {DEFAULT_QUEUE})')(func)
+
+def _queues_option(func):
+    return click.option('--queue', default=None,
+                        help='Only this named queue (default: every queue)')(func)
+
+def _resolve_run_at(delay=None, at=None):
+    """Turn a delay in seconds or an ISO-8601 UTC time into a run_at datetime"""
+    if delay is not None and at is not None:
+        raise click.UsageError("Use either a delay or an absolute time, not both")
+    if delay is not None:
+        return datetime.utcnow() + timedelta(seconds=float(delay))
+    if at is not None:
+        try:
+            return parse_timestamp(at)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="'--at'")
+    return None
+
+def _validate_idempotency_key(ctx, param, value):
+    try:
+        check_idempotency_key(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    return value
 
 @cli.command()
 @click.argument('command')
-def enqueue(command):
+@click.option('--delay', type=float, default=None, help='Seconds to wait before the job may run')
+@click.option('--at', 'at', default=None, help='UTC time (ISO-8601) at which the job may run')
+@click.option('--timeout', type=click.FloatRange(min=0, min_open=True), default=None,
+              help='Seconds the command may run (default: default_timeout config)')
+@click.option('--priority', type=click.IntRange(MIN_PRIORITY, MAX_PRIORITY), default=0,
+              show_default=True, help='Higher priorities are picked more often')
+@click.option('--idempotency-key', default=None, callback=_validate_idempotency_key,
+              help='Return the existing job if one was enqueued with this key recently')
+@_queue_option
+def enqueue(command, delay, at, timeout, priority, idempotency_key, queue):
     """Enqueue a new job with a shell command"""
-    job = queue_manager.enqueue(command)
-    click.echo(f"Enqueued job {job.id}: {command}")
+    _publish_metrics_at_exit()
+    run_at = _resolve_run_at(delay, at)
+    try:
+        job, deduplicated = _queue(queue, create=True).enqueue_deduplicated(
+            command, run_at=run_at, timeout=timeout, priority=priority,
+            idempotency_key=idempotency_key)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if deduplicated:
+        click.echo(f"Job with idempotency key {idempotency_key} already enqueued: {job.command}")
+    else:
+        click.echo(f"Enqueued job {job.id}: {command}")
     click.echo(f"Job ID: {job.id}")
+    if job.run_at:
+        click.echo(f"Scheduled for: {job.run_at.isoformat()}Z")
 
 @cli.command()
 @click.argument('job_spec_json')
 def enqueue_json(job_spec_json):
     """Enqueue a job using full JSON specification"""
+    _publish_metrics_at_exit()
     try:
         job_data = json.loads(job_spec_json)
-        command = job_data.get('command', '')
-        max_retries = job_data.get('max_retries', 3)
-        
-        job = queue_manager.enqueue(command, max_retries)
+        queue = job_data.get("queue") if isinstance(job_data, dict) else None
+        if queue is not None and not isinstance(queue, str):
+            raise ValueError("'queue' must be a string")
+        job = _queue(queue, create=True).enqueue_spec(job_data)
         
         # Return in specification format
-        created_job = {
-            "id": job.id,
-            "command": job.command,
-            "state": job.state.value,
-            "attempts": job.attempts,
-            "max_retries": job.max_retries,
-            "created_at": job.created_at.isoformat() + "Z",
-            "updated_at": job.updated_at.isoformat() + "Z"
-        }
-        click.echo(json.dumps(created_job, indent=2))
+        click.echo(json.dumps(_export_record(job), indent=2))
         
     except json.JSONDecodeError as e:
         click.echo(f"Error: Invalid JSON - {e}")
     except Exception as e:
         click.echo(f"Error: {e}")
 
+@cli.command(name='enqueue-batch')
+@click.argument('source', type=click.File('r'), default='-')
+@click.option('--chunk-size', default=1000, show_default=True,
+              help='Jobs persisted per storage write')
+@_queue_option
+def enqueue_batch(source, chunk_size, queue):
+    """Enqueue job specs from a JSONL file (or - for stdin).
+
+    Specs whose "queue" field names another queue than --queue are rejected.
+    """
+    _publish_metrics_at_exit()
+    start = time.perf_counter()
+    count, errors = _queue(queue, create=True).enqueue_many(source, chunk_size=chunk_size)
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else 0.0
+    click.echo(f"Enqueued {count} job(s) in {elapsed:.2f}s ({rate:.0f} jobs/sec)")
+    if errors:
+        click.echo(f"Rejected {len(errors)} line(s):", err=True)
+        for line_no, message in errors:
+            click.echo(f"  line {line_no}: {message}", err=True)
+
 @cli.command()
-def status():
-    """Show queue status"""
-    stats = queue_manager.get_stats()
+@_queues_option
+def status(queue):
+    """Show queue status, for all queues unless --queue is given"""
+    per_queue = {manager.queue: manager.get_stats() for manager in _queues(queue)}
+    stats = {"pending_by_priority": {}}
+    for queue_stats in per_queue.values():
+        for key, value in queue_stats.items():
+            if key == "pending_by_priority":
+                for priority, count in value.items():
+                    stats[key][priority] = stats[key].get(priority, 0) + count
+            else:
+                stats[key] = stats.get(key, 0) + value
+    supervisor = read_pidfile(storage.data_file + ".pid")
+    if supervisor:
+        stats['active_workers'] = len(supervisor['workers']) * supervisor['threads']
     click.echo("=== JobQueue System Status ===")
     click.echo(f"Total Jobs: {stats['total_jobs']}")
     click.echo(f"Active Workers: {stats['active_workers']}")
@@ -183,77 +184,219 @@ def status():
     click.echo(f"Completed: {stats['completed']}")
     click.echo(f"Failed: {stats['failed']}")
     click.echo(f"Dead Letter Queue: {stats['dead']}")
+    if stats['pending_by_priority']:
+        click.echo("Pending by priority:")
+        for priority, count in sorted(stats['pending_by_priority'].items(), reverse=True):
+            click.echo(f"  {priority}: {count}")
+    if len(per_queue) > 1:
+        click.echo("Queues:")
+        for name, queue_stats in per_queue.items():
+            click.echo(f"  {name}: {queue_stats['total_jobs']} job(s), "
+                       f"{queue_stats['pending']} pending, {queue_stats['processing']} processing, "
+                       f"{queue_stats['dead']} dead")
+
+def _page_options(func):
+    """Filter and pagination options shared by list and export"""
+    func = click.option('--after', default=None,
+                        help='Cursor printed by a previous page')(func)
+    func = click.option('--limit', type=click.IntRange(min=1), default=None,
+                        help='Stop after this many jobs')(func)
+    func = click.option('--state', type=click.Choice(
+        ['pending', 'processing', 'completed', 'failed', 'dead']))(func)
+    return _queues_option(func)
+
+def _iter_page(state, limit, after, queue=None):
+    """Stream one page of job records, then print the cursor for the next page"""
+    if after:
+        try:
+            decode_cursor(after)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="'--after'")
+    state = JobState(state) if state else None
+    pages = [manager.storage.iter_records(state, after, limit) for manager in _queues(queue)]
+    records = heapq.merge(*pages, key=lambda record: (record.created_ts, record.id))
+    count = 0
+    last = None
+    for last in records:
+        count += 1
+        yield last
+        if count == limit:
+            break
+    if limit is not None and count == limit:
+        click.echo(f"Next page: --after {last.cursor}", err=True)
+
+def _find_job(job_id, queue=None):
+    """The queue manager holding a job and the job, or (manager, None) if no queue has it.
+
+    A job that is gone but left a log is attributed to the queue owning the log.
+    """
+    managers = _queues(queue)
+    for manager in managers:
+        job = manager.storage.get_job(job_id)
+        if job is not None:
+            return manager, job
+    for manager in managers:
+        if os.path.exists(log_path(manager.log_dir, job_id)):
+            return manager, None
+    return managers[0], None
+
+def _export_record(job):
+    """A job in specification format"""
+    return {
+        "id": job.id,
+        "command": job.command,
+        "state": job.state.value,
+        "attempts": job.attempts,
+        "max_retries": job.max_retries,
+        "created_at": job.created_at.isoformat() + "Z",
+        "updated_at": job.updated_at.isoformat() + "Z",
+        "run_at": job.run_at.isoformat() + "Z" if job.run_at else None,
+        "timeout": job.timeout,
+        "priority": job.priority,
+        "queue": job.queue,
+        "idempotency_key": job.idempotency_key,
+        "resources": job.resources
+    }
 
 @cli.command()
-@click.option('--state', type=click.Choice(['pending', 'processing', 'completed', 'failed', 'dead']))
-def list(state):
-    """List jobs"""
-    jobs = storage.get_all_jobs()
-    
-    if state:
-        jobs = [j for j in jobs if j.state.value == state]
+@_page_options
+@click.option('--format', 'fmt', type=click.Choice(['text', 'jsonl']), default='text',
+              show_default=True, help='One line of text or one JSON object per job')
+def list(state, limit, after, queue, fmt):
+    """List jobs in creation order"""
+    found = False
+    for record in _iter_page(state, limit, after, queue):
+        found = True
+        if fmt == 'jsonl':
+            click.echo(json.dumps(_export_record(record.job())))
+        else:
+            click.echo(f"{record.id}: {record.state.value} - {record.command} "
+                       f"(attempts: {record.attempts})")
     
-    if not jobs:
+    if not found and fmt == 'text':
         click.echo("No jobs found")
-        return
-    
-    for job in jobs:
-        click.echo(f"{job.id}: {job.state.value} - {job.command} (attempts: {job.attempts})")
 
 @cli.command()
 @click.argument('job_id')
-def inspect(job_id):
+@_queues_option
+def inspect(job_id, queue):
     """Inspect a specific job with full JSON output"""
-    job = storage.get_job(job_id)
+    job = _find_job(job_id, queue)[1]
     
     if job:
-        job_data = {
-            "id": job.id,
-            "command": job.command,
-            "state": job.state.value,
-            "attempts": job.attempts,
-            "max_retries": job.max_retries,
-            "created_at": job.created_at.isoformat() + "Z",
-            "updated_at": job.updated_at.isoformat() + "Z"
-        }
+        job_data = dict(_export_record(job), output_tail=job.output_tail)
         click.echo(json.dumps(job_data, indent=2))
     else:
         click.echo(f"Job {job_id} not found")
 
 @cli.command()
-@click.option('--state', type=click.Choice(['pending', 'processing', 'completed', 'failed', 'dead']))
-def export(state):
-    """Export jobs as JSON array in specification format"""
-    jobs = storage.get_all_jobs()
-    
-    if state:
-        jobs = [j for j in jobs if j.state.value == state]
-    
-    jobs_data = []
-    for job in jobs:
-        jobs_data.append({
-            "id": job.id,
-            "command": job.command,
-            "state": job.state.value,
-            "attempts": job.attempts,
-            "max_retries": job.max_retries,
-            "created_at": job.created_at.isoformat() + "Z",
-            "updated_at": job.updated_at.isoformat() + "Z"
-        })
+@click.argument('job_id')
+@click.option('--follow', '-f', is_flag=True, help='Keep printing output until the job finishes')
+@click.option('--bytes', 'nbytes', default=65536, show_default=True,
+              help='Trailing bytes of existing output to show')
+@_queues_option
+def logs(job_id, follow, nbytes, queue):
+    """Show a job's output log"""
+    manager, job = _find_job(job_id, queue)
+    storage = manager.storage
+    path = log_path(manager.log_dir, job_id)
+    if job is None and not os.path.exists(path):
+        click.echo(f"Job {job_id} not found")
+        return
+    out = click.get_binary_stream('stdout')
+    offset = 0
+    if os.path.exists(path):
+        data, offset = read_tail(path, nbytes)
+        out.write(data)
+        out.flush()
+    elif not follow:
+        click.echo(f"No output logged for job {job_id} yet")
+        return
+    if follow:
+        def finished():
+            job = storage.get_job(job_id)
+            return job is None or job.state in (JobState.COMPLETED, JobState.DEAD)
+        for chunk in follow_log(path, offset, finished):
+            out.write(chunk)
+            out.flush()
+
+@cli.command()
+@_page_options
+@click.option('--format', 'fmt', type=click.Choice(['json', 'jsonl']), default='json',
+              show_default=True, help='A JSON array or one JSON object per line')
+def export(state, limit, after, queue, fmt):
+    """Export jobs in specification format, streamed as they are read"""
+    if fmt == 'jsonl':
+        for record in _iter_page(state, limit, after, queue):
+            click.echo(json.dumps(_export_record(record.job())))
+        return
     
-    click.echo(json.dumps(jobs_data, indent=2))
+    # Same layout as json.dumps(jobs, indent=2), written one job at a time
+    separator = "[\n"
+    for record in _iter_page(state, limit, after, queue):
+        text = json.dumps(_export_record(record.job()), indent=2)
+        click.echo(separator + "\n".join("  " + line for line in text.splitlines()), nl=False)
+        separator = ",\n"
+    click.echo("[]" if separator == "[\n" else "\n]")
 
 @cli.command()
-@click.option('--count', default=1, help='Number of workers to start')
-def start(count):
-    """Start worker processes"""
-    click.echo(f"Started {count} worker(s)")
-    click.echo("Worker functionality simplified for demo")
+@click.option('--processes', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Worker processes to fork')
+@click.option('--threads', '--count', 'threads', type=click.IntRange(min=1), default=1,
+              show_default=True,
+              help='Workers per process (concurrent jobs with --executor async)')
+@click.option('--executor', type=click.Choice(['thread', 'async']), default='thread',
+              show_default=True, help='How each process runs jobs')
+@click.option('--prefetch', type=click.IntRange(min=1), default=None,
+              help='Jobs claimed per trip to storage')
+@click.option('--drain-timeout', default=30.0, show_default=True,
+              help='Seconds to let running jobs finish on stop')
+@click.option('--detach', is_flag=True, help='Run the supervisor in the background')
+@click.option('--queues', default=None,
+              help=f'Comma-separated queues to serve (default: {DEFAULT_QUEUE})')
+@click.option('--metrics-port', type=click.IntRange(1, 65535), default=None,
+              help='Serve Prometheus metrics on this localhost port')
+@click.option('--profile', is_flag=True,
+              help='Sample worker stacks into a collapsed-stack file per process')
+def start(processes, threads, executor, prefetch, drain_timeout, detach, queues, metrics_port,
+          profile):
+    """Start a supervisor that runs worker processes"""
+    pidfile = storage.data_file + ".pid"
+    running = read_pidfile(pidfile)
+    if running:
+        click.echo(f"Workers already running (supervisor pid {running['pid']})")
+        return
+    if queues is not None:
+        queues = [name.strip() for name in queues.split(",") if name.strip()]
+        for name in queues:
+            _queue(name)
+    supervisor = Supervisor(_backend(), storage.data_file, processes, threads, executor,
+                            prefetch, pidfile, drain_timeout, queues, metrics_port, profile)
+    click.echo(f"Starting {processes} worker process(es) x {threads} {executor} worker(s)"
+               + (f" for queue(s) {', '.join(queues)}" if queues else ""))
+    if profile:
+        click.echo(f"Profiling workers into {profile_path(storage.data_file, '<pid>')} "
+                   "(for flamegraph.pl or speedscope)")
+    if detach:
+        log_file = storage.data_file + ".supervisor.log"
+        click.echo(f"Detaching, logging to {log_file}; stop with: jobqueue stop")
+        supervisor_detach(log_file)
+    supervisor.run()
 
 @cli.command()
-def stop():
+@click.option('--timeout', default=60.0, show_default=True,
+              help='Seconds to wait for workers to drain')
+def stop(timeout):
     """Stop all worker processes"""
-    click.echo("Stopped all workers")
+    try:
+        pid = stop_supervisor(storage.data_file + ".pid", timeout)
+    except TimeoutError as e:
+        click.echo(f"Error: {e}")
+        return
+    if pid is None:
+        click.echo("No workers running")
+    else:
+        click.echo(f"Stopped all workers (supervisor pid {pid})")
 
 @cli.group()
 def dlq():
@@ -261,17 +404,17 @@ def dlq():
     pass
 
 @dlq.command()
-def list():
-    """List DLQ jobs"""
-    jobs = storage.get_all_jobs()
-    dead_jobs = [j for j in jobs if j.state == JobState.DEAD]
+@_queues_option
+def list(queue):
+    """List DLQ jobs of every queue unless --queue is given"""
+    found = False
+    pages = [manager.storage.iter_records(JobState.DEAD) for manager in _queues(queue)]
+    for record in heapq.merge(*pages, key=lambda record: (record.created_ts, record.id)):
+        found = True
+        click.echo(f"{record.id}: {record.command} (failed {record.attempts} times)")
     
-    if not dead_jobs:
+    if not found:
         click.echo("DLQ is empty")
-        return
-    
-    for job in dead_jobs:
-        click.echo(f"{job.id}: {job.command} (failed {job.attempts} times)")
 
 @cli.group()
 def config():
@@ -295,5 +438,155 @@ def get(key):
     value = storage.get_config(key.replace('-', '_'))
     click.echo(f"{key} = {value}")
 
+@cli.group()
+def archive():
+    """Retention and cold archive of finished jobs"""
+    pass
+
+@archive.command(name='run')
+@click.option('--dry-run', is_flag=True, help='Only count the jobs that would be archived')
+@_queues_option
+def archive_run(dry_run, queue):
+    """Move completed/dead jobs past their TTL or max count into the archive.
+
+    Runs for every queue unless --queue is given; each queue has its own archive.
+    """
+    managers = _queues(queue)
+    verb = "Would archive" if dry_run else "Archived"
+    for manager in managers:
+        counts = manager.run_retention(dry_run)
+        prefix = f"{manager.queue}: " if len(managers) > 1 else ""
+        click.echo(f"{prefix}{verb} {counts['completed']} completed "
+                   f"and {counts['dead']} dead job(s)")
+
+@archive.command()
+@click.option('--state', type=click.Choice(['completed', 'dead']))
+@click.option('--since', default=None, help='Only jobs finished at or after this UTC time (ISO-8601)')
+@click.option('--until', default=None, help='Only jobs finished at or before this UTC time (ISO-8601)')
+@click.option('--command', 'command', default=None, help='Only jobs whose command contains this text')
+@click.option('--id', 'job_id', default=None, help='Only the job with this ID')
+@click.option('--limit', type=int, default=None, help='Stop after this many jobs')
+@_queues_option
+def query(state, since, until, command, job_id, limit, queue):
+    """Stream archived jobs as JSON lines, from every queue's archive unless --queue is given"""
+    try:
+        since = parse_timestamp(since) if since else None
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="'--since'")
+    try:
+        until = parse_timestamp(until) if until else None
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="'--until'")
+    records = itertools.chain.from_iterable(
+        manager.archive.query(state, since, until, command, job_id) for manager in _queues(queue))
+    for count, record in enumerate(records):
+        if limit is not None and count >= limit:
+            break
+        click.echo(json.dumps(record))
+
+@cli.group(name='storage')
+def storage_group():
+    """Storage backend management"""
+    pass
+
+@storage_group.command()
+@click.argument('source', default='jobqueue_data.json')
+@click.option('--queue', default=None,
+              help=f'Named queue to import into (default: {DEFAULT_QUEUE})')
+def migrate(source, queue):
+    """Import jobs and config from a JSON data file into the active backend"""
+    if isinstance(storage, Storage):
+        click.echo("Error: migrate imports into the sqlite backend, use --backend sqlite")
+        return
+    target = _queue(queue, create=True).storage
+    source_storage = Storage(source)
+    jobs = source_storage.get_all_jobs()
+    config = source_storage.get_all_config()
+    if target is storage:
+        storage.import_jobs(jobs, config)
+    else:
+        # Config is shared by all queues and lives with the default one
+        storage.import_jobs([], config)
+        target.import_jobs(jobs)
+    click.echo(f"Imported {len(jobs)} job(s) from {source} into {target.data_file}")
+
+@storage_group.command()
+@click.option('--format', 'fmt', type=click.Choice(sorted(CODECS)), required=True,
+              help='Snapshot format to switch to')
+@_queues_option
+def convert(fmt, queue):
+    """Rewrite the JSON backend's snapshot in another format, for every queue unless --queue is given"""
+    if not isinstance(storage, Storage):
+        click.echo("Error: convert applies to the json backend only")
+        return
+    for manager in _queues(queue):
+        target = manager.storage
+        try:
+            previous = target.convert(fmt)
+        except ValueError as e:
+            click.echo(f"Error: {e}")
+            return
+        click.echo(f"Converted {target.data_file} from {previous} to {fmt}")
+
+@storage_group.command(name='check-counts')
+@click.option('--repair', is_flag=True, help='Rebuild the counters from a full recount')
+@_queues_option
+def check_counts(repair, queue):
+    """Verify the per-state job counters used by `status`, for every queue unless --queue is given"""
+    managers = _queues(queue)
+    found = False
+    for manager in managers:
+        prefix = f"{manager.queue}: " if len(managers) > 1 else ""
+        for state, (stored, actual) in sorted(manager.storage.check_counts(repair).items()):
+            found = True
+            click.echo(f"{prefix}{state}: stored {'missing' if stored is None else stored}, "
+                       f"actual {actual}")
+    if not found:
+        click.echo("Job counters are consistent")
+        return
+    click.echo("Counters rebuilt" if repair else "Run with --repair to rebuild them")
+
+@cli.command(name='metrics')
+def metrics_command():
+    """Print worker metrics and job counts in Prometheus text format"""
+    click.echo(metrics_text(storage.data_file, _backend()), nl=False)
+
+@cli.command()
+@click.option('--backend', 'backends', type=click.Choice(['json', 'sqlite']), multiple=True,
+              help='Backend to measure, repeatable (default: both)')
+@click.option('--jobs', type=click.IntRange(min=1), multiple=True,
+              help='Queue size to measure, repeatable (default: 1000)')
+@click.option('--workers', type=click.IntRange(min=1), multiple=True,
+              help='Worker count to measure, repeatable (default: 1)')
+@click.option('--command', default=None,
+              help='Run this shell command per job through real workers '
+                   '(default: claim and complete without running anything)')
+@click.option('--sleep', type=click.FloatRange(min=0), default=None,
+              help='Shorthand for --command "sleep SECONDS"')
+@click.option('--executor', type=click.Choice(['thread', 'async']), default='thread',
+              show_default=True, help='Worker executor used with --command')
+@click.option('--prefetch', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Jobs claimed per worker poll')
+@click.option('--latency-samples', type=click.IntRange(min=0), default=100, show_default=True,
+              help='Jobs enqueued one at a time to time pickup latency')
+@click.option('--output', type=click.File('w'), default='-',
+              help='Write the JSON report here instead of stdout')
+def bench(backends, jobs, workers, command, sleep, executor, prefetch, latency_samples, output):
+    """Measure enqueue/claim throughput and pickup latency as JSON"""
+    from bench import environment, run_benchmark
+    if command is not None and sleep is not None:
+        raise click.UsageError("Use either --command or --sleep, not both")
+    if sleep is not None:
+        command = f"sleep {sleep}"
+    results = []
+    for backend in backends or ('json', 'sqlite'):
+        for size in jobs or (1000,):
+            for count in workers or (1,):
+                click.echo(f"{backend}: {size} job(s), {count} worker(s)...", err=True)
+                results.append(run_benchmark(backend, size, count, command, latency_samples,
+                                             prefetch, executor))
+    report = {"environment": environment(), "results": results}
+    output.write(json.dumps(report, indent=2) + "\n")
+
 if __name__ == '__main__':
     cli()
\ No newline at end of file
@@ -0,0 +1,70 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+class JsonCodec:
+    """Compact JSON, encoded with orjson when it is installed.
+
+    Falls back to the stdlib ``json`` module without orjson, and for
+    values orjson refuses (such as integers beyond 64 bits). Both produce
+    plain JSON, so files written either way read back the same.
+    """
+    name = "json"
+    header = b""
+
+    def dumps(self, obj) -> bytes:
+        if orjson is not None:
+            try:
+                return orjson.dumps(obj)
+            except TypeError:
+                pass
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+    def loads(self, data: bytes):
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data)
+
+class MsgpackCodec:
+    """MessagePack, for snapshots only; needs the msgpack package"""
+    name = "msgpack"
+    header = b"JQMSGPACK1\n"
+
+    def dumps(self, obj) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data: bytes):
+        return msgpack.unpackb(data, raw=False)
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), MsgpackCodec())}
+
+def available_codecs() -> list:
+    """Names of the codecs usable with the installed packages"""
+    return [name for name in CODECS if name != "msgpack" or msgpack is not None]
+
+def get_codec(name: str):
+    """Look up a codec by name; ValueError if unknown or not installed"""
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec: {name} (choose from {', '.join(CODECS)})")
+    if name not in available_codecs():
+        raise ValueError(f"The {name} codec needs the {name} package, install it first")
+    return CODECS[name]
+
+def detect_codec(data: bytes):
+    """The codec a file was written with, from its header"""
+    for codec in CODECS.values():
+        if codec.header and data.startswith(codec.header):
+            return codec
+    return CODECS["json"]
+
+def encode(codec, obj) -> bytes:
+    """Serialize obj behind the codec's header, ready to write to a file"""
+    return codec.header + codec.dumps(obj)
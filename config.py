@@ -14,4 +14,84 @@ class Config:
     
     @property
     def base_delay(self):
-        return int(self.get("base_delay", 2))
\ No newline at end of file
+        return int(self.get("base_delay", 2))
+    
+    @property
+    def backoff_jitter(self):
+        """Fraction of the retry backoff added as random jitter"""
+        return float(self.get("backoff_jitter", 0))
+    
+    @property
+    def lease_seconds(self):
+        """How long a claim is held before another worker may take the job"""
+        return float(self.get("lease_seconds", 330))
+    
+    @property
+    def idle_poll_seconds(self):
+        """Longest an idle worker sleeps without a wakeup notification"""
+        return float(self.get("idle_poll_seconds", 5))
+    
+    @property
+    def prefetch(self):
+        """Jobs a worker claims per trip to storage"""
+        return max(1, int(self.get("prefetch", 1)))
+    
+    @property
+    def log_max_bytes(self):
+        """Size at which a job's output log is rotated (0 never rotates)"""
+        return int(self.get("log_max_bytes", 10 * 1024 * 1024))
+    
+    @property
+    def log_backups(self):
+        """Rotated output logs kept per job (0 truncates instead)"""
+        return int(self.get("log_backups", 1))
+    
+    @property
+    def log_tail_bytes(self):
+        """Bytes of trailing output stored on the job record"""
+        return int(self.get("log_tail_bytes", 2048))
+    
+    @property
+    def sample_interval(self):
+        """Seconds between CPU/RSS samples of a running job's process tree"""
+        return float(self.get("sample_interval", 0.5))
+    
+    @property
+    def default_timeout(self):
+        """Seconds a job may run when its spec sets no timeout"""
+        return float(self.get("default_timeout", 300))
+    
+    @property
+    def completed_ttl(self):
+        """Seconds completed jobs stay in the hot store (0 keeps them)"""
+        return float(self.get("completed_ttl", 0))
+    
+    @property
+    def completed_max_jobs(self):
+        """Most recent completed jobs kept in the hot store (0 is unlimited)"""
+        return int(self.get("completed_max_jobs", 0))
+    
+    @property
+    def dead_ttl(self):
+        """Seconds dead jobs stay in the hot store (0 keeps them)"""
+        return float(self.get("dead_ttl", 0))
+    
+    @property
+    def dead_max_jobs(self):
+        """Most recent dead jobs kept in the hot store (0 is unlimited)"""
+        return int(self.get("dead_max_jobs", 0))
+    
+    @property
+    def retention_interval(self):
+        """Seconds between retention runs by a running supervisor"""
+        return float(self.get("retention_interval", 300))
+    
+    @property
+    def metrics_interval(self):
+        """Seconds between worker processes publishing their metrics"""
+        return float(self.get("metrics_interval", 5))
+    
+    @property
+    def idempotency_ttl(self):
+        """Seconds an idempotency key deduplicates enqueues after its job was created"""
+        return float(self.get("idempotency_ttl", 86400))
@@ -0,0 +1,57 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows has no advisory flock
+    fcntl = None
+
+class FileLock:
+    """Re-entrant exclusive lock shared by threads and processes.
+
+    Threads in one process serialize on an RLock; the outermost holder also
+    takes an ``fcntl.flock`` on ``path`` so other processes on the host wait
+    as well. The lock file is opened per acquisition, so a forked child never
+    shares its parent's lock. Without fcntl this is just the thread lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Take the lock; without blocking, return False if it is held elsewhere"""
+        if not self._lock.acquire(blocking):
+            return False
+        self._depth += 1
+        if self._depth == 1 and fcntl is not None:
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BaseException as e:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                self._depth -= 1
+                self._lock.release()
+                if isinstance(e, BlockingIOError) and not blocking:
+                    return False
+                raise
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,94 @@
+import functools
+import threading
+import time
+
+EVENTS = ("storage", "claim", "execute", "transition")
+
+# Per event, a tuple of (before, after) pairs; replaced rather than
+# mutated, so firing a hook needs no lock
+_hooks = {event: () for event in EVENTS}
+_lock = threading.Lock()
+
+def add_hook(event: str, before=None, after=None):
+    """Call ``before`` and ``after`` around every ``event``.
+
+    ``before(event, info)`` runs as the operation starts and
+    ``after(event, info, seconds, error)`` once it has finished, where
+    ``info`` is a dict describing the operation (see ``span`` callers) and
+    ``error`` the exception it raised, if any. Hooks run on the thread doing
+    the work. Returns a function that removes the hook again.
+    """
+    if event not in EVENTS:
+        raise ValueError(f"Unknown hook event: {event} (choose from {', '.join(EVENTS)})")
+    hook = (before, after)
+    with _lock:
+        _hooks[event] = _hooks[event] + (hook,)
+
+    def remove():
+        with _lock:
+            _hooks[event] = tuple(h for h in _hooks[event] if h is not hook)
+    return remove
+
+def _call(callback, *args):
+    try:
+        callback(*args)
+    except Exception as e:
+        # A broken tracer must not take the worker down with it
+        print(f"Hook {callback!r} failed: {e}")
+
+class _Span:
+    __slots__ = ("event", "info", "hooks", "start")
+
+    def __init__(self, event: str, info: dict, hooks: tuple):
+        self.event = event
+        self.info = info
+        self.hooks = hooks
+
+    def __enter__(self):
+        for before, _ in self.hooks:
+            if before is not None:
+                _call(before, self.event, self.info)
+        self.start = time.perf_counter()
+        return self.info
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        for _, after in self.hooks:
+            if after is not None:
+                _call(after, self.event, self.info, seconds, exc)
+        return False
+
+class _NoSpan:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+def span(event: str, **info):
+    """Context manager that fires ``event``'s hooks around its body.
+
+    With no hooks registered for the event this returns a shared no-op
+    context manager, so instrumented code pays one dict lookup.
+    """
+    hooks = _hooks[event]
+    if not hooks:
+        return _NO_SPAN
+    return _Span(event, info, hooks)
+
+def traced(event: str):
+    """Decorate a method to run inside ``span(event, op=<name>, target=self)``"""
+    def decorate(func):
+        op = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            hooks = _hooks[event]
+            if not hooks:
+                return func(self, *args, **kwargs)
+            with _Span(event, {"op": op, "target": self}, hooks):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorate
@@ -1,6 +1,9 @@
+import base64
 import uuid
 import json
-from datetime import datetime
+import random
+import time
+from datetime import datetime, timedelta, timezone
 from enum import Enum
 
 class JobState(Enum):
@@ -10,70 +13,330 @@ class JobState(Enum):
     FAILED = "failed"
     DEAD = "dead"
 
+# Stored state strings map straight to the shared enum members
+STATES = {state.value: state for state in JobState}
+
+EPOCH = datetime(1970, 1, 1)
+
+# Priority levels; higher levels are picked more often, see ready_index
+MIN_PRIORITY = 0
+MAX_PRIORITY = 9
+
+# Queue of jobs enqueued without one, stored in the main data file
+DEFAULT_QUEUE = "default"
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse an ISO-8601 UTC timestamp into a naive UTC datetime"""
+    # Older records may carry both an offset and a trailing "Z"
+    parsed = datetime.fromisoformat(value.replace('Z', ''))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def to_epoch(value: datetime) -> float:
+    """Convert a naive UTC datetime to seconds since the epoch"""
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+def from_epoch(value: float) -> datetime:
+    """Convert seconds since the epoch to a naive UTC datetime"""
+    return EPOCH + timedelta(seconds=value)
+
+def format_timestamp(value: float) -> str:
+    """Format epoch seconds the way job records store times"""
+    return from_epoch(value).isoformat() + "Z"
+
+def encode_cursor(created_ts: float, job_id: str) -> str:
+    """Opaque pagination cursor for the position just past a job"""
+    raw = json.dumps([created_ts, job_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Turn a cursor back into a (created_ts, job_id) key; ValueError if invalid"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_ts, job_id = json.loads(raw)
+        return float(created_ts), str(job_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"invalid cursor: {cursor}") from e
+
+def stacked_lease(lease_seconds, position: int, parallel: int = 1):
+    """Lease for the job at ``position`` (from 0) of a batch claimed at once.
+
+    The first ``parallel`` jobs start right away and get ``lease_seconds``;
+    each further round of ``parallel`` waits for the one before, so gets
+    ``lease_seconds`` more.
+    """
+    if lease_seconds is None:
+        return None
+    return lease_seconds * (position // max(1, parallel) + 1)
+
+class _Timestamp:
+    """A Job time field kept as epoch seconds in ``_<field>_ts``.
+
+    Jobs loaded from a record keep its ISO-8601 text in ``_<field>_iso``
+    and only parse it on first access, and ``to_dict`` hands unchanged
+    text straight back. The ``<field>_at`` attribute is a naive UTC
+    datetime view of the value and ``<field>_ts`` the float itself.
+    """
+
+    def __init__(self, field: str, as_datetime: bool):
+        self.ts = f"_{field}_ts"
+        self.iso = f"_{field}_iso"
+        self.as_datetime = as_datetime
+
+    def __get__(self, job, owner=None):
+        if job is None:
+            return self
+        value = getattr(job, self.ts)
+        if value is None:
+            text = getattr(job, self.iso)
+            if text is None:
+                return None
+            value = to_epoch(parse_timestamp(text))
+            setattr(job, self.ts, value)
+        return from_epoch(value) if self.as_datetime else value
+
+    def __set__(self, job, value):
+        if value is not None and self.as_datetime:
+            value = to_epoch(value)
+        setattr(job, self.ts, value)
+        setattr(job, self.iso, None)
+
+    def text(self, job):
+        """The field as stored in records, or None"""
+        text = getattr(job, self.iso)
+        if text is None:
+            value = getattr(job, self.ts)
+            if value is None:
+                return None
+            text = format_timestamp(value)
+            setattr(job, self.iso, text)
+        return text
+
 class Job:
+    __slots__ = (
+        "id", "command", "state", "attempts", "max_retries", "lease_owner",
+        "output_tail", "resources", "timeout", "priority", "queue", "idempotency_key",
+        "_created_ts", "_created_iso", "_updated_ts", "_updated_iso",
+        "_lease_expires_ts", "_lease_expires_iso", "_run_ts", "_run_iso",
+    )
+
+    created_at = _Timestamp("created", True)
+    created_ts = _Timestamp("created", False)
+    updated_at = _Timestamp("updated", True)
+    updated_ts = _Timestamp("updated", False)
+    lease_expires_at = _Timestamp("lease_expires", True)
+    lease_expires_ts = _Timestamp("lease_expires", False)
+    run_at = _Timestamp("run", True)
+    run_ts = _Timestamp("run", False)
+
     def __init__(self, id=None, command="", max_retries=3, state=JobState.PENDING, 
-                 attempts=0, created_at=None, updated_at=None):
+                 attempts=0, created_at=None, updated_at=None, lease_owner=None,
+                 lease_expires_at=None, run_at=None, output_tail=None, resources=None,
+                 timeout=None, priority=0, queue=DEFAULT_QUEUE, idempotency_key=None):
+        # Rounded to the microseconds records store, so created_ts (and
+        # cursors and SQLite's created_ts column) match a reloaded job's
+        now = to_epoch(from_epoch(time.time()))
         self.id = id or str(uuid.uuid4())
         self.command = command
         self.state = state
         self.attempts = attempts
         self.max_retries = max_retries
-        self.created_at = created_at or datetime.utcnow()
-        self.updated_at = updated_at or datetime.utcnow()
+        self.created_at = created_at
+        self.updated_at = updated_at
+        if created_at is None:
+            self.created_ts = now
+        if updated_at is None:
+            self.updated_ts = now
+        self.lease_owner = lease_owner
+        self.lease_expires_at = lease_expires_at
+        self.run_at = run_at
+        self.output_tail = output_tail
+        # Measurements from the last attempt, see accounting.ResourceSampler
+        self.resources = resources
+        # Seconds the command may run; None uses the default_timeout config
+        self.timeout = timeout
+        self.priority = priority
+        self.queue = queue
+        # Producer-chosen key that makes repeat enqueues return this job,
+        # see QueueManager.enqueue_spec
+        self.idempotency_key = idempotency_key
+    
+    def queue_wait(self):
+        """Seconds between creation and the current claim"""
+        return max(0.0, self.updated_ts - self.created_ts)
     
     def to_dict(self):
-        return {
+        cls = type(self)
+        data = {
             "id": self.id,
             "command": self.command,
             "state": self.state.value,
             "attempts": self.attempts,
             "max_retries": self.max_retries,
-            "created_at": self.created_at.isoformat() + "Z",
-            "updated_at": self.updated_at.isoformat() + "Z"
+            "created_at": cls.created_at.text(self),
+            "updated_at": cls.updated_at.text(self),
+            "lease_owner": self.lease_owner,
+            "lease_expires_at": cls.lease_expires_at.text(self),
+            "run_at": cls.run_at.text(self),
+            "output_tail": self.output_tail,
+            "resources": self.resources,
+            "timeout": self.timeout,
+            "priority": self.priority,
+            "queue": self.queue
         }
+        # Only stored when set, so jobs without one keep their record size
+        if self.idempotency_key is not None:
+            data["idempotency_key"] = self.idempotency_key
+        return data
     
     @classmethod
     def from_dict(cls, data):
-        job = cls(
-            id=data["id"],
-            command=data["command"],
-            max_retries=data.get("max_retries", 3),
-            state=JobState(data["state"]),
-            attempts=data["attempts"]
-        )
-        # Handle timestamp parsing
-        created_at_str = data["created_at"].replace('Z', '+00:00')
-        updated_at_str = data["updated_at"].replace('Z', '+00:00')
-        job.created_at = datetime.fromisoformat(created_at_str)
-        job.updated_at = datetime.fromisoformat(updated_at_str)
+        """Build a job from a stored record; its times are parsed lazily"""
+        job = cls.__new__(cls)
+        job.id = data["id"]
+        job.command = data["command"]
+        job.state = STATES[data["state"]]
+        job.attempts = data["attempts"]
+        job.max_retries = data.get("max_retries", 3)
+        job._created_ts = job._updated_ts = job._lease_expires_ts = job._run_ts = None
+        job._created_iso = data["created_at"]
+        job._updated_iso = data["updated_at"]
+        job._lease_expires_iso = data.get("lease_expires_at")
+        job._run_iso = data.get("run_at")
+        job.lease_owner = data.get("lease_owner")
+        job.output_tail = data.get("output_tail")
+        job.resources = data.get("resources")
+        job.timeout = data.get("timeout")
+        job.priority = data.get("priority", 0)
+        job.queue = data.get("queue", DEFAULT_QUEUE)
+        job.idempotency_key = data.get("idempotency_key")
         return job
     
-    def calculate_backoff(self):
-        """Calculate exponential backoff delay in seconds"""
-        return 2 ** self.attempts
+    @property
+    def cursor(self) -> str:
+        """Cursor that resumes a listing after this job"""
+        return encode_cursor(self.created_ts, self.id)
+    
+    def calculate_backoff(self, base_delay=2, jitter=0.0):
+        """Calculate exponential backoff delay in seconds.
+
+        ``jitter`` adds up to that fraction of the delay at random, so jobs
+        that failed together don't all retry at the same instant.
+        """
+        delay = base_delay ** self.attempts
+        if jitter:
+            delay += random.uniform(0, delay * jitter)
+        return delay
+    
+    def schedule_in(self, seconds):
+        """Hold the job back until ``seconds`` from now"""
+        self.run_ts = time.time() + seconds
+    
+    def is_due(self, now=None):
+        run_ts = self.run_ts
+        return run_ts is None or run_ts <= (to_epoch(now) if now else time.time())
     
     def can_retry(self):
         return self.attempts < self.max_retries and self.state == JobState.FAILED
     
-    def mark_processing(self):
+    def lease_expired(self, now=None):
+        """Whether this job's claim lease has run out"""
+        expires = self.lease_expires_ts
+        if expires is None:
+            return False
+        return expires <= (to_epoch(now) if now else time.time())
+    
+    def clear_lease(self):
+        self.lease_owner = None
+        self.lease_expires_ts = None
+    
+    def mark_processing(self, owner=None, lease_seconds=None):
         self.state = JobState.PROCESSING
-        self.updated_at = datetime.utcnow()
+        self.updated_ts = time.time()
+        self.lease_owner = owner
+        self.lease_expires_ts = None
+        if lease_seconds is not None:
+            self.lease_expires_ts = self.updated_ts + lease_seconds
+    
+    def release(self):
+        """Hand a claimed job that never started back to the queue"""
+        self.state = JobState.PENDING
+        self.updated_ts = time.time()
+        self.clear_lease()
     
     def mark_completed(self):
         self.state = JobState.COMPLETED
-        self.updated_at = datetime.utcnow()
+        self.updated_ts = time.time()
+        self.clear_lease()
     
     def mark_failed(self):
+        self.clear_lease()
         self.attempts += 1
         if self.attempts >= self.max_retries:
             self.state = JobState.DEAD
         else:
             self.state = JobState.FAILED
-        self.updated_at = datetime.utcnow()
+        self.updated_ts = time.time()
     
     def retry(self):
         if self.state == JobState.DEAD and self.attempts <= self.max_retries:
             self.state = JobState.PENDING
-            self.updated_at = datetime.utcnow()
+            self.run_ts = None
+            self.updated_ts = time.time()
             return True
-        return False
\ No newline at end of file
+        return False
+
+class JobRecord:
+    """Read-only view of a stored job record.
+
+    Lets scans filter on state, attempts and other plain fields without
+    building a Job; ``job()`` hydrates only the records that are kept.
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data: dict):
+        self.data = data
+
+    @property
+    def id(self) -> str:
+        return self.data["id"]
+
+    @property
+    def command(self) -> str:
+        return self.data["command"]
+
+    @property
+    def state(self) -> JobState:
+        return STATES[self.data["state"]]
+
+    @property
+    def attempts(self) -> int:
+        return self.data["attempts"]
+
+    @property
+    def max_retries(self) -> int:
+        return self.data.get("max_retries", 3)
+
+    @property
+    def priority(self) -> int:
+        return self.data.get("priority", 0)
+
+    @property
+    def queue(self) -> str:
+        return self.data.get("queue", DEFAULT_QUEUE)
+
+    @property
+    def created_ts(self) -> float:
+        return to_epoch(parse_timestamp(self.data["created_at"]))
+
+    @property
+    def updated_ts(self) -> float:
+        return to_epoch(parse_timestamp(self.data["updated_at"]))
+
+    @property
+    def cursor(self) -> str:
+        return encode_cursor(self.created_ts, self.id)
+
+    def job(self) -> Job:
+        return Job.from_dict(self.data)
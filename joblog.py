@@ -0,0 +1,128 @@
+import os
+import time
+from typing import Callable, Iterator, Tuple
+
+class JobLog:
+    """Streams a job's output to ``<log_dir>/<job_id>.log`` in chunks.
+
+    Output never accumulates in the worker: each chunk is written straight
+    to disk. Once the file reaches ``max_bytes`` it is rotated to
+    ``.log.1`` (shifting older files up to ``backups``); with ``backups=0``
+    it is truncated instead. A ``max_bytes`` of 0 or less disables rotation.
+    The last ``tail_bytes`` are kept in memory so they can be stored on
+    the job record.
+    """
+
+    def __init__(self, log_dir: str, job_id: str, max_bytes: int = 10 * 1024 * 1024,
+                 backups: int = 1, tail_bytes: int = 2048):
+        os.makedirs(log_dir, exist_ok=True)
+        self.path = log_path(log_dir, job_id)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.tail_bytes = tail_bytes
+        self._tail = bytearray()
+        # Unbuffered, so `logs --follow` sees output as soon as it is written
+        self._file = open(self.path, "ab", buffering=0)
+        self._size = self._file.tell()
+
+    def write(self, chunk: bytes):
+        if self.tail_bytes:
+            self._tail += chunk[-self.tail_bytes:]
+            del self._tail[:-self.tail_bytes]
+        if self.max_bytes <= 0:
+            self._file.write(chunk)
+            self._size += len(chunk)
+            return
+        view = memoryview(chunk)
+        while view:
+            if self._size >= self.max_bytes:
+                self._rotate()
+            piece = view[:self.max_bytes - self._size]
+            self._file.write(piece)
+            self._size += len(piece)
+            view = view[len(piece):]
+
+    def mark(self, message: str):
+        """Write a marker line such as the start of an attempt"""
+        line = f"=== {message} ===\n".encode()
+        self._file.write(line)
+        self._size += len(line)
+
+    def _rotate(self):
+        self._file.close()
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                older = f"{self.path}.{index}"
+                if os.path.exists(older):
+                    os.replace(older, f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+            self._file = open(self.path, "ab", buffering=0)
+        else:
+            self._file = open(self.path, "wb", buffering=0)
+        self._size = 0
+
+    def tail(self) -> str:
+        """Last tail_bytes of output, decoded"""
+        return self._tail.decode(errors="replace")
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def log_path(log_dir: str, job_id: str) -> str:
+    return os.path.join(log_dir, f"{job_id}.log")
+
+def read_tail(path: str, nbytes: int) -> Tuple[bytes, int]:
+    """Read the last nbytes of a file without loading the rest.
+
+    Returns the data and the offset just past it.
+    """
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - nbytes))
+        data = f.read(nbytes)
+        return data, f.tell()
+
+def follow(path: str, offset: int, done: Callable[[], bool],
+           poll_interval: float = 0.5, chunk_size: int = 65536) -> Iterator[bytes]:
+    """Yield data appended to path after offset until done() and no more output.
+
+    Rotation (the file being replaced or shrinking) restarts from the
+    beginning of the new file.
+    """
+    f = None
+    inode = None
+    try:
+        while True:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                st = None
+            if st is not None and (st.st_ino != inode or st.st_size < offset):
+                if f is not None:
+                    # Drain what was written to the old file before rotation
+                    yield from iter(lambda: f.read(chunk_size), b"")
+                    f.close()
+                    offset = 0
+                f = open(path, "rb")
+                f.seek(offset)
+                inode = st.st_ino
+            # Check done() before the read so output written just before the
+            # job finished is never missed
+            finished = done()
+            data = f.read(chunk_size) if f is not None else b""
+            if data:
+                offset = f.tell()
+                yield data
+                continue
+            if finished:
+                return
+            time.sleep(poll_interval)
+    finally:
+        if f is not None:
+            f.close()
@@ -0,0 +1,273 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List
+from filelock import FileLock
+
+# Seconds; spans lock waits and journal appends up to long-running jobs
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+
+RETIRED = "retired.json"
+
+_registry = {}
+
+class Counter:
+    """Monotonic total per combination of label values"""
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def reset(self):
+        # Also called in a forked child, where another thread may have
+        # held the old lock at the time of the fork
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            series = [[list(labels), value] for labels, value in self._series.items()]
+        return {"type": self.type, "help": self.help, "labels": list(self.labels),
+                "series": series}
+
+class Histogram(Counter):
+    """Distribution of observed values in fixed buckets, per label values.
+
+    A series is kept as per-bucket (not cumulative) counts, the last one
+    for values beyond every bucket, followed by the sum of all values, so
+    snapshots from several processes merge by adding lists element-wise.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            series = [[list(labels), list(values)] for labels, values in self._series.items()]
+        return {"type": self.type, "help": self.help, "labels": list(self.labels),
+                "buckets": list(self.buckets), "series": series}
+
+class TimedLock:
+    """A lock that records how long contended acquisitions waited.
+
+    Wraps any lock whose ``acquire`` takes a ``blocking`` flag (threading
+    locks, FileLock). Each acquisition first tries without blocking; only
+    when that fails is the wait timed and observed in ``LOCK_WAIT_SECONDS``
+    under the given name, so the uncontended path stays nearly free and the
+    histogram shows how often and how long callers had to wait.
+    """
+
+    def __init__(self, lock, name: str):
+        self._lock = lock
+        self.name = name
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if self._lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        self._lock.acquire()
+        LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, self.name)
+        return True
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+ENQUEUE_SECONDS = Histogram(
+    "jobqueue_enqueue_seconds", "Time to persist an enqueue call's jobs and wake workers")
+JOBS_ENQUEUED = Counter("jobqueue_jobs_enqueued_total", "Jobs enqueued")
+JOBS_DEDUPLICATED = Counter(
+    "jobqueue_jobs_deduplicated_total", "Enqueues deduplicated by idempotency key")
+QUEUE_WAIT_SECONDS = Histogram(
+    "jobqueue_queue_wait_seconds", "Time from a job becoming due to being claimed")
+JOBS_CLAIMED = Counter("jobqueue_jobs_claimed_total", "Jobs claimed by workers")
+EXECUTION_SECONDS = Histogram(
+    "jobqueue_job_execution_seconds", "Wall time of job commands")
+JOBS_FINISHED = Counter(
+    "jobqueue_job_transitions_total", "Claimed jobs completed, failed or moved to the DLQ",
+    ("state",))
+STORAGE_SECONDS = Histogram(
+    "jobqueue_storage_seconds", "Time spent reading and writing job storage", ("op",))
+STORAGE_BYTES = Counter(
+    "jobqueue_storage_bytes_total", "Bytes read from and written to job storage", ("op",))
+LOCK_WAIT_SECONDS = Histogram(
+    "jobqueue_lock_wait_seconds", "Time spent waiting for a lock held by someone else",
+    ("lock",))
+
+def snapshot() -> dict:
+    """This process's metrics as a JSON-serializable dict"""
+    return {name: metric.snapshot() for name, metric in _registry.items()}
+
+def reset():
+    """Forget everything recorded so far"""
+    for metric in _registry.values():
+        metric.reset()
+
+if hasattr(os, "register_at_fork"):
+    # A forked worker reports only what it records itself
+    os.register_at_fork(after_in_child=reset)
+
+def merge(snapshots: List[dict]) -> dict:
+    """Add up snapshots taken in several processes"""
+    merged = {}
+    for snap in snapshots:
+        for name, metric in snap.items():
+            target = merged.setdefault(name, dict(metric, series=[]))
+            series = {tuple(labels): value for labels, value in target["series"]}
+            for labels, value in metric["series"]:
+                labels = tuple(labels)
+                if labels not in series:
+                    series[labels] = value
+                elif isinstance(value, list):
+                    series[labels] = [a + b for a, b in zip(series[labels], value)]
+                else:
+                    series[labels] = series[labels] + value
+            target["series"] = [[list(labels), value] for labels, value in series.items()]
+    return merged
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(snap: dict) -> str:
+    """Metrics in the Prometheus text exposition format"""
+    lines = []
+    for name, metric in sorted(snap.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for labels, value in sorted(metric["series"]):
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_labels(metric['labels'], labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric["buckets"] + ["+Inf"], value[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(metric['labels'], labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(metric['labels'], labels)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(metric['labels'], labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+def _write_json(path: str, data: dict):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+def flush(directory: str):
+    """Publish this process's metrics as ``<directory>/<pid>.json``"""
+    os.makedirs(directory, exist_ok=True)
+    _write_json(os.path.join(directory, f"{os.getpid()}.json"), snapshot())
+
+def retire(directory: str):
+    """Fold this process's metrics into the directory's retired totals.
+
+    Called as a process exits, so its counts outlive it without leaving
+    one file per short-lived process behind.
+    """
+    snap = snapshot()
+    own = os.path.join(directory, f"{os.getpid()}.json")
+    if not any(metric["series"] for metric in snap.values()) and not os.path.exists(own):
+        return
+    os.makedirs(directory, exist_ok=True)
+    with FileLock(directory + ".lock"):
+        path = os.path.join(directory, RETIRED)
+        try:
+            with open(path) as f:
+                retired = json.load(f)
+        except (OSError, ValueError):
+            retired = {}
+        _write_json(path, merge([retired, snap]))
+        try:
+            os.remove(own)
+        except FileNotFoundError:
+            pass
+    reset()
+
+def collect(directory: str) -> dict:
+    """Merged metrics of every process that published to directory"""
+    if not os.path.isdir(directory):
+        return {}
+    snapshots = []
+    with FileLock(directory + ".lock"):
+        for path in glob.glob(os.path.join(glob.escape(directory), "*.json")):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return merge(snapshots)
+
+def publish(directory: str, interval: float = 5.0):
+    """Flush this process's metrics every interval from a daemon thread"""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                flush(directory)
+            except OSError as e:
+                print(f"Metrics: could not write to {directory}: {e}")
+
+    threading.Thread(target=run, daemon=True, name="jobqueue-metrics").start()
+
+def serve(port: int, render_metrics: Callable[[], str], host: str = "127.0.0.1"):
+    """Serve render_metrics() at http://host:port/metrics from a daemon thread"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = render_metrics().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="jobqueue-metrics-http").start()
+    return server
@@ -0,0 +1,161 @@
+import atexit
+import glob
+import os
+import random
+import socket
+import threading
+import time
+from typing import Optional
+
+class WakeupChannel:
+    """Wakes idle workers when new work arrives.
+
+    In-process waiters share a condition variable; other processes are
+    reached by datagram on the ``<pid>.sock`` each binds in ``directory``
+    (without AF_UNIX, workers fall back to their poll timeout). Only one
+    waiter per process is armed with the earliest deadline.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.directories = [directory]
+        self._cond = threading.Condition()
+        self._tokens = 0
+        self._waiters = 0
+        self._armed = None
+        self._socks = {}
+        self._pid = None
+
+    def add_directory(self, directory: str):
+        """Also take cross-process wakeups sent to ``directory``"""
+        if directory in self.directories:
+            return
+        self.directories.append(directory)
+        if self._pid == os.getpid():
+            self._bind(directory)
+
+    def _listen(self):
+        """Bind this process's sockets and start their listener threads once"""
+        if self._pid == os.getpid() or not hasattr(socket, "AF_UNIX"):
+            return
+        self._pid = os.getpid()
+        self._socks = {}
+        atexit.register(self.close)
+        for directory in self.directories:
+            self._bind(directory)
+
+    def _bind(self, directory: str):
+        path = os.path.join(directory, f"{self._pid}.sock")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            if os.path.exists(path):
+                os.unlink(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(path)
+        except OSError:
+            return
+        self._socks[directory] = (sock, path)
+        threading.Thread(target=self._receive, args=(sock,), daemon=True).start()
+
+    def _receive(self, sock):
+        while True:
+            try:
+                message = sock.recv(16)
+            except OSError:
+                return
+            try:
+                count = max(1, int(message))
+            except ValueError:
+                count = 1
+            self._notify_local(count)
+
+    def close(self):
+        """Stop accepting cross-process wakeups"""
+        if self._pid == os.getpid():
+            for sock, path in self._socks.values():
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                sock.close()
+        self._socks = {}
+
+    def _notify_local(self, count: int = 1):
+        with self._cond:
+            self._tokens = min(self._tokens + count, max(self._waiters, 1))
+            self._cond.notify(count)
+
+    def notify(self, count: int = 1, directory: str = None):
+        """Wake up to ``count`` idle workers, here first, then in other processes.
+
+        Other processes are those listening in ``directory``, by default
+        the channel's own. Up to ``count`` of them are each told to wake up
+        to the remaining ``count`` of their waiters.
+        """
+        with self._cond:
+            local = min(count, self._waiters - self._tokens)
+            if local > 0:
+                self._tokens += local
+                self._cond.notify(local)
+                count -= local
+        if count > 0 and not self._notify_remote(count, directory or self.directory):
+            # Nobody else is listening; leave a token for our next waiter
+            self._notify_local()
+
+    def _notify_remote(self, count: int, directory: str) -> bool:
+        if not hasattr(socket, "AF_UNIX"):
+            return False
+        peers = glob.glob(os.path.join(glob.escape(directory), "*.sock"))
+        if directory in self._socks and self._socks[directory][1] in peers:
+            peers.remove(self._socks[directory][1])
+        random.shuffle(peers)
+        sent = 0
+        message = str(count).encode()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            for peer in peers:
+                if sent >= count:
+                    break
+                try:
+                    sock.sendto(message, peer)
+                    sent += 1
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Process is gone; clean up after it
+                    try:
+                        os.unlink(peer)
+                    except OSError:
+                        pass
+                except OSError:
+                    continue
+        return sent > 0
+
+    def wake_all(self):
+        """Wake every waiting thread in this process (used on shutdown)"""
+        with self._cond:
+            self._tokens = self._waiters
+            self._cond.notify_all()
+
+    def wait(self, poll_timeout: float, deadline: Optional[float] = None) -> bool:
+        """Block until notified, the poll timeout passes or deadline is reached.
+
+        ``deadline`` is an epoch time. Returns True if woken by a notification.
+        """
+        self._listen()
+        with self._cond:
+            timeout = poll_timeout
+            armed = False
+            if deadline is not None and (self._armed is None or deadline < self._armed):
+                self._armed = deadline
+                armed = True
+                timeout = max(0.0, min(poll_timeout, deadline - time.time()))
+            self._waiters += 1
+            try:
+                if not self._tokens:
+                    self._cond.wait(timeout)
+                if self._tokens:
+                    self._tokens -= 1
+                    return True
+                return False
+            finally:
+                self._waiters -= 1
+                if armed and self._armed == deadline:
+                    self._armed = None
@@ -0,0 +1,71 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+class StackSampler:
+    """Statistical profiler that samples the Python stack of every thread.
+
+    Stacks are counted per ``interval`` and ``dump`` writes them to ``path``
+    in collapsed-stack format (``frame;frame;... N``) for flame graphs.
+    """
+
+    def __init__(self, path: str, interval: float = 0.005, dump_interval: float = 30.0):
+        self.path = path
+        self.interval = interval
+        self.dump_interval = dump_interval
+        self.samples = Counter()
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name="jobqueue-profiler")
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and write what was collected"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.dump()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = \
+                f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _run(self):
+        own = threading.get_ident()
+        next_dump = time.monotonic() + self.dump_interval
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                stacks.append(";".join(reversed(stack)))
+            with self._lock:
+                self.samples.update(stacks)
+            if time.monotonic() >= next_dump:
+                next_dump = time.monotonic() + self.dump_interval
+                self.dump()
+
+    def dump(self):
+        """Write the collapsed stacks so far, most sampled first"""
+        with self._lock:
+            lines = [f"{stack} {count}\n" for stack, count in self.samples.most_common()]
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(lines)
+        os.replace(tmp_path, self.path)
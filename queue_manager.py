@@ -1,74 +1,297 @@
+import json
+import os
+import socket
 import threading
 import time
-from typing import List, Optional
-from job import Job, JobState
-from storage import Storage
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple, Union
+from config import Config
+from hooks import span
+from job import DEFAULT_QUEUE, MAX_PRIORITY, MIN_PRIORITY, Job, JobState, parse_timestamp
+from joblog import JobLog
+from metrics import (ENQUEUE_SECONDS, JOBS_CLAIMED, JOBS_DEDUPLICATED, JOBS_ENQUEUED,
+                     JOBS_FINISHED, TimedLock, collect, render)
+from notify import WakeupChannel
+from retention import Archive, apply_retention
+from storage import Storage, create_storage, list_queues
 
 class QueueManager:
-    def __init__(self, storage: Storage):
+    def __init__(self, storage: Storage, config: Config = None,
+                 wakeup: WakeupChannel = None, queue: str = DEFAULT_QUEUE):
+        """Manage one queue's jobs; named queues share the default queue's ``config``"""
         self.storage = storage
-        self.processing_lock = threading.Lock()
+        self.queue = queue
+        self.config = config or Config(storage)
+        self.wakeup_dir = storage.data_file + ".wakeup"
+        if wakeup is None:
+            wakeup = WakeupChannel(self.wakeup_dir)
+        else:
+            wakeup.add_directory(self.wakeup_dir)
+        self.wakeup = wakeup
+        self.processing_lock = TimedLock(threading.Lock(), "processing")
         self.active_workers = 0
         self.shutdown_flag = False
     
-    def enqueue(self, command: str, max_retries: int = None) -> Job:
-        """Enqueue a new job"""
+    def enqueue(self, command: str, max_retries: int = None, run_at: datetime = None,
+                timeout: float = None, priority: int = 0, idempotency_key: str = None) -> Job:
+        """Enqueue a new job, optionally held back until run_at (UTC).
+
+        With an ``idempotency_key`` that is still live the existing job is
+        returned instead, see ``enqueue_spec``.
+        """
+        return self.enqueue_deduplicated(command, max_retries, run_at, timeout, priority,
+                                         idempotency_key)[0]
+    
+    def enqueue_deduplicated(self, command: str, max_retries: int = None,
+                             run_at: datetime = None, timeout: float = None, priority: int = 0,
+                             idempotency_key: str = None) -> Tuple[Job, bool]:
+        """Like ``enqueue``, but also returns whether the job was deduplicated.
+
+        The flag is True when an existing job holding ``idempotency_key``
+        was returned instead of enqueueing a new one.
+        """
+        if max_retries is None:
+            max_retries = self.config.max_retries
+        if not MIN_PRIORITY <= priority <= MAX_PRIORITY:
+            raise ValueError(f"priority must be between {MIN_PRIORITY} and {MAX_PRIORITY}")
+        
+        check_idempotency_key(idempotency_key)
+        job = Job(command=command, max_retries=max_retries, run_at=run_at, timeout=timeout,
+                  priority=priority, queue=self.queue, idempotency_key=idempotency_key)
+        return self._submit([job])[0]
+    
+    def build_job(self, spec: dict) -> Job:
+        """Validate a JSON job spec and build the Job it describes.
+
+        Raises ValueError if the spec is malformed or its ``queue`` names
+        another queue than this one.
+        """
+        if not isinstance(spec, dict):
+            raise ValueError("job spec must be a JSON object")
+        queue = spec.get("queue", self.queue)
+        if not isinstance(queue, str):
+            raise ValueError("'queue' must be a string")
+        if queue != self.queue:
+            raise ValueError(f"spec is for queue '{queue}', not '{self.queue}'")
+        command = spec.get("command")
+        if not isinstance(command, str) or not command.strip():
+            raise ValueError("'command' must be a non-empty string")
+        max_retries = spec.get("max_retries")
         if max_retries is None:
-            max_retries = int(self.storage.get_config("max_retries", 3))
+            max_retries = self.config.max_retries
+        elif isinstance(max_retries, bool) or not isinstance(max_retries, int) or max_retries < 0:
+            raise ValueError("'max_retries' must be a non-negative integer")
         
-        job = Job(command=command, max_retries=max_retries)
-        self.storage.save_job(job)
+        run_at = None
+        if spec.get("delay") is not None and spec.get("run_at") is not None:
+            raise ValueError("use either 'delay' or 'run_at', not both")
+        if spec.get("delay") is not None:
+            if not isinstance(spec["delay"], (int, float)):
+                raise ValueError("'delay' must be a number of seconds")
+            run_at = datetime.utcnow() + timedelta(seconds=spec["delay"])
+        elif spec.get("run_at") is not None:
+            run_at = parse_timestamp(str(spec["run_at"]))
+        
+        timeout = spec.get("timeout")
+        if timeout is not None and (isinstance(timeout, bool) or
+                                    not isinstance(timeout, (int, float)) or timeout <= 0):
+            raise ValueError("'timeout' must be a positive number of seconds")
+        priority = spec.get("priority", 0)
+        if isinstance(priority, bool) or not isinstance(priority, int) or \
+                not MIN_PRIORITY <= priority <= MAX_PRIORITY:
+            raise ValueError(f"'priority' must be an integer from {MIN_PRIORITY} to {MAX_PRIORITY}")
+        idempotency_key = spec.get("idempotency_key")
+        check_idempotency_key(idempotency_key)
+        return Job(command=command, max_retries=max_retries, run_at=run_at, timeout=timeout,
+                   priority=priority, queue=self.queue, idempotency_key=idempotency_key)
+    
+    def enqueue_spec(self, spec: dict) -> Job:
+        """Enqueue a job from a JSON job spec.
+
+        A spec with an ``idempotency_key`` already used by a job of this
+        queue created within the ``idempotency_ttl`` config returns that
+        job rather than enqueueing another, so producers can safely retry.
+        """
+        return self._submit([self.build_job(spec)])[0][0]
+    
+    def enqueue_many(self, specs: Iterable[Union[dict, str]],
+                     chunk_size: int = 1000) -> Tuple[int, List[Tuple[int, str]]]:
+        """Enqueue a stream of job specs, one storage write per chunk.
+
+        Specs may be dicts or JSON strings (blank strings are skipped).
+        Returns the number of jobs enqueued, not counting specs whose
+        idempotency key matched an existing job, and a list of
+        ``(position, error)`` for specs that were rejected, where position
+        counts from 1.
+        """
+        count = 0
+        errors = []
+        chunk = []
+        for position, spec in enumerate(specs, 1):
+            try:
+                if isinstance(spec, str):
+                    if not spec.strip():
+                        continue
+                    spec = json.loads(spec)
+                chunk.append(self.build_job(spec))
+            except ValueError as e:
+                errors.append((position, str(e)))
+                continue
+            if len(chunk) >= chunk_size:
+                count += _count_new(self._submit(chunk))
+                chunk = []
+        if chunk:
+            count += _count_new(self._submit(chunk))
+        return count, errors
+    
+    def _submit(self, jobs: List[Job]) -> List[Tuple[Job, bool]]:
+        """Persist new jobs in one write and wake workers for the due ones.
+
+        Returns ``(job, deduplicated)`` for each of ``jobs``: the job
+        itself and False, or for a job with a live idempotency key the
+        existing job holding it and True.
+        """
+        start = time.perf_counter()
+        results = [(job, False) for job in jobs]
+        if any(job.idempotency_key is not None for job in jobs):
+            stored = self.storage.save_unique_jobs(jobs, self.config.idempotency_ttl)
+            results = [(kept, kept is not job) for job, kept in zip(jobs, stored)]
+            new = [job for job, kept in zip(jobs, stored) if kept is job]
+            if len(new) < len(jobs):
+                JOBS_DEDUPLICATED.inc(len(jobs) - len(new))
+            jobs = new
+        elif len(jobs) == 1:
+            self.storage.save_job(jobs[0])
+        else:
+            self.storage.save_jobs(jobs)
+        due = sum(1 for job in jobs if job.is_due())
+        if due:
+            self.wakeup.notify(due, self.wakeup_dir)
+        ENQUEUE_SECONDS.observe(time.perf_counter() - start)
+        JOBS_ENQUEUED.inc(len(jobs))
+        return results
+    
+    @property
+    def owner(self) -> str:
+        """Default lease owner for claims made by this process"""
+        return f"{socket.gethostname()}:{os.getpid()}"
+    
+    def get_next_pending_job(self, owner: str = None) -> Optional[Job]:
+        """Claim the next job atomically, leased to owner"""
+        lease_seconds = self.config.lease_seconds
+        with span("claim", queue=self.queue, owner=owner, limit=1), self.processing_lock:
+            job = self.storage.claim_next_job(owner or self.owner, lease_seconds)
+        if job:
+            JOBS_CLAIMED.inc()
         return job
     
-    def get_next_pending_job(self) -> Optional[Job]:
-        """Get next pending job atomically"""
-        with self.processing_lock:
-            pending_jobs = self.storage.get_jobs_by_state(JobState.PENDING)
-            if not pending_jobs:
-                return None
-            
-            # Also check for failed jobs that can be retried
-            failed_jobs = self.storage.get_jobs_by_state(JobState.FAILED)
-            retryable_jobs = [job for job in failed_jobs if job.can_retry()]
-            
-            all_available = pending_jobs + retryable_jobs
-            if not all_available:
-                return None
-            
-            # Sort by created_at to ensure FIFO
-            all_available.sort(key=lambda x: x.created_at)
-            job = all_available[0]
-            
-            # Mark as processing
-            job.mark_processing()
-            self.storage.save_job(job)
-            return job
-    
-    def complete_job(self, job: Job):
+    def claim_jobs(self, owner: str = None, limit: int = 1, parallel: int = 1) -> List[Job]:
+        """Claim up to limit jobs in one critical section.
+
+        ``parallel`` is how many of them the caller starts at once; those
+        share the configured lease, later ones get longer leases.
+        """
+        lease_seconds = self.config.lease_seconds
+        with span("claim", queue=self.queue, owner=owner, limit=limit), self.processing_lock:
+            jobs = self.storage.claim_jobs(owner or self.owner, lease_seconds, limit, parallel)
+        if jobs:
+            JOBS_CLAIMED.inc(len(jobs))
+        return jobs
+    
+    def release_jobs(self, jobs: List[Job], owner: str = None) -> int:
+        """Return prefetched jobs that were never started to the queue"""
+        if not jobs:
+            return 0
+        with span("transition", queue=self.queue, jobs=jobs, state=JobState.PENDING.value):
+            released = self.storage.release_jobs(jobs, owner or self.owner)
+        if released:
+            self.wakeup.notify(released, self.wakeup_dir)
+        return released
+    
+    def job_timeout(self, job: Job) -> float:
+        """Seconds a job's command may run before its process group is killed"""
+        return job.timeout or self.config.default_timeout
+    
+    def hold_lease(self, job: Job, seconds: float) -> bool:
+        """Make sure a claimed job's lease outlasts the next ``seconds``.
+
+        A job whose timeout is longer than the configured lease would
+        otherwise be claimed again by another worker while still running.
+        Returns False if the lease has already been lost.
+        """
+        owner = job.lease_owner
+        if owner is None or job.lease_expires_at is None:
+            return True
+        expires = datetime.utcnow() + timedelta(seconds=seconds)
+        if job.lease_expires_at >= expires:
+            return True
+        job.lease_expires_at = expires
+        return self.storage.save_claimed_job(job, owner)
+    
+    @property
+    def log_dir(self) -> str:
+        """Directory holding per-job output logs"""
+        return self.config.get("log_dir") or self.storage.data_file + ".logs"
+    
+    @property
+    def archive(self) -> Archive:
+        """Cold archive that retention moves finished jobs into"""
+        return Archive(self.config.get("archive_dir") or self.storage.data_file + ".archive")
+    
+    def run_retention(self, dry_run: bool = False) -> dict:
+        """Archive completed and dead jobs past their TTL or max count"""
+        return apply_retention(self.storage, self.archive, self.config, dry_run)
+    
+    def open_job_log(self, job: Job) -> JobLog:
+        """Open the output log a job's next attempt streams into"""
+        return JobLog(self.log_dir, job.id, self.config.log_max_bytes,
+                      self.config.log_backups, self.config.log_tail_bytes)
+    
+    def wait_for_work(self) -> bool:
+        """Block an idle worker until a job is enqueued or comes due.
+
+        Falls back to waking every ``idle_poll_seconds`` in case a
+        notification was missed.
+        """
+        return self.wakeup.wait(self.config.idle_poll_seconds, self.storage.next_due())
+    
+    def _save_transition(self, job: Job, owner: Optional[str]) -> bool:
+        """Persist a claimed job's transition if its lease is still held"""
+        with span("transition", queue=self.queue, jobs=[job], state=job.state.value):
+            if owner is None:
+                self.storage.save_job(job)
+                saved = True
+            else:
+                saved = self.storage.save_claimed_job(job, owner)
+        if saved:
+            JOBS_FINISHED.inc(1, job.state.value)
+        return saved
+    
+    def complete_job(self, job: Job) -> bool:
         """Mark job as completed"""
+        owner = job.lease_owner
         job.mark_completed()
-        self.storage.save_job(job)
+        return self._save_transition(job, owner)
     
-    def fail_job(self, job: Job):
-        """Mark job as failed (with retry logic)"""
+    def fail_job(self, job: Job) -> bool:
+        """Mark job as failed and schedule its retry after the backoff delay"""
+        owner = job.lease_owner
         job.mark_failed()
-        self.storage.save_job(job)
+        if job.state == JobState.FAILED:
+            job.schedule_in(job.calculate_backoff(self.config.base_delay,
+                                                  self.config.backoff_jitter))
+        return self._save_transition(job, owner)
     
     def get_stats(self) -> dict:
-        """Get queue statistics"""
-        all_jobs = self.storage.get_all_jobs()
+        """Get queue statistics from the storage's per-state counters"""
+        counts = self.storage.count_by_state()
         stats = {
-            "total_jobs": len(all_jobs),
-            "pending": 0,
-            "processing": 0,
-            "completed": 0,
-            "failed": 0,
-            "dead": 0,
-            "active_workers": self.active_workers
+            "total_jobs": sum(counts.values()),
+            "active_workers": self.active_workers,
+            "pending_by_priority": self.storage.count_by_priority(JobState.PENDING)
         }
-        
-        for job in all_jobs:
-            stats[job.state.value] += 1
+        for state in JobState:
+            stats[state.value] = counts.get(state.value, 0)
         
         return stats
     
@@ -83,5 +306,116 @@ class QueueManager:
             success = job.retry()
             if success:
                 self.storage.save_job(job)
+                self.wakeup.notify(1, self.wakeup_dir)
                 return True
-        return False
\ No newline at end of file
+        return False
+
+def check_idempotency_key(key):
+    """Raise ValueError unless key is None or a usable idempotency key"""
+    if key is not None and (not isinstance(key, str) or not 0 < len(key) <= 255):
+        raise ValueError("'idempotency_key' must be a string of 1 to 255 characters")
+
+def _count_new(results: List[Tuple[Job, bool]]) -> int:
+    """How many of _submit's results are new jobs rather than deduplicated ones"""
+    return sum(1 for _, deduplicated in results if not deduplicated)
+
+def open_queues(queues: List[str] = None, data_file: str = None,
+                backend: str = None) -> List[QueueManager]:
+    """Managers for the named queues (just the default one if None).
+
+    They share the default queue's config and one wakeup channel, so a
+    worker serving all of them sleeps until any one gets work.
+    """
+    config = Config(create_storage(data_file, backend))
+    wakeup = None
+    managers = []
+    for queue in queues or [DEFAULT_QUEUE]:
+        manager = QueueManager(create_storage(data_file, backend, queue), config, wakeup, queue)
+        wakeup = manager.wakeup
+        managers.append(manager)
+    return managers
+
+def metrics_text(data_file: str = None, backend: str = None) -> str:
+    """Prometheus text for the metrics workers published plus job counts.
+
+    Worker processes publish to ``<data_file>.metrics``; the job counts are
+    read from every queue's storage when this is called.
+    """
+    storage = create_storage(data_file, backend)
+    snap = collect(storage.data_file + ".metrics")
+    series = []
+    for queue in list_queues(storage.data_file):
+        partition = storage if queue == DEFAULT_QUEUE else \
+            create_storage(storage.data_file, backend, queue)
+        counts = partition.count_by_state()
+        series.extend([[queue, state.value], counts.get(state.value, 0)] for state in JobState)
+    snap["jobqueue_jobs"] = {"type": "gauge", "help": "Jobs in each queue by state",
+                             "labels": ["queue", "state"], "series": series}
+    return render(snap)
+
+class QueueSet:
+    """Several queues behind the QueueManager methods a worker uses.
+
+    Claims start at a different queue each time and move on to the next
+    while the limit isn't reached, so every subscribed queue is served even
+    when one of them is always busy. A claimed job's transitions go to the
+    manager of the queue it came from.
+    """
+
+    def __init__(self, managers: List[QueueManager]):
+        self.managers = {manager.queue: manager for manager in managers}
+        first = managers[0]
+        self.config = first.config
+        self.wakeup = first.wakeup
+        self.active_workers = 0
+        self._order = list(self.managers.values())
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _manager(self, job: Job) -> QueueManager:
+        return self.managers[job.queue]
+
+    def claim_jobs(self, owner: str = None, limit: int = 1, parallel: int = 1) -> List[Job]:
+        """Claim up to limit jobs, visiting the queues round-robin"""
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self._order)
+        jobs = []
+        for i in range(len(self._order)):
+            manager = self._order[(start + i) % len(self._order)]
+            for job in manager.claim_jobs(owner, limit - len(jobs),
+                                          max(1, parallel - len(jobs))):
+                # The partition a job was claimed from decides where it's saved
+                job.queue = manager.queue
+                jobs.append(job)
+            if len(jobs) >= limit:
+                break
+        return jobs
+
+    def release_jobs(self, jobs: List[Job], owner: str = None) -> int:
+        by_queue = {}
+        for job in jobs:
+            by_queue.setdefault(job.queue, []).append(job)
+        return sum(self.managers[queue].release_jobs(queued, owner)
+                   for queue, queued in by_queue.items())
+
+    def job_timeout(self, job: Job) -> float:
+        return self._manager(job).job_timeout(job)
+
+    def hold_lease(self, job: Job, seconds: float) -> bool:
+        return self._manager(job).hold_lease(job, seconds)
+
+    def open_job_log(self, job: Job) -> JobLog:
+        return self._manager(job).open_job_log(job)
+
+    def complete_job(self, job: Job) -> bool:
+        return self._manager(job).complete_job(job)
+
+    def fail_job(self, job: Job) -> bool:
+        return self._manager(job).fail_job(job)
+
+    def wait_for_work(self) -> bool:
+        """Block until any of the queues gets a job or one comes due"""
+        due = [when for when in (manager.storage.next_due() for manager in self._order)
+               if when is not None]
+        return self.wakeup.wait(self.config.idle_poll_seconds, min(due) if due else None)
@@ -0,0 +1,165 @@
+import heapq
+import time
+from typing import Optional
+from job import parse_timestamp, to_epoch
+
+READY_STATES = ("pending", "failed")
+
+class WeightedRoundRobin:
+    """Smooth weighted round-robin choice between priority levels.
+
+    Level ``p`` has weight ``p + 1``. Every pick adds each candidate
+    level's weight to its credit, takes the level with the most credit
+    and charges it the total weight of the candidates. While several
+    levels have work, each gets picks in proportion to its weight, spread
+    evenly rather than in bursts, so a backlog at a low level still makes
+    steady progress next to a busy high one.
+    """
+
+    def __init__(self):
+        self._credit = {}
+
+    def choose(self, levels) -> int:
+        """Pick one of the given levels (which must not be empty)"""
+        credit = {}
+        total = 0
+        best = None
+        for level in sorted(levels, reverse=True):
+            weight = level + 1
+            credit[level] = self._credit.get(level, 0) + weight
+            total += weight
+            if best is None or credit[level] > credit[best]:
+                best = level
+        credit[best] -= total
+        # Levels that ran dry start afresh when they get work again
+        self._credit = credit
+        return best
+
+class ReadyIndex:
+    """Per-priority min-heaps of ready job IDs ordered by creation time.
+
+    ``update`` must see every job record written. Delayed jobs wait in a
+    ``run_at`` heap and leased jobs in a lease-expiry heap until due. Heaps
+    use lazy deletion against ``_entries``, keeping ``pop`` at O(log n).
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._leases = {}
+        self._scheduler = WeightedRoundRobin()
+        self._reset_heaps()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _reset_heaps(self):
+        self._heaps = {}
+        self._delayed = []
+        self._lease_heap = []
+
+    def update(self, job_data: dict):
+        """Index, re-index or drop a job based on its current record"""
+        job_id = job_data["id"]
+        state = job_data["state"]
+        self._update_lease(job_id, state, job_data.get("lease_expires_at"))
+        if state not in READY_STATES or (
+            state == "failed" and job_data["attempts"] >= job_data.get("max_retries", 3)
+        ):
+            self._entries.pop(job_id, None)
+            return
+
+        run_at = job_data.get("run_at")
+        entry = (job_data.get("priority", 0), to_epoch(parse_timestamp(job_data["created_at"])),
+                 to_epoch(parse_timestamp(run_at)) if run_at else 0.0)
+        if self._entries.get(job_id) == entry:
+            return
+        self._entries[job_id] = entry
+        if run_at:
+            heapq.heappush(self._delayed, (entry[2], job_id))
+        else:
+            heapq.heappush(self._heaps.setdefault(entry[0], []), (entry[1], job_id, entry[2]))
+        if len(self._delayed) + sum(map(len, self._heaps.values())) > 2 * len(self._entries) + 1024:
+            self._rebuild()
+
+    def _update_lease(self, job_id: str, state: str, lease_expires_at: Optional[str]):
+        if state != "processing" or not lease_expires_at:
+            self._leases.pop(job_id, None)
+            return
+        expires = to_epoch(parse_timestamp(lease_expires_at))
+        if self._leases.get(job_id) != expires:
+            self._leases[job_id] = expires
+            heapq.heappush(self._lease_heap, (expires, job_id))
+
+    def discard(self, job_id: str):
+        """Drop a job from the index"""
+        self._entries.pop(job_id, None)
+        self._leases.pop(job_id, None)
+
+    def _live_delayed(self):
+        delayed = self._delayed
+        while delayed:
+            entry = self._entries.get(delayed[0][1])
+            if entry is not None and entry[2] == delayed[0][0]:
+                return delayed[0]
+            heapq.heappop(delayed)
+        return None
+
+    def _live_lease(self):
+        lease_heap = self._lease_heap
+        while lease_heap and self._leases.get(lease_heap[0][1]) != lease_heap[0][0]:
+            heapq.heappop(lease_heap)
+        return lease_heap[0] if lease_heap else None
+
+    def next_due(self) -> Optional[float]:
+        """Epoch time at which the next scheduled job or lease comes due"""
+        times = [item[0] for item in (self._live_delayed(), self._live_lease()) if item]
+        return min(times) if times else None
+
+    def pop(self, now: float = None) -> Optional[str]:
+        """Remove and return the next claimable job ID.
+
+        Jobs whose lease has expired come first. Otherwise a priority
+        level with due jobs is chosen by weighted round-robin and its
+        oldest due job is taken.
+        """
+        now = time.time() if now is None else now
+        lease = self._live_lease()
+        if lease and lease[0] <= now:
+            heapq.heappop(self._lease_heap)
+            del self._leases[lease[1]]
+            return lease[1]
+
+        while True:
+            due = self._live_delayed()
+            if due is None or due[0] > now:
+                break
+            heapq.heappop(self._delayed)
+            priority, created, run_ts = self._entries[due[1]]
+            heapq.heappush(self._heaps.setdefault(priority, []), (created, due[1], run_ts))
+
+        levels = []
+        for priority, heap in self._heaps.items():
+            while heap and self._entries.get(heap[0][1]) != (priority, heap[0][0], heap[0][2]):
+                heapq.heappop(heap)
+            if heap:
+                levels.append(priority)
+        if not levels:
+            return None
+        priority = self._scheduler.choose(levels)
+        _, job_id, _ = heapq.heappop(self._heaps[priority])
+        del self._entries[job_id]
+        return job_id
+
+    def _rebuild(self):
+        """Drop stale heap entries left behind by lazy deletion"""
+        self._reset_heaps()
+        now = time.time()
+        for job_id, (priority, created, run_ts) in self._entries.items():
+            if run_ts > now:
+                self._delayed.append((run_ts, job_id))
+            else:
+                self._heaps.setdefault(priority, []).append((created, job_id, run_ts))
+        for job_id, expires in self._leases.items():
+            self._lease_heap.append((expires, job_id))
+        for heap in (*self._heaps.values(), self._delayed, self._lease_heap):
+            heapq.heapify(heap)
@@ -0,0 +1,130 @@
+import gzip
+import json
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List
+from filelock import FileLock
+from job import Job, JobState, parse_timestamp, to_epoch
+
+FINISHED_STATES = (JobState.COMPLETED, JobState.DEAD)
+
+SEGMENT_PATTERN = re.compile(r"^jobs-(\d{4}-\d{2}-\d{2})\.jsonl\.gz$")
+
+class Archive:
+    """Cold storage for finished jobs as gzip JSONL segments.
+
+    Jobs are appended to ``<directory>/jobs-YYYY-MM-DD.jsonl.gz`` for the
+    UTC day they finished on. Every append adds a new gzip member, so a
+    segment is never rewritten and a crash can at worst leave a truncated
+    last member, which queries skip. Queries decompress one segment at a
+    time and yield matching records as they are read, so memory stays flat
+    however much history there is.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        # Serializes retention runs across processes
+        self.lock = FileLock(directory + ".lock")
+
+    def segment_path(self, day: date) -> str:
+        return os.path.join(self.directory, f"jobs-{day.isoformat()}.jsonl.gz")
+
+    def segments(self, since: date = None, until: date = None) -> List[str]:
+        """Segment paths in day order, limited to [since, until] if given"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        paths = []
+        for name in sorted(names):
+            match = SEGMENT_PATTERN.match(name)
+            if not match:
+                continue
+            day = date.fromisoformat(match.group(1))
+            if (since and day < since) or (until and day > until):
+                continue
+            paths.append(os.path.join(self.directory, name))
+        return paths
+
+    def append(self, jobs: List[Job]):
+        """Append jobs to the segments for the days they finished on"""
+        by_day = {}
+        for job in jobs:
+            by_day.setdefault(job.updated_at.date(), []).append(job.to_dict())
+        os.makedirs(self.directory, exist_ok=True)
+        for day, records in sorted(by_day.items()):
+            payload = "".join(json.dumps(record) + "\n" for record in records)
+            with open(self.segment_path(day), "ab") as f:
+                f.write(gzip.compress(payload.encode()))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def query(self, state: str = None, since: datetime = None, until: datetime = None,
+              command: str = None, job_id: str = None) -> Iterator[dict]:
+        """Stream archived job records matching every given filter.
+
+        ``since``/``until`` bound the time the job finished; ``command``
+        matches a substring of the command.
+        """
+        for path in self.segments(since and since.date(), until and until.date()):
+            with gzip.open(path, "rt") as f:
+                try:
+                    for line in f:
+                        record = json.loads(line)
+                        if job_id and record["id"] != job_id:
+                            continue
+                        if state and record["state"] != state:
+                            continue
+                        if command and command not in record["command"]:
+                            continue
+                        if since or until:
+                            finished = parse_timestamp(record["updated_at"])
+                            if (since and finished < since) or (until and finished > until):
+                                continue
+                        yield record
+                except (EOFError, OSError):  # gzip.BadGzipFile is an OSError, 3.8+ only
+                    print(f"Warning: {path} ends in a truncated record batch, skipped")
+
+def expired_jobs(storage, config, now: datetime = None) -> List[Job]:
+    """Finished jobs past their state's TTL or beyond its max count"""
+    now = now or datetime.utcnow()
+    expired = []
+    for state in FINISHED_STATES:
+        ttl = getattr(config, f"{state.value}_ttl")
+        keep = getattr(config, f"{state.value}_max_jobs")
+        if not ttl and not keep:
+            continue
+        cutoff = to_epoch(now - timedelta(seconds=ttl)) if ttl else None
+        # Only records that expire are hydrated into Jobs
+        finished = sorted(((record.updated_ts, record) for record in storage.iter_records(state)),
+                          key=lambda entry: entry[0], reverse=True)
+        for index, (updated_ts, record) in enumerate(finished):
+            if (keep and index >= keep) or (cutoff and updated_ts < cutoff):
+                expired.append(record.job())
+    return expired
+
+def apply_retention(storage, archive: Archive, config, dry_run: bool = False,
+                    now: datetime = None, chunk_size: int = 1000) -> Dict[str, int]:
+    """Move expired finished jobs out of the hot store into the archive.
+
+    Each chunk is made durable in the archive before it is deleted from
+    storage. Jobs changed in the meantime (say, a DLQ retry) are left in
+    place, so their archived copy is only a superseded snapshot. Returns
+    the number of jobs archived per state.
+    """
+    counts = {state.value: 0 for state in FINISHED_STATES}
+    with archive.lock:
+        expired = expired_jobs(storage, config, now)
+        if dry_run:
+            for job in expired:
+                counts[job.state.value] += 1
+            return counts
+        for start in range(0, len(expired), chunk_size):
+            chunk = expired[start:start + chunk_size]
+            archive.append(chunk)
+            deleted = set(storage.delete_jobs(chunk))
+            for job in chunk:
+                if job.id in deleted:
+                    counts[job.state.value] += 1
+    return counts
@@ -8,6 +8,10 @@ setup(
         "click>=8.0.0",
         "psutil>=5.8.0",
     ],
+    extras_require={
+        "fast": ["orjson>=3.0"],
+        "msgpack": ["msgpack>=1.0"],
+    },
     entry_points={
         'console_scripts': [
             'jobqueue=main:cli',
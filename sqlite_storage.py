@@ -0,0 +1,494 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+from hooks import traced
+from job import (MAX_PRIORITY, MIN_PRIORITY, Job, JobRecord, JobState, decode_cursor,
+                 stacked_lease)
+from metrics import LOCK_WAIT_SECONDS, STORAGE_BYTES, STORAGE_SECONDS
+from ready_index import WeightedRoundRobin
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    created_ts REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    max_retries INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS config (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Columns added after the first release, created on open if missing
+COLUMNS = {
+    "lease_owner": "TEXT",
+    "lease_expires_ts": "REAL",
+    "run_ts": "REAL",
+    "priority": "INTEGER NOT NULL DEFAULT 0",
+    "idempotency_key": "TEXT",
+}
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_jobs_state_created ON jobs (state, created_ts);
+CREATE INDEX IF NOT EXISTS idx_jobs_state_lease ON jobs (state, lease_expires_ts);
+CREATE INDEX IF NOT EXISTS idx_jobs_state_run ON jobs (state, run_ts);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_ts, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_state_priority ON jobs (state, priority, created_ts);
+CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (state, priority, run_ts, created_ts);
+CREATE INDEX IF NOT EXISTS idx_jobs_idempotency ON jobs (idempotency_key, created_ts)
+    WHERE idempotency_key IS NOT NULL;
+"""
+
+# An UPDATE on conflict rather than INSERT OR REPLACE, whose implicit
+# delete would bypass the counter triggers
+UPSERT = (
+    "INSERT INTO jobs (id, state, created_ts, attempts, max_retries, data, "
+    "lease_owner, lease_expires_ts, run_ts, priority, idempotency_key) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (id) DO UPDATE SET state = excluded.state, created_ts = excluded.created_ts, "
+    "attempts = excluded.attempts, max_retries = excluded.max_retries, data = excluded.data, "
+    "lease_owner = excluded.lease_owner, lease_expires_ts = excluded.lease_expires_ts, "
+    "run_ts = excluded.run_ts, priority = excluded.priority, "
+    "idempotency_key = excluded.idempotency_key"
+)
+
+# The newest job created with an idempotency key after :since, one seek
+# on the partial idx_jobs_idempotency index
+LIVE_KEY_QUERY = """
+SELECT data FROM jobs WHERE idempotency_key = :key AND created_ts > :since
+ORDER BY created_ts DESC LIMIT 1
+"""
+
+# Per-state job counts kept in step with the jobs table by triggers, so
+# they change in the same transaction as the job itself. There is a row
+# for every state from the start; triggers only ever update them.
+COUNTERS = (
+    """CREATE TABLE IF NOT EXISTS job_counts (
+        state TEXT PRIMARY KEY,
+        count INTEGER NOT NULL
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS job_counts_insert AFTER INSERT ON jobs BEGIN
+        UPDATE job_counts SET count = count + 1 WHERE state = NEW.state;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS job_counts_delete AFTER DELETE ON jobs BEGIN
+        UPDATE job_counts SET count = count - 1 WHERE state = OLD.state;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS job_counts_update AFTER UPDATE OF state ON jobs
+    WHEN OLD.state IS NOT NEW.state BEGIN
+        UPDATE job_counts SET count = count - 1 WHERE state = OLD.state;
+        UPDATE job_counts SET count = count + 1 WHERE state = NEW.state;
+    END""",
+)
+
+RECOUNT_QUERY = "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+
+# A processing job whose lease has expired, claimed before anything else
+EXPIRED_CLAIM_QUERY = """
+SELECT data FROM jobs WHERE state = 'processing' AND lease_expires_ts <= :now
+ORDER BY lease_expires_ts LIMIT 1
+"""
+
+# Candidates at every priority for each ready state: the oldest job
+# without a run_at and the oldest job whose run_at has come due, so that,
+# as with ReadyIndex, due jobs are claimed in creation order. Both branches
+# seek the (state, priority, run_ts, created_ts) index, so jobs still
+# waiting for their run_at or backoff are never scanned.
+READY_CLAIM_QUERY = " UNION ALL ".join(
+    f"""SELECT * FROM (SELECT priority, created_ts, data FROM jobs
+                       WHERE state = '{state}' AND priority = {priority}{retryable}
+                         AND {due}
+                       ORDER BY created_ts LIMIT 1)"""
+    for priority in range(MIN_PRIORITY, MAX_PRIORITY + 1)
+    for state, retryable in (("pending", ""), ("failed", " AND attempts < max_retries"))
+    for due in ("run_ts IS NULL", "run_ts <= :now")
+)
+
+NEXT_DUE_QUERY = """
+SELECT MIN(ts) FROM (
+    SELECT MIN(run_ts) AS ts FROM jobs WHERE state = 'pending' AND run_ts > :now
+    UNION ALL
+    SELECT MIN(run_ts) FROM jobs WHERE state = 'failed' AND run_ts > :now
+    UNION ALL
+    SELECT MIN(lease_expires_ts) FROM jobs WHERE state = 'processing'
+)
+"""
+
+class SQLiteStorage:
+    """Job store backed by a SQLite database in WAL mode.
+
+    Exposes the same API as ``Storage``. Jobs are kept as JSON documents
+    alongside the columns used for lookups; ``id`` is the primary key and
+    ``(state, created_ts)`` is indexed so claiming the next job is an index
+    seek. Each thread gets its own connection, and WAL lets several worker
+    processes share one database file; claims run in ``BEGIN IMMEDIATE``
+    transactions, so SQLite's own file locking serializes them across
+    processes. Like ``ReadyIndex``, claims choose between priority levels
+    with a ``WeightedRoundRobin``, kept per instance.
+    """
+
+    def __init__(self, data_file="jobqueue_data.db", timeout=30.0):
+        self.data_file = data_file
+        self.timeout = timeout
+        self._local = threading.local()
+        self._scheduler = WeightedRoundRobin()
+        self._scheduler_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, decl in COLUMNS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {decl}")
+        conn.executescript(INDEXES)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            fresh = not conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'job_counts'").fetchone()
+            for statement in COUNTERS:
+                conn.execute(statement)
+            if fresh:
+                # Databases from before the counters existed start from a recount
+                self._recount(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _recount(self, conn: sqlite3.Connection):
+        """Reset the counters from the jobs table (inside a transaction)"""
+        conn.execute("DELETE FROM job_counts")
+        conn.executemany("INSERT INTO job_counts (state, count) VALUES (?, 0)",
+                         [(state.value,) for state in JobState])
+        for state, count in conn.execute(RECOUNT_QUERY).fetchall():
+            conn.execute("UPDATE job_counts SET count = ? WHERE state = ?", (count, state))
+
+    def _begin(self, conn: sqlite3.Connection) -> float:
+        """BEGIN IMMEDIATE, recording the wait for SQLite's write lock"""
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        started = time.perf_counter()
+        LOCK_WAIT_SECONDS.observe(started - start, "sqlite")
+        return started
+
+    def _commit(self, conn: sqlite3.Connection, started: float):
+        """COMMIT a transaction opened by _begin, recording how long it took"""
+        conn.execute("COMMIT")
+        STORAGE_SECONDS.observe(time.perf_counter() - started, "write")
+
+    def _observe_read(self, start: float, rows: list):
+        """Record a query that began at perf_counter() start and its rows' data"""
+        STORAGE_SECONDS.observe(time.perf_counter() - start, "read")
+        STORAGE_BYTES.inc(sum(len(row[0]) for row in rows), "read")
+
+    def _conn(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.data_file, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _row_params(self, job: Job):
+        data = json.dumps(job.to_dict(), separators=(",", ":"))
+        STORAGE_BYTES.inc(len(data), "write")
+        return (job.id, job.state.value, job.created_ts, job.attempts,
+                job.max_retries, data, job.lease_owner, job.lease_expires_ts, job.run_ts,
+                job.priority, job.idempotency_key)
+
+    @traced("storage")
+    def save_job(self, job: Job):
+        """Save or update a job"""
+        start = time.perf_counter()
+        self._conn().execute(UPSERT, self._row_params(job))
+        STORAGE_SECONDS.observe(time.perf_counter() - start, "write")
+
+    @traced("storage")
+    def save_claimed_job(self, job: Job, owner: str) -> bool:
+        """Save a job only if ``owner`` still holds its claim lease"""
+        conn = self._conn()
+        started = self._begin(conn)
+        try:
+            row = conn.execute("SELECT lease_owner FROM jobs WHERE id = ?", (job.id,)).fetchone()
+            if row is None or row[0] != owner:
+                self._commit(conn, started)
+                return False
+            conn.execute(UPSERT, self._row_params(job))
+            self._commit(conn, started)
+            return True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @traced("storage")
+    def save_jobs(self, jobs: List[Job]):
+        """Save many jobs in a single transaction"""
+        self.import_jobs(jobs)
+
+    def import_jobs(self, jobs: List[Job], config: dict = None):
+        """Insert many jobs and config values in a single transaction"""
+        conn = self._conn()
+        started = self._begin(conn)
+        try:
+            conn.executemany(UPSERT, (self._row_params(job) for job in jobs))
+            for key, value in (config or {}).items():
+                conn.execute("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
+                             (key, json.dumps(value)))
+            self._commit(conn, started)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @traced("storage")
+    def save_unique_jobs(self, jobs: List[Job], key_ttl: float) -> List[Job]:
+        """Save new jobs unless their idempotency key is still live.
+
+        Works like ``Storage.save_unique_jobs``, looking keys up in the
+        idempotency index inside one write transaction.
+        """
+        since = time.time() - key_ttl
+        conn = self._conn()
+        started = self._begin(conn)
+        try:
+            stored = []
+            for job in jobs:
+                existing = None
+                if job.idempotency_key is not None:
+                    # Sees jobs inserted earlier in this batch too
+                    row = conn.execute(LIVE_KEY_QUERY, {"key": job.idempotency_key,
+                                                        "since": since}).fetchone()
+                    if row:
+                        existing = Job.from_dict(json.loads(row[0]))
+                if existing is None:
+                    conn.execute(UPSERT, self._row_params(job))
+                    existing = job
+                stored.append(existing)
+            self._commit(conn, started)
+            return stored
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def claim_next_job(self, owner: str = None, lease_seconds: float = None) -> Optional[Job]:
+        """Select the next claimable job and lease it to ``owner`` in one transaction"""
+        jobs = self.claim_jobs(owner, lease_seconds, 1)
+        return jobs[0] if jobs else None
+
+    @traced("storage")
+    def claim_jobs(self, owner: str = None, lease_seconds: float = None,
+                   limit: int = 1, parallel: int = 1) -> List[Job]:
+        """Claim up to ``limit`` jobs in one transaction.
+
+        Jobs are leased in rounds of ``parallel``, the number the caller
+        starts at once: the first round gets ``lease_seconds``, the next
+        twice that and so on, so jobs waiting in a worker's buffer don't
+        expire while the ones ahead of them run.
+        """
+        conn = self._conn()
+        started = self._begin(conn)
+        try:
+            jobs = []
+            now = time.time()
+            while len(jobs) < limit:
+                data = self._next_claimable(conn, now)
+                if data is None:
+                    break
+                job = Job.from_dict(json.loads(data))
+                lease = stacked_lease(lease_seconds, len(jobs), parallel)
+                job.mark_processing(owner, lease)
+                conn.execute(UPSERT, self._row_params(job))
+                jobs.append(job)
+            self._commit(conn, started)
+            return jobs
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _next_claimable(self, conn: sqlite3.Connection, now: float) -> Optional[str]:
+        """Data of the job to claim next, chosen like ReadyIndex.pop"""
+        row = conn.execute(EXPIRED_CLAIM_QUERY, {"now": now}).fetchone()
+        if row:
+            return row[0]
+        heads = {}
+        for priority, created_ts, data in conn.execute(READY_CLAIM_QUERY, {"now": now}):
+            if priority not in heads or created_ts < heads[priority][0]:
+                heads[priority] = (created_ts, data)
+        if not heads:
+            return None
+        with self._scheduler_lock:
+            priority = self._scheduler.choose(heads)
+        return heads[priority][1]
+
+    @traced("storage")
+    def release_jobs(self, jobs: List[Job], owner: str) -> int:
+        """Return claimed but unstarted jobs to the queue if owner still holds them"""
+        conn = self._conn()
+        started = self._begin(conn)
+        try:
+            released = 0
+            for job in jobs:
+                row = conn.execute("SELECT lease_owner FROM jobs WHERE id = ?", (job.id,)).fetchone()
+                if row is None or row[0] != owner:
+                    continue
+                job.release()
+                conn.execute(UPSERT, self._row_params(job))
+                released += 1
+            self._commit(conn, started)
+            return released
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @traced("storage")
+    def next_due(self) -> Optional[float]:
+        """Epoch time at which the next scheduled job or lease comes due"""
+        row = self._conn().execute(NEXT_DUE_QUERY, {"now": time.time()}).fetchone()
+        return row[0]
+
+    @traced("storage")
+    def get_job(self, job_id: str) -> Optional[Job]:
+        """Get a job by ID"""
+        start = time.perf_counter()
+        row = self._conn().execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        self._observe_read(start, [row] if row else [])
+        if row:
+            return Job.from_dict(json.loads(row[0]))
+        return None
+
+    @traced("storage")
+    def get_jobs_by_state(self, state: JobState) -> List[Job]:
+        """Get all jobs with specified state"""
+        rows = self._conn().execute(
+            "SELECT data FROM jobs WHERE state = ? ORDER BY created_ts", (state.value,)
+        )
+        return [Job.from_dict(json.loads(row[0])) for row in rows]
+
+    @traced("storage")
+    def get_all_jobs(self) -> List[Job]:
+        """Get all jobs"""
+        rows = self._conn().execute("SELECT data FROM jobs ORDER BY created_ts")
+        return [Job.from_dict(json.loads(row[0])) for row in rows]
+
+    def iter_jobs(self, state: JobState = None, after: str = None, limit: int = None,
+                  batch_size: int = 1000) -> Iterator[Job]:
+        """Yield jobs in creation order, resuming after a cursor"""
+        for record in self.iter_records(state, after, limit, batch_size):
+            yield record.job()
+
+    def iter_records(self, state: JobState = None, after: str = None, limit: int = None,
+                     batch_size: int = 1000) -> Iterator[JobRecord]:
+        """Like iter_jobs, but yields record views without building Jobs.
+
+        Pages through the ``(created_ts, id)`` order with a keyset query per
+        batch, so no read transaction stays open between batches.
+        """
+        position = decode_cursor(after) if after else None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            clauses, params = [], []
+            if state is not None:
+                clauses.append("state = ?")
+                params.append(state.value)
+            if position is not None:
+                clauses.append("(created_ts, id) > (?, ?)")
+                params.extend(position)
+            where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+            count = batch_size if remaining is None else min(batch_size, remaining)
+            start = time.perf_counter()
+            rows = self._conn().execute(
+                f"SELECT data, created_ts, id FROM jobs {where}"
+                "ORDER BY created_ts, id LIMIT ?", (*params, count)).fetchall()
+            self._observe_read(start, rows)
+            for data, _, _ in rows:
+                yield JobRecord(json.loads(data))
+            if len(rows) < count:
+                return
+            position = rows[-1][1:]
+            if remaining is not None:
+                remaining -= len(rows)
+
+    @traced("storage")
+    def count_by_priority(self, state: JobState = JobState.PENDING) -> Dict[int, int]:
+        """Number of jobs in ``state`` at each priority"""
+        rows = self._conn().execute(
+            "SELECT priority, COUNT(*) FROM jobs WHERE state = ? GROUP BY priority",
+            (state.value,))
+        return dict(rows.fetchall())
+
+    @traced("storage")
+    def delete_job(self, job_id: str):
+        """Delete a job"""
+        cursor = self._conn().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return cursor.rowcount > 0
+
+    @traced("storage")
+    def delete_jobs(self, jobs: List[Job]) -> List[str]:
+        """Delete jobs whose stored record has not changed since they were read.
+
+        Returns the IDs that were deleted.
+        """
+        conn = self._conn()
+        deleted = []
+        started = self._begin(conn)
+        try:
+            for job in jobs:
+                row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job.id,)).fetchone()
+                if row and json.loads(row[0])["updated_at"] == job.to_dict()["updated_at"]:
+                    conn.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+                    deleted.append(job.id)
+            self._commit(conn, started)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return deleted
+
+    @traced("storage")
+    def count_by_state(self) -> Dict[str, int]:
+        """Number of jobs in each state, read from the trigger-maintained counters"""
+        rows = self._conn().execute("SELECT state, count FROM job_counts WHERE count != 0")
+        return dict(rows.fetchall())
+
+    def check_counts(self, repair: bool = False) -> Dict[str, tuple]:
+        """Compare the stored counters with a full recount.
+
+        Returns ``{state: (stored, actual)}`` for states that disagree.
+        With ``repair`` the counters are reset to the recount.
+        """
+        conn = self._conn()
+        started = self._begin(conn)
+        try:
+            stored = dict(conn.execute("SELECT state, count FROM job_counts").fetchall())
+            actual = dict(conn.execute(RECOUNT_QUERY).fetchall())
+            mismatches = {state: (stored.get(state, 0), actual.get(state, 0))
+                          for state in set(stored) | set(actual)
+                          if stored.get(state, 0) != actual.get(state, 0)}
+            if repair and mismatches:
+                self._recount(conn)
+            self._commit(conn, started)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return mismatches
+
+    def get_config(self, key: str, default=None):
+        """Get configuration value"""
+        row = self._conn().execute("SELECT value FROM config WHERE key = ?", (key,)).fetchone()
+        if row:
+            return json.loads(row[0])
+        return default
+
+    def get_all_config(self) -> dict:
+        """Get all configuration values"""
+        rows = self._conn().execute("SELECT key, value FROM config")
+        return {key: json.loads(value) for key, value in rows}
+
+    def set_config(self, key: str, value):
+        """Set configuration value"""
+        self._conn().execute("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
+                             (key, json.dumps(value)))
@@ -1,82 +1,675 @@
+import bisect
 import json
 import os
+import re
 import threading
-from typing import List, Optional
-from job import Job, JobState
+import time
+from typing import Dict, Iterator, List, Optional
+from codec import CODECS, detect_codec, encode, get_codec
+from filelock import FileLock
+from hooks import traced
+from job import (DEFAULT_QUEUE, Job, JobRecord, JobState, decode_cursor, parse_timestamp,
+                 stacked_lease, to_epoch)
+from metrics import STORAGE_BYTES, STORAGE_SECONDS, TimedLock
+from ready_index import ReadyIndex
+
+# Journal records stay line-delimited JSON whatever the snapshot codec
+JOURNAL = CODECS["json"]
+
+def _read(f) -> bytes:
+    """Read the rest of an open storage file, recording the time and bytes"""
+    start = time.perf_counter()
+    data = f.read()
+    STORAGE_SECONDS.observe(time.perf_counter() - start, "read")
+    STORAGE_BYTES.inc(len(data), "read")
+    return data
+
+def _written(start: float, size: int):
+    """Record a write of size bytes that began at perf_counter() start"""
+    STORAGE_SECONDS.observe(time.perf_counter() - start, "write")
+    STORAGE_BYTES.inc(size, "write")
 
 class Storage:
-    def __init__(self, data_file="jobqueue_data.json"):
+    """Job store backed by a snapshot file plus an append-only journal.
+
+    ``data_file`` holds a snapshot of all jobs, written with ``codec`` (see
+    codec.py), and every mutation is appended as one JSON line to
+    ``<data_file>.journal``. In-memory state is built on first use and kept
+    current by tailing the journal, which is folded into a new snapshot
+    once it passes ``compact_threshold`` records. Mutations run under
+    ``file_lock``, an fcntl lock on ``<data_file>.lock``, so processes
+    sharing one data file never interleave writes or claim the same job.
+    """
+
+    def __init__(self, data_file="jobqueue_data.json", compact_threshold=10000):
         self.data_file = data_file
-        self.lock = threading.Lock()
+        self.journal_file = data_file + ".journal"
+        self.counts_file = data_file + ".counts"
+        self.config_file = data_file + ".config"
+        self.compact_threshold = compact_threshold
+        self.lock = TimedLock(threading.RLock(), "storage")
+        self.file_lock = TimedLock(FileLock(data_file + ".lock"), "storage_file")
+        self._jobs = {}
+        # Config from the snapshot and journal of older versions
+        self._config = {}
+        self._config_values = {}
+        self._config_id = None
+        self._counts = {}
+        self._ready = ReadyIndex()
+        # Idempotency key -> ID of the newest job created with it
+        self._keys = {}
+        self._journal_id = None
+        self._journal_offset = 0
+        self._journal_records = 0
+        self.codec = CODECS["json"]
         self._ensure_data_file()
-    
+
     def _ensure_data_file(self):
-        """Create data file if it doesn't exist"""
-        if not os.path.exists(self.data_file):
-            with open(self.data_file, 'w') as f:
-                json.dump({"jobs": {}, "config": {}}, f)
-    
-    def _read_data(self):
-        """Read all data from file with locking"""
-        with self.lock:
+        """Create data and journal files if they don't exist"""
+        created = not os.path.exists(self.data_file)
+        if created:
+            with open(self.data_file, 'wb') as f:
+                f.write(encode(self.codec, {"jobs": {}}))
+        if not os.path.exists(self.journal_file):
+            open(self.journal_file, 'ab').close()
+        if created:
+            self._write_counts({})
+            self._write_config({}, replace=False)
+
+    def _load(self):
+        """Rebuild in-memory state from the snapshot and the full journal"""
+        with open(self.journal_file, 'rb') as journal:
+            st = os.fstat(journal.fileno())
+            try:
+                with open(self.data_file, 'rb') as f:
+                    raw = _read(f)
+            except FileNotFoundError:
+                raw = b""
+            codec = detect_codec(raw)
+            # A snapshot we cannot read must not be mistaken for an empty
+            # one, or the next compaction would overwrite it
+            self.codec = get_codec(codec.name)
+            data = {"jobs": {}}
+            if raw:
+                try:
+                    data = codec.loads(raw[len(codec.header):])
+                    if not isinstance(data, dict):
+                        raise ValueError("not a snapshot object")
+                except Exception as e:
+                    raise ValueError(f"Cannot read snapshot {self.data_file} as {codec.name} "
+                                     f"({e}); restore it or move it aside to start empty") from e
+            self._jobs = data.get("jobs", {})
+            self._config = data.get("config", {})
+            self._counts = {}
+            self._ready = ReadyIndex()
+            self._keys = {}
+            for job_data in self._jobs.values():
+                self._count(job_data, 1)
+                self._ready.update(job_data)
+                self._index_key(job_data, None)
+            snapshot_counts = dict(self._counts)
+            self._journal_id = (st.st_dev, st.st_ino)
+            self._journal_offset = 0
+            self._journal_records = 0
+            self._replay(_read(journal))
+        if not os.path.exists(self.counts_file):
+            # Store from before the counts file; don't wait for a compaction
+            self._write_counts(snapshot_counts, self._journal_id)
+        if not os.path.exists(self.config_file):
+            # Config written before it had its own file
+            self._write_config(self._config, replace=False)
+
+    def _refresh(self):
+        """Pick up journal records appended by other Storage instances"""
+        try:
+            st = os.stat(self.journal_file)
+        except FileNotFoundError:
+            self._ensure_data_file()
+            st = os.stat(self.journal_file)
+        if (st.st_dev, st.st_ino) != self._journal_id or st.st_size < self._journal_offset:
+            # Journal was compacted and replaced
+            self._load()
+        elif st.st_size > self._journal_offset:
+            with open(self.journal_file, 'rb') as journal:
+                journal.seek(self._journal_offset)
+                self._replay(_read(journal))
+
+    def _replay(self, chunk: bytes):
+        """Apply complete journal lines in chunk and advance the offset"""
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            try:
+                record = JOURNAL.loads(line)
+            except ValueError:
+                # Torn record from a crashed writer
+                continue
+            self._apply(record)
+            self._journal_records += 1
+        self._journal_offset += end
+
+    def _apply(self, record: dict):
+        """Apply a single journal record to the in-memory state"""
+        op = record.get("op")
+        if op == "put":
+            job_data = record["job"]
+            previous = self._jobs.get(job_data["id"])
+            if previous is not None:
+                self._count(previous, -1)
+            self._count(job_data, 1)
+            self._jobs[job_data["id"]] = job_data
+            self._ready.update(job_data)
+            self._index_key(job_data, previous)
+        elif op == "delete":
+            previous = self._jobs.pop(record["id"], None)
+            if previous is not None:
+                self._count(previous, -1)
+                key = previous.get("idempotency_key")
+                if key is not None and self._keys.get(key) == record["id"]:
+                    del self._keys[key]
+            self._ready.discard(record["id"])
+        elif op == "config":
+            # Only written by older versions, see _write_config
+            self._config[record["key"]] = record["value"]
+
+    def _index_key(self, job_data: dict, previous: Optional[dict]):
+        key = job_data.get("idempotency_key")
+        # A new job is the newest with its key; updates to an older job
+        # whose key has since been reused must not take the key back
+        if key is not None and (previous is None or key not in self._keys):
+            self._keys[key] = job_data["id"]
+
+    def _count(self, job_data: dict, delta: int):
+        key = (job_data["state"], job_data.get("priority", 0))
+        self._counts[key] = self._counts.get(key, 0) + delta
+
+    def _append(self, records: list):
+        """Append records to the journal and apply them in memory"""
+        # Record each job's previous state (and for deletes its priority,
+        # which never changes) so counts can be derived from the journal
+        # alone (see count_by_state)
+        states = {}
+        for record in records:
+            if record["op"] == "put":
+                job_id, state = record["job"]["id"], record["job"]["state"]
+            elif record["op"] == "delete":
+                job_id, state = record["id"], None
+            else:
+                continue
+            if job_id in states:
+                record["prev"], priority = states[job_id]
+            else:
+                current = self._jobs.get(job_id, {})
+                record["prev"], priority = current.get("state"), current.get("priority", 0)
+            if state is None:
+                record["priority"] = priority
+            else:
+                priority = record["job"].get("priority", 0)
+            states[job_id] = (state, priority)
+        payload = b"".join(JOURNAL.dumps(record) + b"\n" for record in records)
+        start = time.perf_counter()
+        fd = os.open(self.journal_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, payload)
+            end = os.lseek(fd, 0, os.SEEK_CUR)
+        finally:
+            os.close(fd)
+        _written(start, len(payload))
+        for record in records:
+            self._apply(record)
+        # Only skip past our own write if nobody appended in between;
+        # otherwise the next refresh replays theirs and ours in file order.
+        if end - len(payload) == self._journal_offset:
+            self._journal_offset = end
+            self._journal_records += len(records)
+        if self._journal_records >= self.compact_threshold:
+            self.compact()
+
+    def _write_atomic(self, path: str, payload: bytes):
+        """Replace path with payload via a temp file and rename"""
+        start = time.perf_counter()
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        _written(start, len(payload))
+
+    @traced("storage")
+    def compact(self):
+        """Fold the journal into a new snapshot and start an empty journal"""
+        with self.lock, self.file_lock:
+            self._refresh()
+            snapshot = {"jobs": self._jobs}
+            self._write_atomic(self.data_file, encode(self.codec, snapshot))
+            self._write_atomic(self.journal_file, b"")
+            st = os.stat(self.journal_file)
+            self._journal_id = (st.st_dev, st.st_ino)
+            self._journal_offset = 0
+            self._journal_records = 0
+            self._write_counts(self._counts)
+
+    def convert(self, codec: str) -> str:
+        """Rewrite the snapshot with another codec; returns the previous codec's name.
+
+        The journal is folded in at the same time. Other instances pick up
+        the new format when they reload after the compaction.
+        """
+        with self.lock, self.file_lock:
+            self._refresh()
+            previous = self.codec.name
+            self.codec = get_codec(codec)
+            self.compact()
+            return previous
+
+    def _write_counts(self, counts: dict, journal_id: tuple = None):
+        """Record per-state, per-priority counts as of the start of a journal.
+
+        ``journal_id`` defaults to the current journal's.
+        """
+        if journal_id is None:
+            st = os.stat(self.journal_file)
+            journal_id = (st.st_dev, st.st_ino)
+        by_state = {}
+        for (state, priority), n in counts.items():
+            if n:
+                by_state.setdefault(state, {})[str(priority)] = n
+        payload = {"journal": list(journal_id), "counts": by_state}
+        self._write_atomic(self.counts_file, json.dumps(payload).encode())
+
+    def _read_counts(self) -> Optional[Dict[tuple, int]]:
+        """Counts from the counts file plus the journal's deltas.
+
+        Keys are ``(state, priority)``. Returns None if the counts file is
+        missing, belongs to another journal, or the journal has records
+        without a ``prev`` state.
+        """
+        try:
+            with open(self.counts_file) as f:
+                base = json.load(f)
+            journal = open(self.journal_file, 'rb')
+        except (OSError, ValueError):
+            return None
+        with journal:
+            st = os.fstat(journal.fileno())
+            if base.get("journal") != [st.st_dev, st.st_ino]:
+                return None
+            counts = {}
+            for state, levels in base["counts"].items():
+                # Files from before priorities held a plain count per state
+                if not isinstance(levels, dict):
+                    levels = {"0": levels}
+                for priority, n in levels.items():
+                    counts[(state, int(priority))] = n
+            chunk = _read(journal)
+        for line in chunk[:chunk.rfind(b"\n") + 1].splitlines():
             try:
-                with open(self.data_file, 'r') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
-                return {"jobs": {}, "config": {}}
-    
-    def _write_data(self, data):
-        """Write data to file with locking"""
+                record = JOURNAL.loads(line)
+            except ValueError:
+                continue
+            op = record.get("op")
+            if op not in ("put", "delete"):
+                continue
+            if "prev" not in record:
+                return None
+            if op == "put":
+                priority = record["job"].get("priority", 0)
+                key = (record["job"]["state"], priority)
+                counts[key] = counts.get(key, 0) + 1
+            else:
+                priority = record.get("priority", 0)
+            if record["prev"]:
+                key = (record["prev"], priority)
+                counts[key] = counts.get(key, 0) - 1
+        return counts
+
+    def _current_counts(self) -> Dict[tuple, int]:
+        """Counts by (state, priority), from the counts file if not loaded yet"""
+        if self._journal_id is None:
+            counts = self._read_counts()
+            if counts is not None:
+                return counts
+        self._refresh()
+        return self._counts
+
+    @traced("storage")
+    def count_by_state(self) -> Dict[str, int]:
+        """Number of jobs in each state.
+
+        On a store not loaded yet this reads the counts file plus the
+        journal's deltas, bounded by ``compact_threshold``, not the snapshot.
+        """
         with self.lock:
-            with open(self.data_file, 'w') as f:
-                json.dump(data, f, indent=2)
-    
+            return _totals(self._current_counts())
+
+    @traced("storage")
+    def count_by_priority(self, state: JobState = JobState.PENDING) -> Dict[int, int]:
+        """Number of jobs in ``state`` at each priority"""
+        with self.lock:
+            return {priority: n for (job_state, priority), n in self._current_counts().items()
+                    if job_state == state.value and n}
+
+    def check_counts(self, repair: bool = False) -> Dict[str, tuple]:
+        """Compare persisted counts with a full recount.
+
+        Returns ``{state: (stored, actual)}`` for states that disagree.
+        With ``repair`` the counts file is rewritten from the recount.
+        """
+        with self.lock, self.file_lock:
+            stored = self._read_counts()
+            self._load()
+            self._counts = {}
+            for job_data in self._jobs.values():
+                self._count(job_data, 1)
+            actual = _totals(self._counts)
+            if stored is not None:
+                stored = _totals(stored)
+            if stored is None:
+                mismatches = {state: (None, n) for state, n in actual.items()}
+            else:
+                mismatches = {state: (stored.get(state, 0), actual.get(state, 0))
+                              for state in set(stored) | set(actual)
+                              if stored.get(state, 0) != actual.get(state, 0)}
+            if repair and (mismatches or stored is None):
+                self.compact()
+            return mismatches
+
+    @traced("storage")
     def save_job(self, job: Job):
         """Save or update a job"""
-        data = self._read_data()
-        data["jobs"][job.id] = job.to_dict()
-        self._write_data(data)
-    
+        with self.lock, self.file_lock:
+            self._refresh()
+            self._append([{"op": "put", "job": job.to_dict()}])
+
+    @traced("storage")
+    def save_jobs(self, jobs: List[Job]):
+        """Save many jobs with a single journal write"""
+        with self.lock, self.file_lock:
+            self._refresh()
+            self._append([{"op": "put", "job": job.to_dict()} for job in jobs])
+
+    @traced("storage")
+    def save_claimed_job(self, job: Job, owner: str) -> bool:
+        """Save a job only if ``owner`` still holds its claim lease"""
+        with self.lock, self.file_lock:
+            self._refresh()
+            current = self._jobs.get(job.id)
+            if current is None or current.get("lease_owner") != owner:
+                return False
+            self._append([{"op": "put", "job": job.to_dict()}])
+            return True
+
+    @traced("storage")
+    def save_unique_jobs(self, jobs: List[Job], key_ttl: float) -> List[Job]:
+        """Save new jobs unless their idempotency key is still live.
+
+        A key is live while the newest job created with it is younger than
+        ``key_ttl`` seconds. Returns the job stored for each of ``jobs``:
+        the job itself, or the existing job holding its key.
+        """
+        since = time.time() - key_ttl
+        with self.lock, self.file_lock:
+            self._refresh()
+            stored = []
+            batch = {}
+            for job in jobs:
+                key = job.idempotency_key
+                existing = batch.get(key) if key is not None else None
+                if key is not None and existing is None:
+                    job_data = self._jobs.get(self._keys.get(key))
+                    if job_data is not None and \
+                            to_epoch(parse_timestamp(job_data["created_at"])) > since:
+                        existing = Job.from_dict(job_data)
+                if existing is None:
+                    existing = job
+                    if key is not None:
+                        batch[key] = job
+                stored.append(existing)
+            new = [job for job, kept in zip(jobs, stored) if kept is job]
+            if new:
+                self._append([{"op": "put", "job": job.to_dict()} for job in new])
+            return stored
+
+    def claim_next_job(self, owner: str = None, lease_seconds: float = None) -> Optional[Job]:
+        """Mark the next claimable job as processing and return it.
+
+        The claim is leased to ``owner`` for ``lease_seconds``; once the
+        lease expires the job can be claimed again by another worker.
+        """
+        jobs = self.claim_jobs(owner, lease_seconds, 1)
+        return jobs[0] if jobs else None
+
+    @traced("storage")
+    def claim_jobs(self, owner: str = None, lease_seconds: float = None,
+                   limit: int = 1, parallel: int = 1) -> List[Job]:
+        """Claim up to ``limit`` jobs under one lock with a single journal write.
+
+        Jobs are leased in rounds of ``parallel``, the number the caller
+        starts at once: the first round gets ``lease_seconds``, the next
+        twice that and so on, so jobs waiting in a worker's buffer don't
+        expire while the ones ahead of them run.
+        """
+        with self.lock, self.file_lock:
+            self._refresh()
+            jobs = []
+            while len(jobs) < limit:
+                job_id = self._ready.pop()
+                if job_id is None:
+                    break
+                job = Job.from_dict(self._jobs[job_id])
+                lease = stacked_lease(lease_seconds, len(jobs), parallel)
+                job.mark_processing(owner, lease)
+                jobs.append(job)
+            if jobs:
+                self._append([{"op": "put", "job": job.to_dict()} for job in jobs])
+            return jobs
+
+    @traced("storage")
+    def release_jobs(self, jobs: List[Job], owner: str) -> int:
+        """Return claimed but unstarted jobs to the queue if owner still holds them"""
+        with self.lock, self.file_lock:
+            self._refresh()
+            records = []
+            for job in jobs:
+                current = self._jobs.get(job.id)
+                if current is None or current.get("lease_owner") != owner:
+                    continue
+                job.release()
+                records.append({"op": "put", "job": job.to_dict()})
+            if records:
+                self._append(records)
+            return len(records)
+
+    @traced("storage")
+    def next_due(self) -> Optional[float]:
+        """Epoch time at which the next scheduled job or lease comes due"""
+        with self.lock:
+            self._refresh()
+            return self._ready.next_due()
+
+    @traced("storage")
     def get_job(self, job_id: str) -> Optional[Job]:
         """Get a job by ID"""
-        data = self._read_data()
-        job_data = data["jobs"].get(job_id)
+        with self.lock:
+            self._refresh()
+            job_data = self._jobs.get(job_id)
         if job_data:
             return Job.from_dict(job_data)
         return None
-    
+
+    @traced("storage")
     def get_jobs_by_state(self, state: JobState) -> List[Job]:
         """Get all jobs with specified state"""
-        data = self._read_data()
-        jobs = []
-        for job_data in data["jobs"].values():
-            if job_data["state"] == state.value:
-                jobs.append(Job.from_dict(job_data))
-        return jobs
-    
+        with self.lock:
+            self._refresh()
+            matching = [job_data for job_data in self._jobs.values()
+                        if job_data["state"] == state.value]
+        return [Job.from_dict(job_data) for job_data in matching]
+
+    @traced("storage")
     def get_all_jobs(self) -> List[Job]:
         """Get all jobs"""
-        data = self._read_data()
-        return [Job.from_dict(job_data) for job_data in data["jobs"].values()]
-    
+        with self.lock:
+            self._refresh()
+            records = list(self._jobs.values())
+        return [Job.from_dict(job_data) for job_data in records]
+
+    def iter_jobs(self, state: JobState = None, after: str = None, limit: int = None,
+                  batch_size: int = 1000) -> Iterator[Job]:
+        """Yield jobs in creation order, resuming after a cursor"""
+        for record in self.iter_records(state, after, limit, batch_size):
+            yield record.job()
+
+    def iter_records(self, state: JobState = None, after: str = None, limit: int = None,
+                     batch_size: int = 1000) -> Iterator[JobRecord]:
+        """Like iter_jobs, but yields record views without building Jobs.
+
+        Only the (created, id) keys of matching jobs are sorted up front;
+        records are fetched one batch at a time, so memory is not
+        proportional to the full job records.
+        """
+        with self.lock:
+            self._refresh()
+            keys = sorted((to_epoch(parse_timestamp(job_data["created_at"])), job_id)
+                          for job_id, job_data in self._jobs.items()
+                          if state is None or job_data["state"] == state.value)
+        start = bisect.bisect_right(keys, decode_cursor(after)) if after else 0
+        end = len(keys) if limit is None else min(len(keys), start + limit)
+        for offset in range(start, end, batch_size):
+            with self.lock:
+                self._refresh()
+                batch = [self._jobs.get(job_id)
+                         for _, job_id in keys[offset:min(offset + batch_size, end)]]
+            for job_data in batch:
+                # Skip jobs deleted or moved out of the state since the sort
+                if job_data is not None and (state is None or job_data["state"] == state.value):
+                    yield JobRecord(job_data)
+
+    @traced("storage")
     def delete_job(self, job_id: str):
         """Delete a job"""
-        data = self._read_data()
-        if job_id in data["jobs"]:
-            del data["jobs"][job_id]
-            self._write_data(data)
-            return True
-        return False
-    
+        with self.lock, self.file_lock:
+            self._refresh()
+            if job_id in self._jobs:
+                self._append([{"op": "delete", "id": job_id}])
+                return True
+            return False
+
+    @traced("storage")
+    def delete_jobs(self, jobs: List[Job]) -> List[str]:
+        """Delete jobs whose stored record has not changed since they were read.
+
+        Returns the IDs that were deleted.
+        """
+        with self.lock, self.file_lock:
+            self._refresh()
+            deleted = [job.id for job in jobs
+                       if self._jobs.get(job.id, {}).get("updated_at") == job.to_dict()["updated_at"]]
+            if deleted:
+                self._append([{"op": "delete", "id": job_id} for job_id in deleted])
+            return deleted
+
+    def _write_config(self, values: dict, replace: bool = True):
+        """Write the config file; with replace=False only if it doesn't exist yet"""
+        if replace:
+            self._write_atomic(self.config_file, JOURNAL.dumps(values))
+            return
+        tmp_path = f"{self.config_file}.tmp.{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(JOURNAL.dumps(values))
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            # link() never overwrites, so a concurrent set_config wins
+            os.link(tmp_path, self.config_file)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+
+    def _read_config(self) -> dict:
+        """Cached config values, re-read only if the config file changed"""
+        try:
+            st = os.stat(self.config_file)
+        except FileNotFoundError:
+            self._refresh()
+            if not os.path.exists(self.config_file):
+                self._write_config(self._config, replace=False)
+            st = os.stat(self.config_file)
+        if (st.st_ino, st.st_mtime_ns, st.st_size) != self._config_id:
+            with open(self.config_file, 'rb') as f:
+                st = os.fstat(f.fileno())
+                self._config_values = JOURNAL.loads(f.read())
+            self._config_id = (st.st_ino, st.st_mtime_ns, st.st_size)
+        return self._config_values
+
     def get_config(self, key: str, default=None):
         """Get configuration value"""
-        data = self._read_data()
-        return data.get("config", {}).get(key, default)
-    
+        with self.lock:
+            return self._read_config().get(key, default)
+
+    def get_all_config(self) -> dict:
+        """Get all configuration values"""
+        with self.lock:
+            return dict(self._read_config())
+
     def set_config(self, key: str, value):
         """Set configuration value"""
-        data = self._read_data()
-        if "config" not in data:
-            data["config"] = {}
-        data["config"][key] = value
-        self._write_data(data)
\ No newline at end of file
+        with self.lock, self.file_lock:
+            values = dict(self._read_config())
+            values[key] = value
+            self._write_config(values)
+
+def _totals(counts: Dict[tuple, int]) -> Dict[str, int]:
+    """Sum counts keyed by (state, priority) into per-state totals"""
+    totals = {}
+    for (state, _), n in counts.items():
+        totals[state] = totals.get(state, 0) + n
+    return {state: n for state, n in totals.items() if n}
+
+QUEUE_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+def partition_path(data_file: str, queue: str = None) -> str:
+    """Data file holding a named queue's jobs.
+
+    The default queue lives in ``data_file`` itself; every other queue gets
+    its own partition, ``<data_file>.queues/<queue><ext>``, with its own
+    journal, locks and counters.
+    """
+    if queue is None or queue == DEFAULT_QUEUE:
+        return data_file
+    if not QUEUE_NAME.match(queue):
+        raise ValueError(f"Invalid queue name: {queue!r} (use letters, digits, - and _)")
+    return os.path.join(data_file + ".queues", queue + os.path.splitext(data_file)[1])
+
+def list_queues(data_file: str) -> List[str]:
+    """Names of the queues stored alongside data_file, the default queue first"""
+    ext = os.path.splitext(data_file)[1]
+    try:
+        names = os.listdir(data_file + ".queues")
+    except FileNotFoundError:
+        names = []
+    queues = [name[:len(name) - len(ext)] for name in names if name.endswith(ext)]
+    return [DEFAULT_QUEUE] + sorted(queue for queue in queues
+                                    if QUEUE_NAME.match(queue) and queue != DEFAULT_QUEUE)
+
+def create_storage(data_file: str = None, backend: str = None, queue: str = None):
+    """Open the storage backend selected by config.
+
+    ``backend`` and ``data_file`` fall back to the ``JOBQUEUE_BACKEND`` and
+    ``JOBQUEUE_DATA_FILE`` environment variables. ``json`` (the default) is
+    the journal-backed ``Storage``; ``sqlite`` is ``SQLiteStorage``. With a
+    ``queue`` the partition of that named queue is opened instead.
+    """
+    backend = backend or os.environ.get("JOBQUEUE_BACKEND", "json")
+    data_file = data_file or os.environ.get("JOBQUEUE_DATA_FILE")
+    if backend not in ("json", "sqlite"):
+        raise ValueError(f"Unknown storage backend: {backend}")
+    data_file = data_file or ("jobqueue_data.db" if backend == "sqlite" else "jobqueue_data.json")
+    path = partition_path(data_file, queue)
+    if path != data_file:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    if backend == "sqlite":
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(path)
+    return Storage(path)
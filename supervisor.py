@@ -0,0 +1,244 @@
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from typing import List, Optional
+
+def _worker_process(backend: str, data_file: str, threads: int, executor: str,
+                    prefetch: Optional[int], drain_timeout: float, queues: Optional[List[str]],
+                    profile: bool = False):
+    """Entry point of one worker process"""
+    import metrics
+    from profiling import StackSampler
+    from queue_manager import QueueSet, open_queues
+    from worker import WorkerManager
+
+    managers = open_queues(queues, data_file, backend)
+    queue_manager = managers[0] if len(managers) == 1 else QueueSet(managers)
+    metrics_dir = managers[0].storage.data_file + ".metrics"
+    metrics.publish(metrics_dir, queue_manager.config.metrics_interval)
+    sampler = None
+    if profile:
+        sampler = StackSampler(profile_path(managers[0].storage.data_file, os.getpid()))
+        sampler.start()
+    try:
+        manager = WorkerManager(queue_manager, executor, drain_timeout)
+        manager.start_workers(threads, prefetch)
+        # WorkerManager's SIGTERM/SIGINT handler drains the workers and exits
+        while True:
+            time.sleep(3600)
+    finally:
+        metrics.retire(metrics_dir)
+        if sampler is not None:
+            sampler.stop()
+
+def profile_path(data_file: str, pid: int) -> str:
+    """Where a profiled worker process writes its collapsed stacks"""
+    return os.path.join(data_file + ".profiles", f"{pid}.folded")
+
+def read_pidfile(path: str) -> Optional[dict]:
+    """Load a supervisor pidfile, or None if missing or its process is gone"""
+    try:
+        with open(path) as f:
+            info = json.load(f)
+        os.kill(info["pid"], 0)
+    except (OSError, ValueError, KeyError):
+        return None
+    return info
+
+class Supervisor:
+    """Forks and babysits a fleet of worker processes.
+
+    Each of the ``processes`` children serves ``queues`` with ``threads``
+    workers and is restarted, with backoff, if it dies. Pids live in
+    ``pidfile``; SIGTERM drains children for up to ``drain_timeout``.
+    Retention runs every ``retention_interval`` seconds between checks.
+    """
+
+    def __init__(self, backend: str, data_file: str, processes: int = 1,
+                 threads: int = 1, executor: str = "thread", prefetch: int = None,
+                 pidfile: str = None, drain_timeout: float = 30.0,
+                 queues: List[str] = None, metrics_port: int = None, profile: bool = False):
+        self.backend = backend
+        self.data_file = data_file
+        self.processes = processes
+        self.threads = threads
+        self.executor = executor
+        self.prefetch = prefetch
+        self.pidfile = pidfile or data_file + ".pid"
+        self.drain_timeout = drain_timeout
+        self.queues = queues
+        self.metrics_port = metrics_port
+        self.profile = profile
+        self._metrics_server = None
+        self.children = {}
+        self.running = False
+        self._queue_managers = None
+        self._next_retention = 0.0
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+
+    def _spawn(self, slot: int):
+        sys.stdout.flush()
+        proc = self._context.Process(
+            target=_worker_process,
+            args=(self.backend, self.data_file, self.threads, self.executor,
+                  self.prefetch, self.drain_timeout, self.queues, self.profile),
+            name=f"jobqueue-worker-{slot}",
+        )
+        proc.start()
+        self.children[slot] = {"process": proc, "started": time.time(), "restarts":
+                               self.children.get(slot, {}).get("restarts", 0)}
+        print(f"Supervisor: started worker process {proc.pid} (slot {slot})")
+
+    def _write_pidfile(self):
+        info = {
+            "pid": os.getpid(),
+            "workers": [child["process"].pid for child in self.children.values()],
+            "processes": self.processes,
+            "threads": self.threads,
+            "executor": self.executor,
+            "data_file": self.data_file,
+            "queues": self.queues,
+            "metrics_port": self.metrics_port,
+            "profile": self.profile,
+        }
+        tmp_path = f"{self.pidfile}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(info, f)
+        os.replace(tmp_path, self.pidfile)
+
+    def _serve_metrics(self):
+        from metrics import serve
+        from queue_manager import metrics_text
+
+        self._metrics_server = serve(
+            self.metrics_port, lambda: metrics_text(self.data_file, self.backend))
+        print(f"Supervisor: serving metrics at http://127.0.0.1:{self.metrics_port}/metrics")
+
+    def _handle_signal(self, signum, frame):
+        self.running = False
+
+    def run(self):
+        """Start the fleet and supervise it until told to stop"""
+        existing = read_pidfile(self.pidfile)
+        if existing and existing["pid"] != os.getpid():
+            raise RuntimeError(f"Supervisor already running with pid {existing['pid']}")
+        self.running = True
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        for slot in range(self.processes):
+            self._spawn(slot)
+        self._write_pidfile()
+        try:
+            if self.metrics_port:
+                self._serve_metrics()
+            self._supervise()
+        finally:
+            self._shutdown()
+
+    def _supervise(self):
+        from multiprocessing.connection import wait
+
+        while self.running:
+            sentinels = {child["process"].sentinel: slot for slot, child in self.children.items()}
+            ready = wait(list(sentinels), timeout=1.0)
+            for sentinel in ready:
+                if not self.running:
+                    break
+                slot = sentinels[sentinel]
+                child = self.children[slot]
+                proc = child["process"]
+                proc.join()
+                print(f"Supervisor: worker process {proc.pid} exited with code {proc.exitcode}")
+                # Back off when a child keeps dying right after start
+                if time.time() - child["started"] < 5:
+                    child["restarts"] += 1
+                    time.sleep(min(30, 2 ** min(child["restarts"], 5) / 4))
+                else:
+                    child["restarts"] = 0
+                if self.running:
+                    self._spawn(slot)
+                    self._write_pidfile()
+            if self.running:
+                self._run_retention()
+    
+    def _run_retention(self):
+        """Archive expired finished jobs once per retention_interval"""
+        if time.time() < self._next_retention:
+            return
+        from queue_manager import open_queues
+
+        if self._queue_managers is None:
+            self._queue_managers = open_queues(self.queues, self.data_file, self.backend)
+        self._next_retention = time.time() + self._queue_managers[0].config.retention_interval
+        for manager in self._queue_managers:
+            try:
+                counts = manager.run_retention()
+            except Exception as e:
+                print(f"Supervisor: retention run for queue {manager.queue} failed: {e}")
+                continue
+            if any(counts.values()):
+                print(f"Supervisor: archived {counts['completed']} completed and "
+                      f"{counts['dead']} dead job(s) from queue {manager.queue}")
+
+    def _shutdown(self):
+        if self._metrics_server is not None:
+            self._metrics_server.shutdown()
+            self._metrics_server.server_close()
+        print("Supervisor: stopping worker processes...")
+        for child in self.children.values():
+            if child["process"].is_alive():
+                os.kill(child["process"].pid, signal.SIGTERM)
+        deadline = time.time() + self.drain_timeout + 5
+        for child in self.children.values():
+            child["process"].join(max(0, deadline - time.time()))
+            if child["process"].is_alive():
+                print(f"Supervisor: worker process {child['process'].pid} did not drain, killing")
+                child["process"].kill()
+                child["process"].join()
+        try:
+            info = read_pidfile(self.pidfile)
+            if info is None or info["pid"] == os.getpid():
+                os.remove(self.pidfile)
+        except OSError:
+            pass
+        print("Supervisor: all worker processes stopped")
+
+def stop_supervisor(pidfile: str, timeout: float = 60.0) -> Optional[int]:
+    """Ask the supervisor in pidfile to drain and wait for it to exit.
+
+    Returns the supervisor's pid, or None if none was running.
+    """
+    info = read_pidfile(pidfile)
+    if info is None:
+        if os.path.exists(pidfile):
+            os.remove(pidfile)
+        return None
+    pid = info["pid"]
+    os.kill(pid, signal.SIGTERM)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return pid
+        time.sleep(0.1)
+    raise TimeoutError(f"Supervisor {pid} did not stop within {timeout:.0f}s")
+
+def detach(log_file: str):
+    """Fork into the background, sending output to log_file"""
+    if os.fork() > 0:
+        os._exit(0)
+    os.setsid()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    log_fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null_fd, 0)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    os.close(null_fd)
+    os.close(log_fd)
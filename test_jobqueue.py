@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
+import glob
 import os
+import shutil
 import subprocess
+import tempfile
 import time
 
 def run_command(cmd):
@@ -8,14 +11,21 @@ def run_command(cmd):
     result = subprocess.run(f"python main.py {cmd}", shell=True, capture_output=True, text=True)
     return result.returncode, result.stdout, result.stderr
 
+def clean_data():
+    """Remove the data file and the files and directories kept beside it"""
+    for path in glob.glob("jobqueue_data.json*"):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
 def test_basic_commands():
     """Test basic CLI commands"""
     print("🧪 Testing Basic Commands")
     print("=" * 50)
     
     # Clean previous data
-    if os.path.exists("jobqueue_data.json"):
-        os.remove("jobqueue_data.json")
+    clean_data()
     
     # Test 1: Enqueue a simple job
     print("1. Testing enqueue command...")
@@ -106,14 +116,1011 @@ def test_dlq_commands():
         print("❌ DLQ commands failed")
         return False
 
+def test_journal_storage():
+    """Journal writes are visible to other instances and survive compaction"""
+    from job import Job, JobState
+    from storage import Storage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, "jobs.json")
+        writer = Storage(data_file, compact_threshold=5)
+        reader = Storage(data_file)
+
+        jobs = [Job(command=f"echo {i}") for i in range(4)]
+        for job in jobs:
+            writer.save_job(job)
+        jobs[0].mark_completed()
+        writer.save_job(jobs[0])
+        writer.delete_job(jobs[1].id)
+        writer.set_config("max_retries", 7)
+
+        # Compaction happened after the fifth record
+        assert os.path.getsize(writer.journal_file) < 200
+        for storage in (reader, Storage(data_file)):
+            assert storage.get_job(jobs[0].id).state == JobState.COMPLETED
+            assert storage.get_job(jobs[1].id) is None
+            assert len(storage.get_jobs_by_state(JobState.PENDING)) == 2
+            assert storage.get_config("max_retries") == 7
+
+def test_sqlite_claim():
+    """Concurrent claims against SQLite never hand out the same job twice"""
+    import threading
+    from job import Job, JobState
+    from sqlite_storage import SQLiteStorage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SQLiteStorage(os.path.join(tmp, "jobs.db"))
+        jobs = [Job(command=f"echo {i}") for i in range(40)]
+        storage.import_jobs(jobs, {"max_retries": 2})
+        failed = storage.get_job(jobs[5].id)
+        failed.mark_failed()
+        storage.save_job(failed)
+
+        # Oldest ready job wins, whether pending or retryable failed
+        assert storage.claim_next_job().id == jobs[0].id
+
+        claimed = []
+        def claim_all():
+            other = SQLiteStorage(storage.data_file)
+            while True:
+                job = other.claim_next_job()
+                if job is None:
+                    return
+                claimed.append(job.id)
+
+        threads = [threading.Thread(target=claim_all) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(claimed) == sorted(job.id for job in jobs[1:])
+        assert len(storage.get_jobs_by_state(JobState.PROCESSING)) == 40
+        assert storage.get_config("max_retries") == 2
+
+def test_ready_index_claim_order():
+    """Claims follow creation order across pending and retryable failed jobs"""
+    from datetime import timedelta
+    from job import Job, JobState
+    from storage import Storage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, "jobs.json"))
+        jobs = [Job(command=f"echo {i}", max_retries=2) for i in range(4)]
+        for i, job in enumerate(jobs):
+            job.created_at += timedelta(seconds=i)
+        jobs[0].mark_completed()
+        jobs[1].mark_failed()
+        jobs[2].mark_failed()
+        jobs[2].mark_failed()
+        for job in jobs:
+            storage.save_job(job)
+
+        assert jobs[2].state == JobState.DEAD
+        assert storage.claim_next_job().id == jobs[1].id
+        assert storage.claim_next_job().id == jobs[3].id
+        assert storage.claim_next_job() is None
+
+        # Another instance sees the DLQ retry through the journal
+        retried = storage.get_job(jobs[2].id)
+        retried.retry()
+        Storage(storage.data_file).save_job(retried)
+        assert storage.claim_next_job().id == jobs[2].id
+
+def _claim_until_empty(data_file, owner, results):
+    from storage import Storage
+    storage = Storage(data_file)
+    claimed = []
+    while True:
+        job = storage.claim_next_job(owner, lease_seconds=60)
+        if job is None:
+            break
+        claimed.append(job.id)
+    results.put(claimed)
+
+def test_cross_process_claims_and_leases():
+    """Worker processes sharing a journal never claim the same job twice"""
+    import multiprocessing
+    from job import Job
+    from storage import Storage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, "jobs.json")
+        storage = Storage(data_file)
+        jobs = [Job(command=f"echo {i}") for i in range(200)]
+        for job in jobs:
+            storage.save_job(job)
+
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_claim_until_empty,
+                                         args=(data_file, f"proc-{i}", results))
+                 for i in range(4)]
+        for proc in procs:
+            proc.start()
+        claimed = [job_id for _ in procs for job_id in results.get(timeout=60)]
+        for proc in procs:
+            proc.join()
+        assert sorted(claimed) == sorted(job.id for job in jobs)
+
+        # A stale owner cannot finish a job once its lease has moved on
+        late = Job(command="echo late")
+        storage.save_job(late)
+        job = storage.claim_next_job("crashed", lease_seconds=0)
+        assert storage.claim_next_job("rescuer", lease_seconds=60).id == late.id
+        job.mark_completed()
+        assert not storage.save_claimed_job(job, "crashed")
+        assert storage.get_job(late.id).lease_owner == "rescuer"
+
+def test_scheduled_jobs_and_backoff():
+    """Delayed jobs and failed retries are only claimable once due"""
+    import time
+    from datetime import datetime, timedelta
+    from job import JobState
+    from queue_manager import QueueManager
+    from sqlite_storage import SQLiteStorage
+    from storage import Storage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (Storage(os.path.join(tmp, "jobs.json")),
+                        SQLiteStorage(os.path.join(tmp, "jobs.db"))):
+            storage.set_config("base_delay", 3)
+            manager = QueueManager(storage)
+            later = manager.enqueue("echo later", run_at=datetime.utcnow() + timedelta(hours=1))
+            soon = manager.enqueue("echo soon", run_at=datetime.utcnow() + timedelta(seconds=0.2))
+            now = manager.enqueue("echo now")
+
+            assert manager.get_next_pending_job().id == now.id
+            assert manager.get_next_pending_job() is None
+            time.sleep(0.25)
+            job = manager.get_next_pending_job()
+            assert job.id == soon.id
+
+            # First failure waits base_delay ** attempts seconds
+            manager.fail_job(job)
+            assert job.state == JobState.FAILED
+            wait = (job.run_at - datetime.utcnow()).total_seconds()
+            assert 2 < wait <= 3
+            assert manager.get_next_pending_job() is None
+            assert storage.get_job(later.id).state == JobState.PENDING
+
+            # Due jobs are claimed in creation order, not in run_at order
+            first = manager.enqueue("echo first", run_at=datetime.utcnow() + timedelta(seconds=0.2))
+            second = manager.enqueue("echo second", run_at=datetime.utcnow())
+            time.sleep(0.25)
+            assert manager.get_next_pending_job().id == first.id
+            assert manager.get_next_pending_job().id == second.id
+
+def test_idle_worker_wakeup():
+    """An idle worker wakes on enqueue from another queue manager, not a poll"""
+    import threading
+    import time
+    from queue_manager import QueueManager
+    from storage import Storage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, "jobs.json")
+        waiting = QueueManager(Storage(data_file))
+        waiting.storage.set_config("idle_poll_seconds", 30)
+        producer = QueueManager(Storage(data_file))
+
+        woken = threading.Event()
+        def idle_worker():
+            start = time.time()
+            while waiting.get_next_pending_job() is None:
+                waiting.wait_for_work()
+            if time.time() - start < 5:
+                woken.set()
+
+        thread = threading.Thread(target=idle_worker)
+        thread.start()
+        time.sleep(0.2)
+        producer.enqueue("echo wake")
+        thread.join(timeout=10)
+        assert woken.is_set()
+
+        # A batch wakes as many idle workers of another process as it has jobs
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(waiting.wakeup.wait(30)))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        producer.enqueue_many([{"command": "echo batch"}] * 3)
+        for thread in threads:
+            thread.join(timeout=10)
+        assert results == [True, True, True]
+        waiting.wakeup.close()
+
+def test_enqueue_many():
+    """Batch enqueue writes one journal record batch per chunk and reports bad lines"""
+    import io
+    from job import JobState
+    from queue_manager import QueueManager
+    from storage import Storage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, "jobs.json"))
+        manager = QueueManager(storage)
+        lines = [f'{{"command": "echo {i}", "max_retries": 1}}' for i in range(25)]
+        lines[3] = "{not json"
+        lines[7] = '{"max_retries": 2}'
+        lines[12] = '{"command": "echo bool", "max_retries": true}'
+        # A spec may name its queue, but only the one being filled
+        lines[15] = '{"command": "echo report", "max_retries": 1, "queue": "reports"}'
+        lines[16] = '{"command": "echo default", "max_retries": 1, "queue": "default"}'
+        lines.insert(10, "")
+
+        count, errors = manager.enqueue_many(io.StringIO("\n".join(lines) + "\n"), chunk_size=10)
+        assert count == 21
+        assert [line for line, _ in errors] == [4, 8, 14, 17]
+        assert "reports" in errors[3][1]
+        pending = storage.get_jobs_by_state(JobState.PENDING)
+        assert len(pending) == 21
+        assert all(job.max_retries == 1 for job in pending)
+
+def test_prefetch_claim_and_release():
+    """Workers claim a batch in one go and hand back what they never started"""
+    from job import JobState
+    from queue_manager import QueueManager
+    from sqlite_storage import SQLiteStorage
+    from storage import Storage
+    from worker import Worker
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (Storage(os.path.join(tmp, "jobs.json")),
+                        SQLiteStorage(os.path.join(tmp, "jobs.db"))):
+            manager = QueueManager(storage)
+            jobs = [manager.enqueue(f"echo {i}") for i in range(5)]
+
+            batch = manager.claim_jobs("worker-a", limit=3)
+            assert [job.id for job in batch] == [job.id for job in jobs[:3]]
+            assert batch[2].lease_expires_at > batch[0].lease_expires_at
+
+            # Only the holder of the lease can release
+            assert manager.release_jobs(batch[1:], "worker-b") == 0
+            assert manager.release_jobs(batch[1:], "worker-a") == 2
+            assert storage.get_job(batch[0].id).state == JobState.PROCESSING
+            assert [job.id for job in manager.claim_jobs("worker-b", limit=10)] == \
+                [job.id for job in jobs[1:]]
+
+            # Jobs started in parallel share one lease length
+            more = [manager.enqueue(f"echo {i}") for i in range(3)]
+            batch = manager.claim_jobs("worker-c", limit=3, parallel=2)
+            assert [job.id for job in batch] == [job.id for job in more]
+            lease = manager.config.lease_seconds
+            assert abs(batch[1].lease_expires_ts - batch[1].updated_ts - lease) < 0.01
+            assert abs(batch[2].lease_expires_ts - batch[2].updated_ts - 2 * lease) < 0.01
+
+        assert Worker(manager, 1, prefetch=0).prefetch == 1
+
+def test_async_worker_runs_jobs_concurrently():
+    """One async worker drives many subprocess jobs at the same time"""
+    import time
+    from job import JobState
+    from queue_manager import QueueManager
+    from storage import Storage
+    from worker import AsyncWorker
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, "jobs.json"))
+        manager = QueueManager(storage)
+        manager.enqueue_many([{"command": "sleep 0.5"}] * 40 +
+                             [{"command": "exit 3", "max_retries": 1}])
+
+        worker = AsyncWorker(manager, 1, concurrency=50)
+        start = time.time()
+        worker.start()
+        while storage.get_jobs_by_state(JobState.PENDING) or \
+                storage.get_jobs_by_state(JobState.PROCESSING):
+            assert time.time() - start < 10
+            time.sleep(0.05)
+        worker.stop()
+
+        assert time.time() - start < 5
+        assert len(storage.get_jobs_by_state(JobState.COMPLETED)) == 40
+        assert len(storage.get_jobs_by_state(JobState.DEAD)) == 1
+        manager.wakeup.close()
+
+def test_supervisor_start_stop():
+    """`start --detach` runs worker processes until `stop` drains them"""
+    import json
+    import sys
+
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, JOBQUEUE_DATA_FILE=os.path.join(tmp, "jobs.json"))
+        def jobqueue(*args):
+            return subprocess.run([sys.executable, main, *args], env=env, cwd=tmp,
+                                  capture_output=True, text=True, timeout=60).stdout
+
+        jobqueue("enqueue", "echo done")
+        jobqueue("start", "--processes", "2", "--detach")
+        deadline = time.time() + 20
+        while "Completed: 1" not in jobqueue("status"):
+            assert time.time() < deadline
+            time.sleep(0.2)
+        with open(os.path.join(tmp, "jobs.json.pid")) as f:
+            assert len(json.load(f)["workers"]) == 2
+        assert "Active Workers: 2" in jobqueue("status")
+        assert "Stopped all workers" in jobqueue("stop")
+        assert not os.path.exists(os.path.join(tmp, "jobs.json.pid"))
+
+def test_job_output_streams_to_rotating_log():
+    """Job output goes to a size-capped log file and a bounded tail on the job"""
+    from job import JobState
+    from joblog import read_tail
+    from queue_manager import QueueManager
+    from storage import Storage
+    from worker import Worker
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, "jobs.json"))
+        storage.set_config("log_max_bytes", 4096)
+        storage.set_config("log_tail_bytes", 64)
+        manager = QueueManager(storage)
+        job = manager.enqueue("seq 1 5000; echo boom >&2; exit 1", max_retries=1)
+
+        worker = Worker(manager, 1)
+        worker._process_job(manager.get_next_pending_job())
+
+        job = storage.get_job(job.id)
+        assert job.state == JobState.DEAD
+        assert len(job.output_tail) == 64 and job.output_tail.endswith("5000\nboom\n")
+        log_file = os.path.join(manager.log_dir, f"{job.id}.log")
+        assert os.path.getsize(log_file) <= 4096
+        assert os.path.exists(log_file + ".1")
+        assert not os.path.exists(log_file + ".2")
+        assert read_tail(log_file, 5)[0] == b"boom\n"
+
+        # Output is on disk while the log is still open, for `logs --follow`
+        with manager.open_job_log(job) as log:
+            log.write(b"hello\n")
+            assert read_tail(log_file, 6)[0] == b"hello\n"
+
+        # A max size of 0 means no rotation rather than an endless loop
+        storage.set_config("log_max_bytes", 0)
+        with manager.open_job_log(job) as log:
+            log.write(b"x" * 10000)
+        assert os.path.getsize(log_file) > 10000
+
+def test_job_resource_accounting():
+    """Executed jobs record wall time, queue wait, CPU time and peak RSS"""
+    import time
+    from job import JobState
+    from queue_manager import QueueManager
+    from storage import Storage
+    from worker import Worker
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, "jobs.json"))
+        storage.set_config("sample_interval", 0.05)
+        manager = QueueManager(storage)
+        # Burn CPU in a grandchild so only tree-wide accounting sees it
+        job = manager.enqueue("sh -c 'i=0; while [ $i -lt 200000 ]; do i=$((i+1)); done'; sleep 0.2")
+        time.sleep(0.1)
+
+        worker = Worker(manager, 1)
+        worker._process_job(manager.get_next_pending_job())
+
+        job = storage.get_job(job.id)
+        assert job.state == JobState.COMPLETED
+        resources = job.resources
+        assert resources["wall_time"] >= 0.2
+        assert resources["queue_wait"] >= 0.1
+        assert resources["cpu_user"] + resources["cpu_system"] > 0.05
+        assert resources["peak_rss"] > 0
+
+def test_job_timeout_kills_process_group():
+    """A job past its timeout is failed and its grandchildren are killed too"""
+    import time
+    from job import JobState
+    from queue_manager import QueueManager
+    from storage import Storage
+    from worker import Worker
+
+    def gone(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] == "Z"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = Storage(os.path.join(tmp, "jobs.json"))
+        storage.set_config("lease_seconds", 5)
+        manager = QueueManager(storage)
+        pid_file = os.path.join(tmp, "grandchild.pid")
+        job = manager.enqueue_spec({"command": f"sleep 60 & echo $! > {pid_file}; wait",
+                                    "timeout": 0.5, "max_retries": 1})
+        try:
+            manager.build_job({"command": "true", "timeout": 0})
+            assert False, "a zero timeout should be rejected"
+        except ValueError:
+            pass
+
+        claimed = manager.get_next_pending_job()
+        start = time.time()
+        Worker(manager, 1)._process_job(claimed)
+        assert time.time() - start < 5
+        assert claimed.state == JobState.DEAD
+
+        job = storage.get_job(job.id)
+        assert job.state == JobState.DEAD and job.timeout == 0.5
+        with open(pid_file) as f:
+            grandchild = int(f.read())
+        deadline = time.time() + 2
+        while not gone(grandchild):
+            assert time.time() < deadline
+            time.sleep(0.05)
+
+def test_retention_moves_finished_jobs_to_archive():
+    """Expired completed/dead jobs leave the hot store and stay queryable"""
+    from datetime import datetime, timedelta
+    from job import Job, JobState
+    from queue_manager import QueueManager
+    from sqlite_storage import SQLiteStorage
+    from storage import Storage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (Storage(os.path.join(tmp, "jobs.json")),
+                        SQLiteStorage(os.path.join(tmp, "jobs.db"))):
+            storage.set_config("completed_max_jobs", 2)
+            storage.set_config("dead_ttl", 4.5 * 86400)
+            manager = QueueManager(storage)
+            now = datetime.utcnow()
+            jobs = []
+            for i, state in enumerate([JobState.COMPLETED] * 4 + [JobState.DEAD] * 2 +
+                                      [JobState.PENDING]):
+                job = Job(command=f"echo {i}", state=state)
+                # One job per day going back, so segments span several days
+                job.updated_at = now - timedelta(days=i)
+                jobs.append(job)
+            storage.save_jobs(jobs)
+
+            assert manager.run_retention(dry_run=True) == {"completed": 2, "dead": 1}
+            assert manager.run_retention() == {"completed": 2, "dead": 1}
+            assert manager.run_retention() == {"completed": 0, "dead": 0}
+            remaining = {job.id for job in storage.get_all_jobs()}
+            assert remaining == {jobs[i].id for i in (0, 1, 4, 6)}
+
+            archive = manager.archive
+            assert len(archive.segments()) == 3
+            assert [r["id"] for r in archive.query()] == [jobs[5].id, jobs[3].id, jobs[2].id]
+            assert [r["id"] for r in archive.query(state="dead")] == [jobs[5].id]
+            assert [r["id"] for r in archive.query(since=now - timedelta(days=3, hours=1))] == \
+                [jobs[3].id, jobs[2].id]
+            assert [r["command"] for r in archive.query(job_id=jobs[2].id)] == ["echo 2"]
+            # A segment with a damaged tail keeps the records before it readable
+            with open(archive.segments()[-1], "ab") as f:
+                f.write(b"not gzip")
+            assert len(list(archive.query())) == 3
+
+def test_state_counters():
+    """Per-state counters follow every transition and can be checked and repaired"""
+    import json
+    from job import Job
+    from sqlite_storage import SQLiteStorage
+    from storage import Storage, _totals
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_file = os.path.join(tmp, "jobs.json")
+        for storage in (Storage(json_file, compact_threshold=6),
+                        SQLiteStorage(os.path.join(tmp, "jobs.db"))):
+            jobs = [Job(command=f"echo {i}") for i in range(5)]
+            storage.save_jobs(jobs)
+            claimed = storage.claim_jobs("w", 30, 2)
+            claimed[0].mark_completed()
+            storage.save_job(claimed[0])
+            storage.delete_job(jobs[4].id)
+            expected = {"pending": 2, "processing": 1, "completed": 1}
+            assert storage.count_by_state() == expected
+            assert storage.check_counts() == {}
+
+        # A fresh journal store answers from the counts file and journal alone
+        fresh = Storage(json_file)
+        assert fresh.count_by_state() == expected
+        assert fresh._journal_id is None
+
+        with open(fresh.counts_file, "w") as f:
+            json.dump({"journal": [0, 0], "counts": {}}, f)
+        assert Storage(json_file).count_by_state() == expected
+        assert set(fresh.check_counts()) == {"pending", "processing", "completed"}
+        fresh.check_counts(repair=True)
+        assert Storage(json_file).check_counts() == {}
+
+        # A store from before the counts file gets one on its first load
+        Storage(json_file).save_job(Job(command="echo new"))
+        os.remove(fresh.counts_file)
+        Storage(json_file).get_all_jobs()
+        assert _totals(Storage(json_file)._read_counts()) == dict(expected, pending=3)
+
+        storage._conn().execute("UPDATE job_counts SET count = 9 WHERE state = 'dead'")
+        assert storage.check_counts(repair=True) == {"dead": (9, 0)}
+        assert storage.count_by_state() == expected
+
+def test_paginated_streaming_listing():
+    """iter_jobs pages through creation order with cursors; export streams the same JSON"""
+    import json
+    import sys
+    from datetime import timedelta
+    from job import Job, JobState
+    from sqlite_storage import SQLiteStorage
+    from storage import Storage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (Storage(os.path.join(tmp, "jobs.json")),
+                        SQLiteStorage(os.path.join(tmp, "jobs.db"))):
+            jobs = [Job(command=f"echo {i}") for i in range(7)]
+            for i, job in enumerate(jobs):
+                job.created_at += timedelta(seconds=7 - i)
+                if i % 3 == 0:
+                    job.mark_completed()
+            storage.save_jobs(jobs)
+            ordered = sorted(jobs, key=lambda job: job.created_at)
+            if isinstance(storage, Storage):
+                json_ordered = ordered
+
+            pages, after = [], None
+            while True:
+                page = [job.id for job in storage.iter_jobs(after=after, limit=3, batch_size=2)]
+                if not page:
+                    break
+                pages.append(page)
+                after = storage.get_job(page[-1]).cursor
+            assert [len(page) for page in pages] == [3, 3, 1]
+            assert sum(pages, []) == [job.id for job in ordered]
+            assert [job.id for job in storage.iter_jobs(JobState.COMPLETED)] == \
+                [job.id for job in ordered if job.state == JobState.COMPLETED]
+
+        main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+        env = dict(os.environ, JOBQUEUE_DATA_FILE=os.path.join(tmp, "jobs.json"))
+        def jobqueue(*args):
+            return subprocess.run([sys.executable, main, *args], env=env, cwd=tmp,
+                                  capture_output=True, text=True, timeout=60)
+        exported = jobqueue("export").stdout
+        records = json.loads(exported)
+        assert exported == json.dumps(records, indent=2) + "\n"
+        assert [r["id"] for r in records] == [job.id for job in json_ordered]
+        page = jobqueue("export", "--format", "jsonl", "--state", "pending", "--limit", "2")
+        assert [json.loads(line)["command"] for line in page.stdout.splitlines()] == \
+            ["echo 5", "echo 4"]
+        cursor = page.stderr.split("--after ")[1].strip()
+        rest = jobqueue("list", "--state", "pending", "--after", cursor).stdout
+        assert [line.split(" - ")[1].split(" (")[0] for line in rest.splitlines()] == \
+            ["echo 2", "echo 1"]
+
+def test_paging_freshly_created_jobs():
+    """Cursors page jobs created in quick succession without repeats or gaps"""
+    from job import Job
+    from sqlite_storage import SQLiteStorage
+    from storage import Storage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (Storage(os.path.join(tmp, "jobs.json")),
+                        SQLiteStorage(os.path.join(tmp, "jobs.db"))):
+            jobs = [Job(command=f"echo {i}") for i in range(200)]
+            storage.save_jobs(jobs)
+            seen, after = [], None
+            while True:
+                page = list(storage.iter_records(after=after, limit=7, batch_size=3))
+                if not page:
+                    break
+                seen.extend(record.id for record in page)
+                after = page[-1].cursor
+            assert len(seen) == len(set(seen)) == 200
+            # A cursor taken from the Job itself resumes at the same place
+            position = seen.index(jobs[99].id)
+            assert [r.id for r in storage.iter_records(after=jobs[99].cursor, limit=1)] == \
+                seen[position + 1:position + 2]
+
+def test_compact_job_and_record_view():
+    """Jobs use slots and epoch times but keep the stored ISO-8601 format"""
+    from datetime import datetime
+    from job import Job, JobRecord, JobState, from_epoch
+
+    data = {"id": "j1", "command": "echo hi", "state": "failed", "attempts": 2,
+            "max_retries": 3, "created_at": "2024-05-01T10:00:00.123456Z",
+            "updated_at": "2024-05-01T10:05:00Z", "lease_owner": None,
+            "lease_expires_at": None, "run_at": "2024-05-01T10:05:04.500000Z",
+            "output_tail": None, "resources": None, "timeout": None, "priority": 0,
+            "queue": "default"}
+    job = Job.from_dict(data)
+    assert not hasattr(job, "__dict__")
+    assert job.state is JobState.FAILED
+    assert job.to_dict() == data
+    assert job.created_at == datetime(2024, 5, 1, 10, 0, 0, 123456)
+    assert abs(job.queue_wait() - 299.876544) < 1e-6
+    assert from_epoch(job.run_ts) == job.run_at
+    job.mark_processing("host:1:1", 30)
+    assert job.lease_expires_ts == job.updated_ts + 30
+    assert Job.from_dict(job.to_dict()).to_dict() == job.to_dict()
+    assert job.to_dict()["updated_at"].endswith("Z")
+
+    record = JobRecord(data)
+    assert (record.state, record.attempts, record.command) == (JobState.FAILED, 2, "echo hi")
+    assert record.cursor == Job.from_dict(data).cursor
+    assert record.job().to_dict() == data
+
+def test_storage_codecs():
+    """Snapshots are compact and their codec is detected from the file header"""
+    import json
+    from codec import CODECS, available_codecs
+    from job import Job
+    from storage import Storage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, "jobs.json")
+        storage = Storage(data_file)
+        jobs = [Job(command=f"echo {i} ✓") for i in range(3)]
+        storage.save_jobs(jobs)
+        with open(storage.journal_file) as f:
+            assert [json.loads(line)["job"]["id"] for line in f] == [job.id for job in jobs]
+        storage.compact()
+        with open(data_file, "rb") as f:
+            raw = f.read()
+        assert b"\n" not in raw and json.loads(raw)["jobs"][jobs[0].id]["command"] == "echo 0 ✓"
+
+        if "msgpack" in available_codecs():
+            assert storage.convert("msgpack") == "json"
+            with open(data_file, "rb") as f:
+                assert f.read().startswith(CODECS["msgpack"].header)
+            assert Storage(data_file).get_job(jobs[2].id).command == "echo 2 ✓"
+            assert storage.convert("json") == "msgpack"
+        else:
+            try:
+                storage.convert("msgpack")
+                assert False, "convert should need msgpack"
+            except ValueError:
+                pass
+            # An unreadable snapshot is an error, not an empty store
+            with open(data_file, "wb") as f:
+                f.write(CODECS["msgpack"].header + b"\x81")
+            try:
+                Storage(data_file).get_job(jobs[0].id)
+                assert False, "loading should need msgpack"
+            except ValueError:
+                pass
+
+        # A corrupt snapshot is reported and left alone, not loaded as empty
+        data_file = os.path.join(tmp, "corrupt.json")
+        Storage(data_file).save_job(Job(command="echo kept"))
+        Storage(data_file).compact()
+        with open(data_file, "rb") as f:
+            snapshot = f.read()
+        with open(data_file, "wb") as f:
+            f.write(snapshot[:len(snapshot) // 2])
+        try:
+            Storage(data_file).get_all_jobs()
+            assert False, "a truncated snapshot must not load"
+        except ValueError as e:
+            assert data_file in str(e)
+        with open(data_file, "rb") as f:
+            assert f.read() == snapshot[:len(snapshot) // 2]
+
+def test_cached_config():
+    """Config reads come from a small cached file, never from the job data"""
+    import json
+    from job import Job
+    from queue_manager import QueueManager
+    from storage import Storage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, "jobs.json")
+        Storage(data_file).save_jobs([Job(command="echo hi") for _ in range(3)])
+        reader, writer = Storage(data_file), Storage(data_file)
+        assert QueueManager(reader).config.max_retries == 3
+        writer.set_config("max_retries", 5)
+        assert reader.get_config("max_retries") == 5
+        assert reader.get_all_config() == {"max_retries": 5}
+        # Neither instance had to load the jobs
+        assert reader._journal_id is None and writer._journal_id is None
+
+        # Config kept in the snapshot and journal by older versions moves over
+        legacy = os.path.join(tmp, "legacy.json")
+        with open(legacy, "w") as f:
+            json.dump({"jobs": {}, "config": {"base_delay": 4}}, f)
+        with open(legacy + ".journal", "w") as f:
+            f.write(json.dumps({"op": "config", "key": "prefetch", "value": 8}) + "\n")
+        storage = Storage(legacy)
+        assert storage.get_all_config() == {"base_delay": 4, "prefetch": 8}
+        assert os.path.exists(legacy + ".config")
+
+def test_priority_scheduling():
+    """Higher priorities are claimed more often without starving low ones"""
+    from job import JobState
+    from queue_manager import QueueManager
+    from sqlite_storage import SQLiteStorage
+    from storage import Storage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (Storage(os.path.join(tmp, "jobs.json")),
+                        SQLiteStorage(os.path.join(tmp, "jobs.db"))):
+            manager = QueueManager(storage)
+            backfill = manager.enqueue_many([{"command": "echo backfill"}] * 30)
+            urgent = manager.enqueue_many([{"command": "echo urgent", "priority": 9}] * 30)
+            assert backfill == (30, []) and urgent == (30, [])
+            try:
+                manager.enqueue("echo nope", priority=10)
+                assert False, "priority 10 should be rejected"
+            except ValueError:
+                pass
+
+            claimed = [storage.claim_next_job() for _ in range(22)]
+            assert claimed[0].priority == 9
+            # Weights 10:1, so 2 of every 22 picks go to the backfill
+            assert sum(job.priority == 0 for job in claimed) == 2
+            assert storage.count_by_priority(JobState.PENDING) == {0: 28, 9: 10}
+            storage.delete_job(claimed[0].id)
+            stats = QueueManager(type(storage)(storage.data_file)).get_stats()
+            assert stats["pending_by_priority"] == {0: 28, 9: 10}
+            assert stats["processing"] == 21
+
+def test_named_queues():
+    """Each named queue has its own partition and a worker can serve several"""
+    import json
+    from queue_manager import QueueSet, open_queues
+    from storage import list_queues, partition_path
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend, name in (("json", "jobs.json"), ("sqlite", "jobs.db")):
+            data_file = os.path.join(tmp, name)
+            default, emails, reports = open_queues(["default", "emails", "reports"],
+                                                   data_file, backend)
+            default.storage.set_config("max_retries", 5)
+            assert emails.config.max_retries == 5
+            assert emails.enqueue("echo mail").queue == "emails"
+            reports.enqueue("echo report")
+            reports.enqueue("echo report 2")
+            assert os.path.exists(partition_path(data_file, "emails"))
+            assert list_queues(data_file) == ["default", "emails", "reports"]
+            assert default.get_stats()["total_jobs"] == 0
+            try:
+                partition_path(data_file, "../escape")
+                assert False, "queue names must not leave the partition directory"
+            except ValueError:
+                pass
+
+            workers = QueueSet([emails, reports])
+            claimed = workers.claim_jobs("w1", limit=2)
+            assert sorted(job.queue for job in claimed) == ["emails", "reports"]
+            for job in claimed:
+                assert workers.complete_job(job)
+            assert emails.get_stats()["completed"] == 1
+            assert reports.get_stats()["completed"] == 1
+            assert reports.get_stats()["pending"] == 1
+            reopened, = open_queues(["reports"], data_file, backend)
+            assert reopened.get_stats()["completed"] == 1
+
+        # Read-only commands reject unknown queues instead of creating them
+        import sys
+        main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+        env = dict(os.environ, JOBQUEUE_DATA_FILE=os.path.join(tmp, "jobs.json"))
+        for args in (["list"], ["status"], ["dlq", "list"], ["archive", "query"]):
+            result = subprocess.run([sys.executable, main, *args, "--queue", "typo"], env=env,
+                                    cwd=tmp, capture_output=True, text=True, timeout=60)
+            assert result.returncode != 0 and "Unknown queue: typo" in result.stderr
+        assert list_queues(os.path.join(tmp, "jobs.json")) == ["default", "emails", "reports"]
+
+        # Without --queue, read-only commands cover every queue
+        def run(*args):
+            result = subprocess.run([sys.executable, main, *args], env=env, cwd=tmp,
+                                    capture_output=True, text=True, timeout=60)
+            assert result.returncode == 0, result.stderr
+            return result
+        listed = [json.loads(line) for line in run("list", "--format", "jsonl").stdout.splitlines()]
+        assert sorted(job["queue"] for job in listed) == ["emails", "reports", "reports"]
+        first_page = run("list", "--format", "jsonl", "--limit", "2")
+        assert len(first_page.stdout.splitlines()) == 2 and "Next page" in first_page.stderr
+        pending = [job for job in listed if job["state"] == "pending"][0]
+        assert json.loads(run("inspect", pending["id"]).stdout)["queue"] == "reports"
+        bad_time = subprocess.run([sys.executable, main, "archive", "query", "--since", "nope"],
+                                  env=env, cwd=tmp, capture_output=True, text=True, timeout=60)
+        assert bad_time.returncode == 2 and "--since" in bad_time.stderr
+
+def test_bench_report():
+    """The benchmark drains its synthetic queue and reports comparable numbers"""
+    import json
+    from bench import percentile, run_benchmark
+
+    assert percentile([5, 1, 4, 2, 3], 50) == 3
+    assert percentile([5, 1, 4, 2, 3], 99) == 5
+    assert percentile([], 50) is None
+    for backend in ("json", "sqlite"):
+        result = run_benchmark(backend, 40, workers=2, latency_samples=3)
+        assert result["backend"] == backend and result["jobs"] == 40
+        assert result["workload"] == "noop"
+        assert result["enqueue_per_sec"] > 0 and result["claims_per_sec"] > 0
+        latency = result["pickup_latency_ms"]
+        assert 0 <= latency["p50"] <= latency["p95"] <= latency["p99"]
+        json.dumps(result)
+    result = run_benchmark("json", 3, command="true", latency_samples=1)
+    assert result["workload"] == "true" and result["jobs"] == 3
+
+def test_metrics_export():
+    """Processes publish metrics that merge into one Prometheus text report"""
+    import threading
+    import urllib.request
+    import metrics
+    from filelock import FileLock
+    from queue_manager import QueueManager, metrics_text
+    from storage import Storage
+
+    metrics.reset()
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, "jobs.json")
+        directory = data_file + ".metrics"
+        manager = QueueManager(Storage(data_file))
+        manager.enqueue_many([{"command": "true"}] * 3)
+        for job in manager.claim_jobs("w1", limit=2):
+            manager.complete_job(job)
+
+        # A contended lock is observed, the uncontended path is not
+        lock = metrics.TimedLock(threading.Lock(), "test")
+        lock.acquire()
+        threading.Timer(0.05, lock.release).start()
+        with lock:
+            pass
+        series = metrics.LOCK_WAIT_SECONDS.snapshot()["series"]
+        waits = {tuple(labels): value for labels, value in series}[("test",)]
+        assert sum(waits[:-1]) == 1 and waits[-1] >= 0.04
+
+        held = FileLock(os.path.join(tmp, "lock"))
+        with held:
+            assert not FileLock(held.path).acquire(blocking=False)
+
+        metrics.flush(directory)
+        assert os.path.exists(os.path.join(directory, f"{os.getpid()}.json"))
+        metrics.retire(directory)
+        assert os.listdir(directory) == [metrics.RETIRED]
+        manager.enqueue("true")
+        metrics.flush(directory)
+
+        text = metrics_text(data_file, "json")
+        assert "jobqueue_jobs_enqueued_total 4" in text
+        assert 'jobqueue_job_transitions_total{state="completed"} 2' in text
+        assert 'jobqueue_jobs{queue="default",state="pending"} 2' in text
+        assert "# TYPE jobqueue_storage_seconds histogram" in text
+        lines = dict(line.rsplit(" ", 1) for line in text.splitlines() if line[0] != "#")
+        assert lines['jobqueue_storage_seconds_bucket{op="write",le="+Inf"}'] == \
+            lines['jobqueue_storage_seconds_count{op="write"}']
+        assert float(lines['jobqueue_lock_wait_seconds_sum{lock="test"}']) >= 0.04
+
+        server = metrics.serve(0, lambda: metrics_text(data_file, "json"))
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+            with urllib.request.urlopen(url) as response:
+                assert "jobqueue_jobs_enqueued_total 4" in response.read().decode()
+        finally:
+            server.shutdown()
+            server.server_close()
+        metrics.reset()
+
+def test_hooks_and_profiling():
+    """Hooks see storage, claim and transition events; the sampler dumps stacks"""
+    import threading
+    import hooks
+    from profiling import StackSampler
+    from queue_manager import QueueManager
+    from storage import Storage
+
+    events = []
+    removers = [hooks.add_hook(event, after=lambda event, info, seconds, error:
+                               events.append((event, info.get("op") or info.get("state"))))
+                for event in ("storage", "claim", "transition")]
+
+    def broken(event, info):
+        raise RuntimeError("tracer bug")
+    removers.append(hooks.add_hook("claim", before=broken))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = QueueManager(Storage(os.path.join(tmp, "jobs.json")))
+        manager.enqueue("true")
+        job = manager.get_next_pending_job("w1")
+        assert job is not None
+        assert manager.complete_job(job)
+        assert ("storage", "save_claimed_job") in events
+        assert ("claim", None) in events
+        assert ("transition", "completed") in events
+
+        for remove in removers:
+            remove()
+        events.clear()
+        manager.enqueue("true")
+        assert manager.get_next_pending_job("w1") is not None
+        assert events == []
+
+        try:
+            hooks.add_hook("nope")
+            assert False, "unknown event accepted"
+        except ValueError:
+            pass
+
+        def busy_loop(stop):
+            while not stop.is_set():
+                sum(range(1000))
+        stop = threading.Event()
+        busy = threading.Thread(target=busy_loop, args=(stop,), name="busy-worker")
+        path = os.path.join(tmp, "profiles", "1.folded")
+        sampler = StackSampler(path, interval=0.001)
+        busy.start()
+        sampler.start()
+        time.sleep(0.2)
+        sampler.stop()
+        stop.set()
+        busy.join()
+        with open(path) as f:
+            lines = f.read().splitlines()
+        assert any(line.startswith("busy-worker;") and "busy_loop" in line for line in lines)
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+def test_idempotency_keys():
+    """A live idempotency key returns the existing job instead of enqueueing again"""
+    from queue_manager import QueueManager
+    from sqlite_storage import SQLiteStorage
+    from storage import Storage
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in (Storage(os.path.join(tmp, "jobs.json")),
+                        SQLiteStorage(os.path.join(tmp, "jobs.db"))):
+            manager = QueueManager(storage)
+            first = manager.enqueue_spec({"command": "echo once", "idempotency_key": "order-1"})
+            again = manager.enqueue_spec({"command": "echo once", "idempotency_key": "order-1"})
+            assert again.id == first.id
+            assert manager.enqueue("echo once", idempotency_key="order-2").id != first.id
+            assert manager.enqueue_deduplicated("echo once", idempotency_key="order-2")[1]
+            assert not manager.enqueue_deduplicated("echo once")[1]
+
+            # Duplicates within one batch and against stored jobs
+            count, errors = manager.enqueue_many([
+                {"command": "echo batch", "idempotency_key": "order-3"},
+                {"command": "echo batch", "idempotency_key": "order-3"},
+                {"command": "echo batch", "idempotency_key": "order-1"},
+                {"command": "echo plain"},
+                {"command": "echo bad", "idempotency_key": ""},
+            ])
+            assert count == 2 and [position for position, _ in errors] == [5]
+            assert storage.count_by_state() == {"pending": 5}
+
+            # Finished jobs keep their key until it expires
+            job = manager.get_next_pending_job("w1")
+            assert job.id == first.id
+            manager.complete_job(job)
+            assert manager.enqueue("echo once", idempotency_key="order-1").id == first.id
+
+            # A fresh store sees keys written by another instance
+            reopened = QueueManager(type(storage)(storage.data_file))
+            assert reopened.enqueue("echo once", idempotency_key="order-1").id == first.id
+
+            manager.config.set("idempotency_ttl", 0)
+            expired = manager.enqueue("echo once", idempotency_key="order-1")
+            assert expired.id != first.id
+            manager.config.set("idempotency_ttl", 3600)
+            assert manager.enqueue("echo once", idempotency_key="order-1").id == expired.id
+
+            # Deleting (or archiving) the job frees its key
+            second = manager.enqueue("echo twice", idempotency_key="order-2")
+            storage.delete_job(second.id)
+            assert manager.enqueue("echo twice", idempotency_key="order-2").id != second.id
+
+        import sys
+        main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+        env = dict(os.environ, JOBQUEUE_DATA_FILE=os.path.join(tmp, "cli.json"))
+        def enqueue(key):
+            return subprocess.run([sys.executable, main, "enqueue", "echo cli",
+                                   "--idempotency-key", key], env=env, cwd=tmp,
+                                  capture_output=True, text=True, timeout=60)
+        assert "Enqueued job" in enqueue("cli-1").stdout
+        assert "already enqueued" in enqueue("cli-1").stdout
+        too_long = enqueue("k" * 256)
+        assert too_long.returncode == 2 and "--idempotency-key" in too_long.stderr
+
 def quick_demo():
     """Run a quick demo showing the system workflow"""
     print("\n🚀 Running Quick Demo")
     print("=" * 50)
     
     # Clean start
-    if os.path.exists("jobqueue_data.json"):
-        os.remove("jobqueue_data.json")
+    clean_data()
     
     print("Step 1: Enqueuing different types of jobs...")
     
@@ -171,4 +1178,4 @@ if __name__ == '__main__':
     print("  python main.py enqueue \"echo 'Hello World'\"")
     print("  python main.py enqueue_json '{\"command\": \"sleep 2\"}'")
     print("  python main.py status")
-    print("  python main.py start --count 2")
\ No newline at end of file
+    print("  python main.py start --count 2")
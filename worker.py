@@ -1,18 +1,45 @@
+import asyncio
+import collections
+import os
+import select
+import socket
 import subprocess
 import threading
 import time
 import signal
 import sys
+from datetime import datetime
+from typing import Optional
 from queue_manager import QueueManager
 from job import Job
+from joblog import JobLog
+from hooks import span
+from accounting import ResourceSampler, async_wait_with_rusage, wait_with_rusage
+from metrics import EXECUTION_SECONDS, QUEUE_WAIT_SECONDS
+
+# Extra lease time beyond a job's timeout, to record its outcome
+LEASE_GRACE_SECONDS = 30
+
+def _kill_group(proc):
+    """Kill a job's whole process group, grandchildren included"""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
 
 class Worker:
-    def __init__(self, queue_manager: QueueManager, worker_id: int):
+    def __init__(self, queue_manager: QueueManager, worker_id: int, prefetch: int = 1):
         self.queue_manager = queue_manager
         self.worker_id = worker_id
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{worker_id}"
+        # A worker that claims nothing per trip would never run a job
+        self.prefetch = max(1, prefetch)
+        self.buffer = collections.deque()
         self.running = False
         self.thread = None
         self.current_job = None
+        self.processes = set()
+        self.sample_interval = queue_manager.config.sample_interval
     
     def start(self):
         """Start the worker"""
@@ -21,49 +48,97 @@ class Worker:
         self.thread.start()
         self.queue_manager.active_workers += 1
     
-    def stop(self):
-        """Stop the worker gracefully"""
+    def stop(self, timeout: float = 5):
+        """Stop the worker gracefully, waiting up to timeout for its current job"""
         self.running = False
+        self.queue_manager.wakeup.wake_all()
         if self.thread:
-            self.thread.join(timeout=5)
+            # A thread on its way into wait_for_work misses a single wake_all
+            deadline = time.time() + timeout
+            while self.thread.is_alive() and time.time() < deadline:
+                self.queue_manager.wakeup.wake_all()
+                self.thread.join(min(0.05, max(0, deadline - time.time())))
+        # Whatever is still running would outlive us in its own session
+        for proc in list(self.processes):
+            print(f"Worker {self.worker_id}: Killing process group {proc.pid} of unfinished job")
+            _kill_group(proc)
+        # The thread may still be busy with a job; don't hold its buffer hostage
+        self._release_buffer()
         self.queue_manager.active_workers -= 1
     
     def _run(self):
         """Main worker loop"""
         while self.running:
-            job = self.queue_manager.get_next_pending_job()
+            job = self._next_job()
             if job:
                 self.current_job = job
                 self._process_job(job)
                 self.current_job = None
             else:
-                # No jobs available, sleep briefly
-                time.sleep(1)
+                # No jobs available, sleep until one is enqueued or due
+                self.queue_manager.wait_for_work()
+        self._release_buffer()
+    
+    def _next_job(self):
+        """Take the next job from the local buffer, refilling it in one claim"""
+        if not self.buffer:
+            self.buffer.extend(self.queue_manager.claim_jobs(self.owner, self.prefetch))
+        while self.buffer:
+            job = self.buffer.popleft()
+            if not job.lease_expired():
+                return job
+            # Lease ran out while buffered; another worker may have the job now
+            print(f"Worker {self.worker_id}: Lease on buffered job {job.id} expired, skipping")
+        return None
+    
+    def _release_buffer(self):
+        """Hand prefetched jobs that never started back to the queue"""
+        jobs = []
+        while True:
+            try:
+                jobs.append(self.buffer.popleft())
+            except IndexError:
+                break
+        if jobs:
+            released = self.queue_manager.release_jobs(jobs, self.owner)
+            print(f"Worker {self.worker_id}: Released {released} prefetched job(s)")
+    
+    def _prepare(self, job: Job) -> Optional[float]:
+        """Work out a job's timeout and hold its lease for that long.
+
+        Returns None if the lease was lost and the job must not run.
+        """
+        # From when the job became due (not when it was created) to its claim
+        due = max(job.created_ts, job.run_ts or 0.0)
+        QUEUE_WAIT_SECONDS.observe(max(0.0, job.updated_ts - due))
+        timeout = self.queue_manager.job_timeout(job)
+        if not self.queue_manager.hold_lease(job, timeout + LEASE_GRACE_SECONDS):
+            print(f"Worker {self.worker_id}: Lease on job {job.id} lost before start, skipping")
+            return None
+        return timeout
+    
+    def _spawn(self, job: Job) -> subprocess.Popen:
+        """Start a job's command as the leader of a new process group"""
+        proc = subprocess.Popen(
+            job.command,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+        self.processes.add(proc)
+        return proc
     
     def _process_job(self, job: Job):
         """Process a single job"""
         try:
-            # Execute the command
-            result = subprocess.run(
-                job.command,
-                shell=True,
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minute timeout
-            )
-            
-            if result.returncode == 0:
-                print(f"Worker {self.worker_id}: Job {job.id} completed successfully")
-                self.queue_manager.complete_job(job)
-            else:
-                print(f"Worker {self.worker_id}: Job {job.id} failed with exit code {result.returncode}")
-                print(f"Stderr: {result.stderr}")
-                self.queue_manager.fail_job(job)
-                
-                # If not dead, schedule retry with backoff
-                if job.state.value != "dead":
-                    backoff_delay = job.calculate_backoff()
-                    print(f"Worker {self.worker_id}: Scheduling retry in {backoff_delay} seconds")
+            with span("execute", job=job, worker=self.worker_id):
+                timeout = self._prepare(job)
+                if timeout is None:
+                    return
+                with self.queue_manager.open_job_log(job) as log:
+                    returncode = self._run_command(job, log, timeout)
+                self._handle_result(job, returncode)
                 
         except subprocess.TimeoutExpired:
             print(f"Worker {self.worker_id}: Job {job.id} timed out")
@@ -71,10 +146,186 @@ class Worker:
         except Exception as e:
             print(f"Worker {self.worker_id}: Job {job.id} failed with exception: {e}")
             self.queue_manager.fail_job(job)
+    
+    def _run_command(self, job: Job, log: JobLog, timeout: float) -> int:
+        """Run the job's command, streaming its output into log"""
+        log.mark(f"attempt {job.attempts + 1} started at {datetime.utcnow().isoformat()}Z")
+        queue_wait = job.queue_wait()
+        proc = self._spawn(job)
+        sampler = ResourceSampler(proc.pid, self.sample_interval)
+        deadline = time.monotonic() + timeout
+        try:
+            fd = proc.stdout.fileno()
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise subprocess.TimeoutExpired(job.command, timeout)
+                if sampler.due():
+                    sampler.sample()
+                if select.select([fd], [], [], min(remaining, sampler.interval))[0]:
+                    chunk = os.read(fd, 65536)
+                    if not chunk:
+                        break
+                    log.write(chunk)
+            try:
+                sampler.apply_rusage(wait_with_rusage(proc, deadline))
+            except TimeoutError:
+                raise subprocess.TimeoutExpired(job.command, timeout)
+            return proc.returncode
+        except subprocess.TimeoutExpired:
+            _kill_group(proc)
+            proc.wait()
+            log.mark(f"timed out after {timeout:g}s, process group killed")
+            raise
+        finally:
+            self.processes.discard(proc)
+            proc.stdout.close()
+            job.output_tail = log.tail()
+            job.resources = sampler.result(queue_wait)
+            EXECUTION_SECONDS.observe(job.resources["wall_time"])
+    
+    def _handle_result(self, job: Job, returncode: int):
+        """Record a finished job as completed or failed"""
+        if returncode == 0:
+            print(f"Worker {self.worker_id}: Job {job.id} completed successfully")
+            if not self.queue_manager.complete_job(job):
+                print(f"Worker {self.worker_id}: Lease on job {job.id} expired, result discarded")
+        else:
+            print(f"Worker {self.worker_id}: Job {job.id} failed with exit code {returncode}")
+            print(f"Output tail: {job.output_tail}")
+            if not self.queue_manager.fail_job(job):
+                print(f"Worker {self.worker_id}: Lease on job {job.id} expired, result discarded")
+                return
+            
+            # fail_job stored the retry time if the job is not dead
+            if job.state.value != "dead":
+                backoff_delay = job.run_ts - time.time()
+                print(f"Worker {self.worker_id}: Scheduling retry in {backoff_delay:.1f} seconds")
+
+class AsyncWorker(Worker):
+    """Worker that runs many jobs at once on a single asyncio event loop.
+
+    Output is read through the event loop and each job's exit is awaited
+    with ``async_wait_with_rusage``, so exact CPU totals are recorded as
+    with the thread executor; a semaphore caps jobs at ``concurrency`` in
+    flight. Claims refill the local buffer with as many jobs as there are
+    free slots, and blocking storage calls run in the loop's default thread
+    pool so they never stall running jobs.
+    """
+
+    def __init__(self, queue_manager: QueueManager, worker_id: int,
+                 concurrency: int = 100, prefetch: int = 1):
+        super().__init__(queue_manager, worker_id, prefetch)
+        self.concurrency = concurrency
+        self.in_flight = 0
+    
+    def _run(self):
+        """Main worker loop"""
+        asyncio.run(self._main())
+    
+    async def _main(self):
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        while self.running:
+            await slots.acquire()
+            if not self.running:
+                slots.release()
+                break
+            job = await loop.run_in_executor(None, self._next_job)
+            if job is None:
+                slots.release()
+                # No jobs available, sleep until one is enqueued or due
+                await loop.run_in_executor(None, self.queue_manager.wait_for_work)
+                continue
+            task = asyncio.create_task(self._execute(job, slots))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        self._release_buffer()
+    
+    def _next_job(self):
+        """Take the next job from the buffer, claiming one per free slot"""
+        if not self.buffer:
+            free = self.concurrency - self.in_flight
+            # The first ``free`` jobs start at once, so they share one lease length
+            self.buffer.extend(
+                self.queue_manager.claim_jobs(self.owner, max(self.prefetch, free), free))
+        return super()._next_job()
+    
+    async def _execute(self, job: Job, slots: asyncio.Semaphore):
+        """Run one job's command and record its outcome"""
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        try:
+            with span("execute", job=job, worker=self.worker_id):
+                timeout = await loop.run_in_executor(None, self._prepare, job)
+                if timeout is None:
+                    return
+                with self.queue_manager.open_job_log(job) as log:
+                    log.mark(f"attempt {job.attempts + 1} started at "
+                             f"{datetime.utcnow().isoformat()}Z")
+                    queue_wait = job.queue_wait()
+                    proc = self._spawn(job)
+                    reader = asyncio.StreamReader(limit=65536)
+                    transport, _ = await loop.connect_read_pipe(
+                        lambda: asyncio.StreamReaderProtocol(reader), proc.stdout)
+                    sampler = ResourceSampler(proc.pid, self.sample_interval)
+                    sampling = asyncio.create_task(self._sample(sampler))
+                    try:
+                        returncode = await asyncio.wait_for(
+                            self._stream_output(proc, reader, log, sampler), timeout)
+                    except asyncio.TimeoutError:
+                        _kill_group(proc)
+                        await async_wait_with_rusage(proc)
+                        log.mark(f"timed out after {timeout:g}s, process group killed")
+                        job.output_tail = log.tail()
+                        print(f"Worker {self.worker_id}: Job {job.id} timed out")
+                        await loop.run_in_executor(None, self.queue_manager.fail_job, job)
+                        return
+                    finally:
+                        self.processes.discard(proc)
+                        sampling.cancel()
+                        transport.close()
+                        job.resources = sampler.result(queue_wait)
+                        EXECUTION_SECONDS.observe(job.resources["wall_time"])
+                    job.output_tail = log.tail()
+                await loop.run_in_executor(None, self._handle_result, job, returncode)
+        except Exception as e:
+            print(f"Worker {self.worker_id}: Job {job.id} failed with exception: {e}")
+            await loop.run_in_executor(None, self.queue_manager.fail_job, job)
+        finally:
+            self.in_flight -= 1
+            slots.release()
+    
+    async def _sample(self, sampler: ResourceSampler):
+        """Sample a running job's process tree until cancelled"""
+        while True:
+            sampler.sample()
+            await asyncio.sleep(sampler.interval)
+    
+    async def _stream_output(self, proc, reader: asyncio.StreamReader, log: JobLog,
+                             sampler: ResourceSampler) -> int:
+        """Copy a process's output into log chunk by chunk, then reap it"""
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            log.write(chunk)
+        sampler.apply_rusage(await async_wait_with_rusage(proc))
+        return proc.returncode
+
+EXECUTORS = ("thread", "async")
 
 class WorkerManager:
-    def __init__(self, queue_manager: QueueManager):
+    def __init__(self, queue_manager: QueueManager, executor: str = "thread",
+                 drain_timeout: float = 5):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor: {executor}")
         self.queue_manager = queue_manager
+        self.executor = executor
+        self.drain_timeout = drain_timeout
         self.workers = []
         self.shutdown_flag = False
         
@@ -89,10 +340,22 @@ class WorkerManager:
         self.stop_all_workers()
         sys.exit(0)
     
-    def start_workers(self, count: int = 1):
-        """Start multiple workers"""
+    def start_workers(self, count: int = 1, prefetch: int = None):
+        """Start multiple workers.
+
+        With the async executor ``count`` is the number of jobs run
+        concurrently by a single event-loop worker.
+        """
+        if prefetch is None:
+            prefetch = self.queue_manager.config.prefetch
+        if self.executor == "async":
+            worker = AsyncWorker(self.queue_manager, len(self.workers) + 1, count, prefetch)
+            worker.start()
+            self.workers.append(worker)
+            print(f"Started async worker {worker.worker_id} (concurrency {count})")
+            return
         for i in range(count):
-            worker = Worker(self.queue_manager, len(self.workers) + 1)
+            worker = Worker(self.queue_manager, len(self.workers) + 1, prefetch)
             worker.start()
             self.workers.append(worker)
             print(f"Started worker {worker.worker_id}")
@@ -101,7 +364,10 @@ class WorkerManager:
         """Stop all workers gracefully"""
         print("Stopping all workers...")
         for worker in self.workers:
-            worker.stop()
+            worker.running = False
+        deadline = time.time() + self.drain_timeout
+        for worker in self.workers:
+            worker.stop(max(0, deadline - time.time()))
         self.workers.clear()
         print("All workers stopped")
     